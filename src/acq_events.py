@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the events that are sent from acquisition threads to
+   the GUI (main window, stub OV dialog) and the EventBus that transports
+   them. Events are collected in a list and the GUI is triggered only once
+   per batch: A new signal is emitted only after the GUI has started to
+   process the previous batch. Repeated events that only refresh the
+   display (redraw, progress, stage position...) are processed once per
+   batch.
+"""
+
+import threading
+
+from enum import Enum
+
+
+class Event(Enum):
+    LOG = 1                     # data: formatted log entry
+    VP_LOG = 2                  # data: entry for the incident log
+    OV_SUCCESS = 3
+    OV_FAILURE = 4
+    STUB_OV_SUCCESS = 5
+    STUB_OV_FAILURE = 6
+    STUB_OV_ABORT = 7
+    STUB_OV_BUSY = 8
+    STUB_OV_PREVIEW = 9         # data: file name of stub OV mosaic
+    APPROACH_BUSY = 10
+    STATUS_IDLE = 11
+    SWEEP_SUCCESS = 12
+    SWEEP_FAILURE = 13
+    MOVE_SUCCESS = 14
+    MOVE_FAILURE = 15
+    FOCUS_ALERT = 16
+    MAG_ALERT = 17
+    UPDATE_XY = 18
+    UPDATE_Z = 19
+    UPDATE_STAGEPOS = 20
+    UPDATE_PROGRESS = 21        # data: percentage (stub OV) or None
+    ASK_DEBRIS_FIRST_OV = 22
+    ASK_DEBRIS_CONFIRMATION = 23
+    REMOTE_STOP = 24
+    ERROR_PAUSE = 25
+    COMPLETION_STOP = 26
+    ACQ_NOT_IN_PROGRESS = 27
+    SAVE_CFG = 28
+    ACQ_IND_OV = 29             # data: OV number
+    ACQ_IND_TILE = 30           # data: (grid number, tile number)
+    RESTRICT_GUI = 31
+    RESTRICT_VP_GUI = 32
+    UNRESTRICT_GUI = 33
+    SHOW_MSG = 34               # data: message text
+    MV_UPDATE_OV = 35           # data: OV number
+    GRAB_VP_SCREENSHOT = 36     # data: file name
+    RELOAD_IMPORTED = 37        # data: number of imported image
+    DRAW_MV = 38
+
+
+# Only the last event of these types in a batch is processed:
+LATEST_ONLY = {Event.UPDATE_XY, Event.UPDATE_Z, Event.UPDATE_STAGEPOS,
+               Event.UPDATE_PROGRESS, Event.STUB_OV_PREVIEW, Event.DRAW_MV,
+               Event.SAVE_CFG}
+# Only the last event of these types with the same data is processed:
+LATEST_PER_ITEM = {Event.MV_UPDATE_OV, Event.RELOAD_IMPORTED}
+
+
+def coalesce(batch):
+    """Remove repeated events from batch (list of (event, data)). The
+       remaining events keep the position of their last occurrence.
+    """
+    last = {}
+    for i, (event, data) in enumerate(batch):
+        if event in LATEST_ONLY:
+            last[event] = i
+        elif event in LATEST_PER_ITEM:
+            last[(event, data)] = i
+    if not last:
+        return batch
+    result = []
+    for i, (event, data) in enumerate(batch):
+        if event in LATEST_ONLY:
+            if last[event] != i:
+                continue
+        elif event in LATEST_PER_ITEM:
+            if last[(event, data)] != i:
+                continue
+        result.append((event, data))
+    return result
+
+
+class EventBus(object):
+
+    def __init__(self, trigger):
+        # trigger.s is connected to the function that processes the events
+        # in the GUI thread:
+        self.trigger = trigger
+        self.events = []
+        # True if a signal has been emitted and the GUI has not yet taken
+        # the events:
+        self.signal_pending = False
+        self.lock = threading.Lock()
+
+    def put(self, event, data=None):
+        """Send event to the GUI. Can be called from any thread."""
+        with self.lock:
+            self.events.append((event, data))
+            emit = not self.signal_pending
+            self.signal_pending = True
+        if emit:
+            self.trigger.s.emit()
+
+    def get_batch(self):
+        """Return all events sent since the last call (in the order in
+           which they were sent, repeated display updates removed). Must be
+           called from the GUI thread.
+        """
+        with self.lock:
+            batch, self.events = self.events, []
+            self.signal_pending = False
+        return coalesce(batch)
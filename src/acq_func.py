@@ -18,14 +18,16 @@
 import os
 import datetime
 from time import sleep
-from PIL import Image
 
+from acq_events import Event
+from image_io import read_image
+from stub_mosaic import StubMosaic, get_canvas_file_name, get_level_file_name
 
-def acquire_ov(base_dir, selection, sem, microtome, ovm, cs, queue, trigger):
+
+def acquire_ov(base_dir, selection, sem, microtome, ovm, cs, events):
     # Update current xy position:
     microtome.get_stage_xy(wait_interval=1)
-    queue.put('UPDATE XY')
-    trigger.s.emit()
+    events.put(Event.UPDATE_XY)
     success = True
     if selection == -1: # acquire all OVs
         start, end = 0, ovm.get_number_ov()
@@ -41,8 +43,7 @@ def acquire_ov(base_dir, selection, sem, microtome, ovm, cs, queue, trigger):
             microtome.reset_error_state()
         if success:
             # update stage position in GUI:
-            queue.put('UPDATE XY')
-            trigger.s.emit()
+            events.put(Event.UPDATE_XY)
             # Set specified OV frame settings:
             sem.apply_frame_settings(ovm.get_ov_size_selector(i),
                                      ovm.get_ov_pixel_size(i),
@@ -54,14 +55,12 @@ def acquire_ov(base_dir, selection, sem, microtome, ovm, cs, queue, trigger):
         if not success:
             break # leave loop if error has occured
     if success:
-        queue.put('OV SUCCESS')
-        trigger.s.emit()
+        events.put(Event.OV_SUCCESS)
     else:
-        queue.put('OV FAILURE')
-        trigger.s.emit()
+        events.put(Event.OV_FAILURE)
 
 def acquire_stub_ov(base_dir, slice_counter, sem, microtome, pos, size_selector,
-                    ovm, cs, queue, trigger, abort_queue):
+                    ovm, cs, events, abort_queue):
     """Acquire a large overview image of user-defined size that can cover
        the entire stub.
     """
@@ -69,8 +68,7 @@ def acquire_stub_ov(base_dir, slice_counter, sem, microtome, pos, size_selector,
     aborted = False
     # Update current xy position:
     microtome.get_stage_xy(wait_interval=1)
-    queue.put('UPDATE STAGEPOS')
-    trigger.s.emit()
+    events.put(Event.UPDATE_STAGEPOS)
     # Make sure DM script uses the correct motor speed calibration
     # (This information is lost when script crashes.)
     success = microtome.write_motor_speed_calibration_to_script()
@@ -79,7 +77,20 @@ def acquire_stub_ov(base_dir, slice_counter, sem, microtome, pos, size_selector,
         ovm.set_stub_ov_size_selector(size_selector)
         cs.set_stub_ov_centre_s(pos)
         width, height = ovm.get_stub_ov_full_size()
-        full_stub_mosaic = Image.new('L', (width, height))
+        if not os.path.exists(base_dir + '\\overviews\\stub'):
+            os.makedirs(base_dir + '\\overviews\\stub')
+        base_dir_name = base_dir[base_dir.rfind('\\') + 1:].translate(
+                            {ord(c): None for c in ' '})
+        timestamp = str(datetime.datetime.now())
+        # Remove some characters from timestap to get valid file name:
+        timestamp = timestamp[:19].translate({ord(c): None for c in ' :-.'})
+        stub_mosaic_file_name = (base_dir + '\\overviews\\stub\\'
+                                 + base_dir_name + '_stubOV_'
+                                 + 's' + str(slice_counter).zfill(5)
+                                 + '_' + timestamp + '.png')
+        # The mosaic is written frame by frame into memory-mapped canvases:
+        full_stub_mosaic = StubMosaic(
+            base_dir, stub_mosaic_file_name, width, height)
         # Calculate origin coordinates:
         start_dx = ((-width/2 + ovm.STUB_OV_FRAME_WIDTH/2)
                     * ovm.STUB_OV_PIXEL_SIZE / 1000)
@@ -102,8 +113,7 @@ def acquire_stub_ov(base_dir, slice_counter, sem, microtome, pos, size_selector,
         for (col, row, target_x, target_y) in stub_ov_grid:
             if not abort_queue.empty():
                 if abort_queue.get() == 'ABORT':
-                    queue.put('STUB OV ABORT')
-                    trigger.s.emit()
+                    events.put(Event.STUB_OV_ABORT)
                     success = False
                     aborted = True
                     break
@@ -116,49 +126,52 @@ def acquire_stub_ov(base_dir, slice_counter, sem, microtome, pos, size_selector,
                 microtome.reset_error_state()
             else:
                 # Show new stage coordinates in main control window:
-                queue.put('UPDATE STAGEPOS')
-                trigger.s.emit()
+                events.put(Event.UPDATE_STAGEPOS)
                 save_path = (base_dir + '\\workspace\\stub'
                             + str(col) + str(row) + '.bmp')
                 success = sem.acquire_frame(save_path)
                 if success:
-                    current_tile = Image.open(save_path)
+                    current_tile = read_image(save_path, as_uint8=True)
                     position = (
                          col * (ovm.STUB_OV_FRAME_WIDTH - ovm.STUB_OV_OVERLAP),
                          row * (ovm.STUB_OV_FRAME_HEIGHT - ovm.STUB_OV_OVERLAP))
-                    full_stub_mosaic.paste(current_tile, position)
+                    full_stub_mosaic.add_frame(current_tile, *position)
+                    # Save low-resolution preview and show it in viewport:
+                    full_stub_mosaic.save_preview()
+                    events.put(Event.STUB_OV_PREVIEW, stub_mosaic_file_name)
                     image_counter += 1
                     percentage_done = int(image_counter / image_number * 100)
-                    queue.put('UPDATE PROGRESS' + str(percentage_done))
-                    trigger.s.emit()
+                    events.put(Event.UPDATE_PROGRESS, percentage_done)
                 if not success:
                     break
 
-        # Write full mosaic to disk unless acq aborted:
+        # Write full mosaic and pyramid levels to disk unless acq aborted:
         if not aborted:
-            if not os.path.exists(base_dir + '\\overviews\\stub'):
-                os.makedirs(base_dir + '\\overviews\\stub')
-            base_dir_name = base_dir[base_dir.rfind('\\') + 1:].translate(
-                                {ord(c): None for c in ' '})
-            timestamp = str(datetime.datetime.now())
-            # Remove some characters from timestap to get valid file name:
-            timestamp = timestamp[:19].translate({ord(c): None for c in ' :-.'})
-            stub_mosaic_file_name = (base_dir + '\\overviews\\stub\\'
-                                     + base_dir_name + '_stubOV_'
-                                     + 's' + str(slice_counter).zfill(5)
-                                     + '_' + timestamp + '.png')
-            full_stub_mosaic.save(stub_mosaic_file_name)
+            full_stub_mosaic.save()
+            # The full-resolution canvas of the previous stub OV is no
+            # longer needed:
+            previous_canvas = get_canvas_file_name(
+                base_dir, ovm.get_stub_ov_file())
+            if os.path.isfile(previous_canvas):
+                try:
+                    os.remove(previous_canvas)
+                except:
+                    pass
             ovm.set_stub_ov_file(stub_mosaic_file_name)
+        else:
+            full_stub_mosaic.close()
+            preview_file_name = get_level_file_name(
+                stub_mosaic_file_name, full_stub_mosaic.get_preview_level())
+            if os.path.isfile(preview_file_name):
+                os.remove(preview_file_name)
 
     if success:
         # Signal
-        queue.put('STUB OV SUCCESS')
-        trigger.s.emit()
+        events.put(Event.STUB_OV_SUCCESS)
     elif not aborted:
-        queue.put('STUB OV FAILURE')
-        trigger.s.emit()
+        events.put(Event.STUB_OV_FAILURE)
 
-def sweep(microtome, queue, trigger):
+def sweep(microtome, events):
     success = True
     z_position = microtome.get_stage_z(wait_interval=1)
     if (z_position is not None) and (z_position >= 0):
@@ -176,27 +189,21 @@ def sweep(microtome, queue, trigger):
     else:
         success = False
     if success:
-        queue.put('SWEEP SUCCESS')
-        trigger.s.emit()
+        events.put(Event.SWEEP_SUCCESS)
     else:
-        queue.put('SWEEP FAILURE')
-        trigger.s.emit()
+        events.put(Event.SWEEP_FAILURE)
 
-def move(microtome, target_pos, queue, trigger):
+def move(microtome, target_pos, events):
     # Update current xy position:
     microtome.get_stage_xy(wait_interval=0.5)
-    queue.put('UPDATE XY')
-    trigger.s.emit()
+    events.put(Event.UPDATE_XY)
     success = True
     microtome.move_stage_to_xy(target_pos)
     if microtome.get_error_state() > 0:
         success = False
         microtome.reset_error_state()
     if success:
-        queue.put('UPDATE XY')
-        trigger.s.emit()
-        queue.put('MOVE SUCCESS')
-        trigger.s.emit()
+        events.put(Event.UPDATE_XY)
+        events.put(Event.MOVE_SUCCESS)
     else:
-        queue.put('MOVE FAILURE')
-        trigger.s.emit()
+        events.put(Event.MOVE_FAILURE)
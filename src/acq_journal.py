@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the acquisition journal, which records the progress
+   of a stack acquisition (resume state) in meta\\acq_journal.txt:
+   Each accepted tile is appended as one line ('TILE;grid;tile'). All other
+   changes (grid completed, interruption, cut) are saved as a snapshot of
+   the complete state ('STATE;{...}'), which replaces the journal
+   (compaction). Each entry is flushed and synced to disk, so that after a
+   crash at most the tile that was being acquired is lost.
+"""
+
+import os
+import json
+import threading
+
+
+JOURNAL_FILE_NAME = 'acq_journal.txt'
+
+
+class AcqJournal(object):
+
+    def __init__(self):
+        self.base_dir = None
+        self.file_name = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def open(self, base_dir):
+        """Use the journal of the stack in base_dir. Return the saved state
+           (dictionary) or None if no journal exists.
+        """
+        with self.lock:
+            self.close_file()
+            self.base_dir = base_dir
+            self.file_name = base_dir + '\\meta\\' + JOURNAL_FILE_NAME
+        return self.replay()
+
+    def replay(self):
+        """Rebuild the state from the last snapshot and the tiles acquired
+           after it.
+        """
+        if self.file_name is None or not os.path.isfile(self.file_name):
+            return None
+        state = None
+        with open(self.file_name, 'r') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    # Incomplete entry (crash while writing):
+                    break
+                entry = line.rstrip('\n').split(';', 1)
+                try:
+                    if entry[0] == 'STATE':
+                        state = json.loads(entry[1])
+                    elif entry[0] == 'TILE' and state is not None:
+                        grid_number, tile_number = entry[1].split(';')
+                        state['tiles_acquired'].append(int(tile_number))
+                except (ValueError, IndexError, KeyError):
+                    break
+        return state
+
+    def add_tile(self, grid_number, tile_number):
+        """Append an accepted tile. Constant cost per tile."""
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.file_name, 'a')
+            self.file.write('TILE;%d;%d\n' % (grid_number, tile_number))
+            self.sync(self.file)
+
+    def save_state(self, state):
+        """Replace the journal with a snapshot of state. The new journal is
+           written to a temporary file first, so that the previous journal
+           remains valid until the snapshot is complete.
+        """
+        with self.lock:
+            self.close_file()
+            tmp_file_name = self.file_name + '.tmp'
+            with open(tmp_file_name, 'w') as file:
+                file.write('STATE;' + json.dumps(state) + '\n')
+                self.sync(file)
+            os.replace(tmp_file_name, self.file_name)
+
+    def sync(self, file):
+        file.flush()
+        os.fsync(file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.close_file()
+
+    def close_file(self):
+        # Lock must be held.
+        if self.file is not None:
+            self.file.close()
+            self.file = None
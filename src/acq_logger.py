@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module writes the log files of a stack acquisition (main log,
+   image list, debris log, error log, metadata) in a background thread.
+   Entries are passed to the thread as records (file, level, text) and
+   written with normal buffering; the files are flushed when no new
+   entries have arrived for FLUSH_INTERVAL seconds and when requested.
+   A file that exceeds MAX_FILE_SIZE is continued in a new file
+   (name_part2.txt, ...). The log files can be copied to the mirror drive
+   incrementally: only the bytes appended since the last copy are
+   transferred.
+"""
+
+import os
+import threading
+
+from queue import Queue, Empty
+
+
+# Levels of log entries (same values as in the logging module):
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+# Seconds without new entries after which the files are flushed:
+FLUSH_INTERVAL = 2
+# Size (characters) at which a log file is continued in a new file:
+MAX_FILE_SIZE = 50 * 1024**2
+
+
+class LogFile(object):
+    """A log file, continued in parts when it becomes too large."""
+
+    def __init__(self, file_name):
+        self.base_name = file_name
+        self.part = 1
+        self.file_name = file_name
+        self.file = open(file_name, 'w')
+        self.size = 0
+        self.dirty = False
+        # (file name, number of bytes already mirrored) for each part:
+        self.mirror_state = [[file_name, 0]]
+
+    def write(self, text):
+        # Size is counted in characters, which is sufficient for rotation:
+        self.file.write(text)
+        self.size += len(text)
+        self.dirty = True
+
+    def next_part(self):
+        self.file.close()
+        self.part += 1
+        root, ext = os.path.splitext(self.base_name)
+        self.file_name = root + '_part' + str(self.part) + ext
+        self.file = open(self.file_name, 'w')
+        self.size = 0
+        self.mirror_state.append([self.file_name, 0])
+
+    def flush(self):
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+
+class AcqLogger(object):
+
+    def __init__(self, max_file_size=MAX_FILE_SIZE, file_level=DEBUG):
+        self.max_file_size = max_file_size
+        # Entries below this level are not written:
+        self.file_level = file_level
+        self.log_files = {}
+        self.mirror_drive = None
+        self.queue = Queue()
+        self.thread = None
+        # Number of consecutive failed attempts to mirror the log files:
+        self.mirror_failures = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def open(self, file_names, mirror_drive=None):
+        """Create the log files given in file_names (dictionary: key ->
+           file name) and start the writer thread. If mirror_drive is
+           specified, the files are mirrored to that drive (same path)
+           when mirror() is called.
+        """
+        self.close()
+        self.log_files = {key: LogFile(file_name)
+                          for key, file_name in file_names.items()}
+        self.mirror_drive = mirror_drive
+        self.mirror_failures = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def is_open(self):
+        return self.thread is not None
+
+    def write(self, key, text, level=INFO):
+        """Append text to the log file key. Can be called from any thread.
+           Entries are ignored if the log files have not been opened.
+        """
+        if self.thread is not None and level >= self.file_level:
+            self.queue.put((key, level, text))
+
+    def get_file_name(self, key):
+        """Return the name of the current part of log file key."""
+        return self.log_files[key].file_name
+
+    def get_file_names(self, key):
+        """Return the names of all parts of log file key."""
+        return [state[0] for state in self.log_files[key].mirror_state]
+
+    def mirror(self, wait=False):
+        """Copy the new entries of all log files to the mirror drive (in
+           the writer thread). If wait is True, block until the copy has
+           been made, so that get_mirror_failures() includes its result.
+        """
+        if self.thread is not None and self.mirror_drive is not None:
+            done = threading.Event() if wait else None
+            self.queue.put(('MIRROR', None, done))
+            if wait:
+                done.wait()
+
+    def flush(self):
+        """Block until all entries have been written to disk, for example
+           before the log files are attached to an e-mail.
+        """
+        if self.thread is not None:
+            done = threading.Event()
+            self.queue.put(('FLUSH', None, done))
+            done.wait()
+
+    def close(self):
+        """Write all remaining entries, mirror the files (if a mirror drive
+           is used), close the files and stop the writer thread.
+        """
+        if self.thread is not None:
+            self.queue.put(('CLOSE', None, None))
+            self.thread.join()
+            self.thread = None
+
+    def get_mirror_failures(self):
+        with self.lock:
+            return self.mirror_failures
+
+    def get_error(self):
+        """Return and clear the last write error (or None)."""
+        with self.lock:
+            error, self.error = self.error, None
+        return error
+
+    def run(self):
+        while True:
+            dirty = any(f.dirty for f in self.log_files.values())
+            try:
+                key, level, text = self.queue.get(
+                    timeout=FLUSH_INTERVAL if dirty else None)
+            except Empty:
+                self.flush_files()
+                continue
+            if key == 'MIRROR':
+                self.flush_files()
+                self.mirror_files()
+                if text is not None:
+                    text.set()
+            elif key == 'FLUSH':
+                self.flush_files()
+                text.set()
+            elif key == 'CLOSE':
+                self.flush_files()
+                if self.mirror_drive is not None:
+                    self.mirror_files()
+                for log_file in self.log_files.values():
+                    log_file.file.close()
+                break
+            else:
+                self.write_entry(key, text)
+
+    def write_entry(self, key, text):
+        try:
+            log_file = self.log_files[key]
+            if log_file.size + len(text) > self.max_file_size:
+                log_file.flush()
+                log_file.next_part()
+            log_file.write(text)
+        except Exception as e:
+            with self.lock:
+                self.error = str(e)
+
+    def flush_files(self):
+        for log_file in self.log_files.values():
+            try:
+                log_file.flush()
+            except Exception as e:
+                with self.lock:
+                    self.error = str(e)
+
+    def mirror_files(self):
+        success = True
+        for log_file in self.log_files.values():
+            for state in log_file.mirror_state:
+                try:
+                    state[1] = self.mirror_file(*state)
+                except:
+                    success = False
+        with self.lock:
+            if success:
+                self.mirror_failures = 0
+            else:
+                self.mirror_failures += 1
+
+    def mirror_file(self, file_name, offset):
+        """Append the bytes after offset to the copy of file_name on the
+           mirror drive. Return the new offset.
+        """
+        dst_file_name = self.mirror_drive + file_name[2:]
+        size = os.path.getsize(file_name)
+        if offset > 0 and (not os.path.isfile(dst_file_name)
+                           or os.path.getsize(dst_file_name) < offset):
+            # Copy on mirror drive missing or incomplete, copy whole file:
+            offset = 0
+        if size == offset and offset > 0:
+            return offset
+        with open(file_name, 'rb') as src:
+            src.seek(offset)
+            data = src.read(size - offset)
+        with open(dst_file_name, 'ab' if offset > 0 else 'wb') as dst:
+            if offset > 0:
+                # Remove a partially written copy from a failed attempt:
+                dst.truncate(offset)
+            dst.write(data)
+        return offset + len(data)
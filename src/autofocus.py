@@ -22,17 +22,15 @@ import json
 import numpy as np
 from math import sqrt, exp, sin, cos
 from time import sleep, time
-from scipy.misc import imsave
 from scipy.signal import correlate2d, fftconvolve
 
 
 class Autofocus():
 
-    def __init__(self, config, sem, acq_queue, acq_trigger):
+    def __init__(self, config, sem, acq_events):
         self.cfg = config
         self.sem = sem
-        self.queue = acq_queue
-        self.trigger = acq_trigger
+        self.events = acq_events
         self.method = int(self.cfg['autofocus']['method'])
         self.ref_tiles = json.loads(self.cfg['autofocus']['ref_tiles'])
         self.interval = int(self.cfg['autofocus']['interval'])
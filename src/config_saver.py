@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module writes configuration files in a background thread. The
+   configuration is copied (as text) in the calling thread and written to a
+   temporary file, which is synced to disk and then renamed to the
+   configuration file. A crash or power cut during saving therefore leaves
+   either the previous or the new version. Unchanged configurations are
+   not written again. The previous versions are kept as backups
+   (file_name.1 is the most recent one).
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of previous versions kept for each configuration file:
+BACKUP_GENERATIONS = 3
+
+
+class ConfigSaver(object):
+
+    def __init__(self, generations=BACKUP_GENERATIONS):
+        self.generations = generations
+        # file name -> hash of the content on disk:
+        self.hashes = {}
+        # file name -> content waiting to be written:
+        self.pending = {}
+        self.error = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def save(self, file_name, config):
+        """Save a snapshot of config (Settings) to file_name in the
+           background. If the previous snapshot has not been written yet,
+           it is replaced by the new one.
+        """
+        content = config.to_string()
+        with self.lock:
+            submit = file_name not in self.pending
+            self.pending[file_name] = content
+        if submit:
+            self.executor.submit(self.write_pending, file_name)
+
+    def write_pending(self, file_name):
+        with self.lock:
+            content = self.pending.pop(file_name)
+        try:
+            content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+            if file_name not in self.hashes:
+                self.hashes[file_name] = self.get_file_hash(file_name)
+            if content_hash == self.hashes[file_name]:
+                return
+            tmp_file_name = file_name + '.tmp'
+            with open(tmp_file_name, 'w') as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            self.rotate_backups(file_name)
+            os.replace(tmp_file_name, file_name)
+            self.hashes[file_name] = content_hash
+        except Exception as e:
+            with self.lock:
+                self.error = file_name + ': ' + str(e)
+
+    def get_file_hash(self, file_name):
+        if not os.path.isfile(file_name):
+            return None
+        with open(file_name, 'r') as file:
+            return hashlib.sha1(file.read().encode('utf-8')).hexdigest()
+
+    def rotate_backups(self, file_name):
+        """Keep the current version of file_name as file_name.1 and move
+           the older backups up by one generation.
+        """
+        if self.generations < 1 or not os.path.isfile(file_name):
+            return
+        for i in range(self.generations - 1, 0, -1):
+            backup = file_name + '.' + str(i)
+            if os.path.isfile(backup):
+                os.replace(backup, file_name + '.' + str(i + 1))
+        # Copy instead of rename, so that file_name always exists:
+        shutil.copyfile(file_name, file_name + '.1')
+
+    def get_error(self):
+        """Return and clear the last error (or None)."""
+        with self.lock:
+            error, self.error = self.error, None
+        return error
+
+    def wait(self):
+        """Block until all pending files have been written."""
+        self.executor.submit(lambda: None).result()
+
+    def shut_down(self):
+        self.executor.shutdown(wait=True)
@@ -17,14 +17,15 @@
 # deleted from the default configuration files
 CFG_TEMPLATE_FILE = '..\\cfg\\default.ini'
 CFG_NUMBER_SECTIONS = 10
-CFG_NUMBER_KEYS = 176
+CFG_NUMBER_KEYS = 189
 
 SYSCFG_TEMPLATE_FILE = '..\\cfg\\system.cfg'
 SYSCFG_NUMBER_SECTIONS = 7
 SYSCFG_NUMBER_KEYS = 19
 
 import os
-from configparser import ConfigParser
+
+from settings import Settings
 
 def process_cfg(current_cfg, current_syscfg, is_default_cfg=False):
 
@@ -44,14 +45,14 @@ def process_cfg(current_cfg, current_syscfg, is_default_cfg=False):
         # Load default configuration. This file must be up-to-date. It is always
         # bundled with each new version of SBEMimage.
         if os.path.isfile(CFG_TEMPLATE_FILE):
-            cfg_template = ConfigParser()
+            cfg_template = Settings()
             try:
                 with open(CFG_TEMPLATE_FILE, 'r') as file:
                     cfg_template.read_file(file)
             except:
                 cfg_load_success = False
         if os.path.isfile(SYSCFG_TEMPLATE_FILE):
-            syscfg_template = ConfigParser()
+            syscfg_template = Settings()
             try:
                 with open(SYSCFG_TEMPLATE_FILE, 'r') as file:
                     syscfg_template.read_file(file)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the block-wise change detection for debris detection
+   (method 3). The difference between the current and the previous OV is
+   summarized per block. Each block is compared to its normal
+   slice-to-slice variation, which is learned from the change maps of the
+   recently accepted OVs. Debris is reported if blocks with unusually large
+   changes form a cluster that overlaps the active tile areas.
+"""
+
+import numpy as np
+
+from collections import deque
+from scipy import ndimage
+
+
+# Factor to estimate the standard deviation from the median absolute
+# deviation:
+MAD_TO_SD = 1.4826
+# Minimum number of change maps required to use the per-block baseline:
+MIN_HISTORY = 5
+# Lower limit for the spread of the block changes (in grey levels):
+MIN_SPREAD = 0.5
+
+
+def get_block_change_map(prev_roi, curr_roi, block_size):
+    """Return the mean absolute difference between curr_roi and prev_roi
+       for each block of block_size x block_size pixels, relative to the
+       median of all blocks (to remove global changes in brightness and
+       noise). Incomplete blocks at the right and bottom are ignored.
+    """
+    rows = prev_roi.shape[0] // block_size
+    cols = prev_roi.shape[1] // block_size
+    if rows == 0 or cols == 0:
+        return np.zeros((0, 0))
+    height, width = rows * block_size, cols * block_size
+    diff = np.absolute(curr_roi[:height, :width].astype(np.int16)
+                       - prev_roi[:height, :width].astype(np.int16))
+    block_means = diff.reshape(
+        rows, block_size, cols, block_size).mean(axis=(1, 3))
+    return block_means - np.median(block_means)
+
+def get_tile_block_mask(shape, block_size, area, tile_areas):
+    """Return a boolean array (shape of the change map) of the blocks that
+       overlap with the tile areas. All blocks are selected if tile_areas is
+       None.
+    """
+    if tile_areas is None:
+        return np.ones(shape, dtype=bool)
+    mask = np.zeros(shape, dtype=bool)
+    for x0, y0, x1, y1 in tile_areas:
+        # Relative to the detection area:
+        x0, x1 = x0 - area[0], x1 - area[0]
+        y0, y1 = y0 - area[1], y1 - area[1]
+        if x1 <= 0 or y1 <= 0:
+            continue
+        mask[max(0, y0) // block_size:(y1 - 1) // block_size + 1,
+             max(0, x0) // block_size:(x1 - 1) // block_size + 1] = True
+    return mask
+
+
+class BlockChangeDetector(object):
+    """Keep the change maps of the recently accepted OVs (for each OV) and
+       detect debris as spatial clusters of blocks with outlier scores.
+       The change map of the current OV is only added to the history once
+       the OV has been accepted (see accept()), so that debris does not
+       become part of the baseline.
+    """
+
+    def __init__(self):
+        # ov_number -> [key, deque of change maps]:
+        self.history = {}
+        # ov_number -> [key, change map] of the OV currently checked:
+        self.pending = {}
+
+    def detect(self, ov_number, prev_roi, curr_roi, area, tile_areas,
+               block_size, history_depth, score_threshold, min_cluster_size):
+        """Return (debris_detected, number of outlier blocks, size of the
+           largest cluster, number of change maps used for the baseline).
+        """
+        change_map = get_block_change_map(prev_roi, curr_roi, block_size)
+        # The history is only valid for the same area and block size:
+        key = (tuple(area), block_size)
+        entry = self.history.get(ov_number)
+        if (entry is None or entry[0] != key
+                or entry[1].maxlen != history_depth):
+            entry = [key, deque(maxlen=history_depth)]
+            self.history[ov_number] = entry
+        self.pending[ov_number] = [key, change_map]
+        if change_map.size == 0:
+            return False, 0, 0, len(entry[1])
+
+        scores = self.get_scores(change_map, entry[1])
+        outliers = ((scores > score_threshold)
+                    & get_tile_block_mask(
+                        change_map.shape, block_size, area, tile_areas))
+        largest_cluster = 0
+        labels, number_clusters = ndimage.label(
+            outliers, structure=np.ones((3, 3)))
+        if number_clusters > 0:
+            largest_cluster = int(np.max(np.bincount(labels.ravel())[1:]))
+        return (largest_cluster >= min_cluster_size,
+                int(np.count_nonzero(outliers)), largest_cluster,
+                len(entry[1]))
+
+    def get_scores(self, change_map, history):
+        """Return robust z-scores of the block changes. With enough history,
+           each block is compared to its own median and median absolute
+           deviation. Otherwise, all blocks of the current map are used.
+        """
+        if len(history) >= MIN_HISTORY:
+            maps = np.array(history)
+            baseline = np.median(maps, axis=0)
+            spread = MAD_TO_SD * np.median(
+                np.absolute(maps - baseline), axis=0)
+            # Blocks with (almost) constant changes in the history would
+            # produce very large scores:
+            spread = np.maximum(spread, np.median(spread))
+        else:
+            baseline = 0
+            spread = MAD_TO_SD * np.median(np.absolute(change_map))
+        return (change_map - baseline) / np.maximum(spread, MIN_SPREAD)
+
+    def accept(self, ov_number):
+        """Add the change map of the accepted OV to the history."""
+        pending = self.pending.pop(ov_number, None)
+        entry = self.history.get(ov_number)
+        if (pending is not None and entry is not None
+                and entry[0] == pending[0] and pending[1].size > 0):
+            entry[1].append(pending[1])
+
+    def discard(self, ov_number):
+        self.pending.pop(ov_number, None)
+
+    def reset(self):
+        self.history = {}
+        self.pending = {}
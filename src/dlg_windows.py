@@ -25,16 +25,19 @@ from time import sleep, time
 from validate_email import validate_email
 from math import atan, sqrt
 from queue import Queue
-from PIL import Image
+import numpy as np
 
 from PyQt5.uic import loadUi
-from PyQt5.QtCore import Qt, QObject, QSize, pyqtSignal
-from PyQt5.QtGui import QPixmap, QIcon, QPalette, QColor, QFont
+from PyQt5.QtCore import Qt, QObject, QSize, QPointF, pyqtSignal
+from PyQt5.QtGui import QPixmap, QIcon, QPalette, QColor, QFont, QImage, \
+                        QPainter, QPen, QPolygonF, qRgb
 from PyQt5.QtWidgets import QApplication, QDialog, QMessageBox, \
                             QFileDialog, QLineEdit, QDialogButtonBox
 
 import utils
 import acq_func
+from acq_events import Event, EventBus
+from image_io import convert_image
 
 
 class Trigger(QObject):
@@ -534,8 +537,7 @@ class ImportImageDlg(QDialog):
         if os.path.isfile(selected_path):
             # Copy file to data folder as png:
             try:
-                imported_img = Image.open(selected_path)
-                imported_img.save(target_path)
+                width, height = convert_image(selected_path, target_path)
             except:
                 QMessageBox.warning(
                     self, 'Error',
@@ -556,7 +558,6 @@ class ImportImageDlg(QDialog):
                     new_img_number, target_path)
                 self.ovm.set_imported_img_name(new_img_number,
                                                self.lineEdit_name.text())
-                width, height = imported_img.size
                 self.ovm.set_imported_img_size_px_py(
                     new_img_number, width, height)
                 self.ovm.set_imported_img_pixel_size(
@@ -578,11 +579,10 @@ class AdjustImageDlg(QDialog):
     """Adjust an imported image (size, rotation, transparency)"""
 
     def __init__(self, ovm, cs, selected_img,
-                 main_window_queue, main_window_trigger):
+                 main_window_events):
         self.ovm = ovm
         self.cs = cs
-        self.main_window_queue = main_window_queue
-        self.main_window_trigger = main_window_trigger
+        self.main_window_events = main_window_events
         self.selected_img = selected_img
         super(AdjustImageDlg, self).__init__()
         loadUi('..\\gui\\adjust_imported_image_dlg.ui', self)
@@ -623,8 +623,7 @@ class AdjustImageDlg(QDialog):
         self.ovm.set_imported_img_transparency(
             self.selected_img, self.spinBox_transparency.value())
         # Emit signals to reload and redraw:
-        self.main_window_queue.put('RELOAD IMPORTED' + str(self.selected_img))
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.RELOAD_IMPORTED, self.selected_img)
 
 #------------------------------------------------------------------------------
 
@@ -1417,6 +1416,10 @@ class DebrisSettingsDlg(QDialog):
             int(self.cfg['debris']['histogram_diff_threshold']))
         self.spinBox_diffPixels.setValue(
             int(self.cfg['debris']['image_diff_threshold']))
+        self.doubleSpinBox_blockScore.setValue(
+            float(self.cfg['debris']['block_score_threshold']))
+        self.spinBox_blockCluster.setValue(
+            int(self.cfg['debris']['block_min_cluster_size']))
         self.checkBox_showDebrisArea.setChecked(
             self.cfg['debris']['show_detection_area'] == 'True')
         self.checkBox_continueAcq.setChecked(
@@ -1428,31 +1431,32 @@ class DebrisSettingsDlg(QDialog):
             self.cfg['debris']['detection_method'] == '1')
         self.radioButton_methodHistogram.setChecked(
             self.cfg['debris']['detection_method'] == '2')
+        self.radioButton_methodBlocks.setChecked(
+            self.cfg['debris']['detection_method'] == '3')
         self.radioButton_methodQuadrant.toggled.connect(
             self.update_option_selection)
         self.radioButton_methodHistogram.toggled.connect(
             self.update_option_selection)
+        self.radioButton_methodBlocks.toggled.connect(
+            self.update_option_selection)
         self.update_option_selection()
 
     def update_option_selection(self):
         """Let user only change the parameters for the currently selected
            detection method. The other input fields are deactivated.
         """
-        if self.radioButton_methodQuadrant.isChecked():
-            self.doubleSpinBox_diffMean.setEnabled(True)
-            self.doubleSpinBox_diffSD.setEnabled(True)
-            self.spinBox_diffPixels.setEnabled(False)
-            self.spinBox_diffHistogram.setEnabled(False)
-        elif self.radioButton_methodPixel.isChecked():
-             self.doubleSpinBox_diffMean.setEnabled(False)
-             self.doubleSpinBox_diffSD.setEnabled(False)
-             self.spinBox_diffPixels.setEnabled(True)
-             self.spinBox_diffHistogram.setEnabled(False)
-        elif self.radioButton_methodHistogram.isChecked():
-             self.doubleSpinBox_diffMean.setEnabled(False)
-             self.doubleSpinBox_diffSD.setEnabled(False)
-             self.spinBox_diffPixels.setEnabled(False)
-             self.spinBox_diffHistogram.setEnabled(True)
+        self.doubleSpinBox_diffMean.setEnabled(
+            self.radioButton_methodQuadrant.isChecked())
+        self.doubleSpinBox_diffSD.setEnabled(
+            self.radioButton_methodQuadrant.isChecked())
+        self.spinBox_diffPixels.setEnabled(
+            self.radioButton_methodPixel.isChecked())
+        self.spinBox_diffHistogram.setEnabled(
+            self.radioButton_methodHistogram.isChecked())
+        self.doubleSpinBox_blockScore.setEnabled(
+            self.radioButton_methodBlocks.isChecked())
+        self.spinBox_blockCluster.setEnabled(
+            self.radioButton_methodBlocks.isChecked())
 
     def accept(self):
         self.ovm.set_ov_auto_debris_detection_area_margin(
@@ -1467,6 +1471,10 @@ class DebrisSettingsDlg(QDialog):
             self.spinBox_diffHistogram.value())
         self.cfg['debris']['image_diff_threshold'] = str(
             self.spinBox_diffPixels.value())
+        self.cfg['debris']['block_score_threshold'] = str(
+            self.doubleSpinBox_blockScore.value())
+        self.cfg['debris']['block_min_cluster_size'] = str(
+            self.spinBox_blockCluster.value())
         self.cfg['debris']['auto_detection_area'] = str(
             self.radioButton_autoSelection.isChecked())
         self.cfg['debris']['show_detection_area'] = str(
@@ -1479,6 +1487,8 @@ class DebrisSettingsDlg(QDialog):
             self.cfg['debris']['detection_method'] = '1'
         elif self.radioButton_methodHistogram.isChecked():
             self.cfg['debris']['detection_method'] = '2'
+        elif self.radioButton_methodBlocks.isChecked():
+            self.cfg['debris']['detection_method'] = '3'
         super(DebrisSettingsDlg, self).accept()
 
 #------------------------------------------------------------------------------
@@ -1577,6 +1587,8 @@ class ImageMonitoringSettingsDlg(QDialog):
             float(self.cfg['monitoring']['tile_mean_threshold']))
         self.doubleSpinBox_stdDevThreshold.setValue(
             float(self.cfg['monitoring']['tile_stddev_threshold']))
+        self.spinBox_historyDepth.setValue(
+            int(self.cfg['monitoring']['tile_history_depth']))
 
     def accept(self):
         error_str = ''
@@ -1603,6 +1615,8 @@ class ImageMonitoringSettingsDlg(QDialog):
             self.doubleSpinBox_meanThreshold.value())
         self.cfg['monitoring']['tile_stddev_threshold'] = str(
             self.doubleSpinBox_stdDevThreshold.value())
+        self.cfg['monitoring']['tile_history_depth'] = str(
+            self.spinBox_historyDepth.value())
         if not error_str:
             super(ImageMonitoringSettingsDlg, self).accept()
         else:
@@ -1763,11 +1777,10 @@ class ApproachDlg(QDialog):
        the cutting thickness.
     """
 
-    def __init__(self, microtome, main_window_queue, main_window_trigger):
+    def __init__(self, microtome, main_window_events):
         super(ApproachDlg, self).__init__()
         self.microtome = microtome
-        self.main_window_queue = main_window_queue
-        self.main_window_trigger = main_window_trigger
+        self.main_window_events = main_window_events
         loadUi('..\\gui\\approach_dlg.ui', self)
         self.setWindowModality(Qt.ApplicationModal)
         self.setWindowIcon(QIcon('..\\img\\icon_16px.ico'))
@@ -1792,8 +1805,7 @@ class ApproachDlg(QDialog):
         self.update_progress()
 
     def add_to_log(self, msg):
-        self.main_window_queue.put(utils.format_log_entry(msg))
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.LOG, utils.format_log_entry(msg))
 
     def update_progress(self):
         self.max_slices = self.spinBox_numberSlices.value()
@@ -1816,8 +1828,7 @@ class ApproachDlg(QDialog):
         self.buttonBox.setEnabled(False)
         self.spinBox_thickness.setEnabled(False)
         self.spinBox_numberSlices.setEnabled(False)
-        self.main_window_queue.put('APPROACH BUSY')
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.APPROACH_BUSY)
         thread = threading.Thread(target=self.approach_thread)
         thread.start()
 
@@ -1830,8 +1841,7 @@ class ApproachDlg(QDialog):
             QMessageBox.warning(self, 'Error',
                                 'Warning: Clearing the knife failed. '
                                 'Try to clear manually.', QMessageBox.Ok)
-        self.main_window_queue.put('STATUS IDLE')
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.STATUS_IDLE)
         # Show message box to user and reset counter and progress bar:
         if not self.aborted:
             QMessageBox.information(
@@ -1874,8 +1884,7 @@ class ApproachDlg(QDialog):
                     'CTRL: Error reading Z position. Approach aborted.')
                 self.microtome.reset_error_state()
                 self.aborted = True
-        self.main_window_queue.put('UPDATE Z')
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.UPDATE_Z)
         self.microtome.near_knife()
         self.add_to_log('3VIEW: Moving knife to near position.')
         if self.microtome.get_error_state() > 0:
@@ -1891,8 +1900,7 @@ class ApproachDlg(QDialog):
                 '3VIEW: Move to new Z: ' + '{0:.3f}'.format(z_position))
             self.microtome.move_stage_to_z(z_position)
             # Show new Z position in main window:
-            self.main_window_queue.put('UPDATE Z')
-            self.main_window_trigger.s.emit()
+            self.main_window_events.put(Event.UPDATE_Z)
             # Check if there were microtome problems:
             if self.microtome.get_error_state() > 0:
                 self.add_to_log(
@@ -1939,12 +1947,11 @@ class ApproachDlg(QDialog):
 class GrabFrameDlg(QDialog):
     """Acquires or saves a single frame from SmartSEM."""
 
-    def __init__(self, config, sem, main_window_queue, main_window_trigger):
+    def __init__(self, config, sem, main_window_events):
         super(GrabFrameDlg, self).__init__()
         self.cfg = config
         self.sem = sem
-        self.main_window_queue = main_window_queue
-        self.main_window_trigger = main_window_trigger
+        self.main_window_events = main_window_events
         self.finish_trigger = Trigger()
         self.finish_trigger.s.connect(self.scan_complete)
         loadUi('..\\gui\\grab_frame_dlg.ui', self)
@@ -2039,9 +2046,8 @@ class GrabFrameDlg(QDialog):
             self.sem.reset_error_state()
 
     def add_to_log(self, msg):
-        """Use trigger and queue to add an entry to the main log."""
-        self.main_window_queue.put(utils.format_log_entry(msg))
-        self.main_window_trigger.s.emit()
+        """Add an entry to the main log."""
+        self.main_window_events.put(Event.LOG, utils.format_log_entry(msg))
 
 #------------------------------------------------------------------------------
 
@@ -2159,12 +2165,11 @@ class MotorTestDlg(QDialog):
     """Perform a random-walk XYZ motor test. Experimental, only for testing/
        debugging."""
 
-    def __init__(self, cfg, microtome, main_window_queue, main_window_trigger):
+    def __init__(self, cfg, microtome, main_window_events):
         super(MotorTestDlg, self).__init__()
         self.cfg = cfg
         self.microtome = microtome
-        self.main_window_queue = main_window_queue
-        self.main_window_trigger = main_window_trigger
+        self.main_window_events = main_window_events
         loadUi('..\\gui\\motor_test_dlg.ui', self)
         self.setWindowModality(Qt.ApplicationModal)
         self.setWindowIcon(QIcon('..\\img\\icon_16px.ico'))
@@ -2186,8 +2191,7 @@ class MotorTestDlg(QDialog):
         self.start_time = None
 
     def add_to_log(self, msg):
-        self.main_window_queue.put(utils.format_log_entry(msg))
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.LOG, utils.format_log_entry(msg))
 
     def update_progress(self):
         if self.start_time is not None:
@@ -2334,7 +2338,7 @@ class StubOVDlg(QDialog):
     def __init__(self, position, size_selector,
                  base_dir, slice_counter,
                  sem, microtome, ovm, cs,
-                 main_window_queue, main_window_trigger):
+                 main_window_events):
         super(StubOVDlg, self).__init__()
         loadUi('..\\gui\\stub_ov_dlg.ui', self)
         self.setWindowModality(Qt.ApplicationModal)
@@ -2347,12 +2351,11 @@ class StubOVDlg(QDialog):
         self.microtome = microtome
         self.ovm = ovm
         self.cs = cs
-        self.main_window_queue = main_window_queue
-        self.main_window_trigger = main_window_trigger
+        self.main_window_events = main_window_events
         # Set up trigger and queue to update dialog GUI during approach:
         self.acq_thread_trigger = Trigger()
         self.acq_thread_trigger.s.connect(self.process_thread_signal)
-        self.acq_thread_queue = Queue()
+        self.acq_thread_events = EventBus(self.acq_thread_trigger)
         self.abort_queue = Queue()
         self.acq_in_progress = False
         self.pushButton_acquire.clicked.connect(self.acquire_stub_ov)
@@ -2386,18 +2389,23 @@ class StubOVDlg(QDialog):
         self.previous_size_selector = self.ovm.get_stub_ov_size_selector()
 
     def process_thread_signal(self):
-        """Process commands from the queue when a trigger signal occurs
-           while the acquisition of the stub overview is running.
+        """Process the events from the acquisition thread when a trigger
+           signal occurs while the acquisition of the stub overview is
+           running.
         """
-        msg = self.acq_thread_queue.get()
-        if msg == 'UPDATE STAGEPOS':
+        for event, data in self.acq_thread_events.get_batch():
+            self.process_thread_event(event, data)
+
+    def process_thread_event(self, event, data):
+        if event == Event.UPDATE_STAGEPOS:
             self.show_new_stage_pos()
-        elif msg[:15] == 'UPDATE PROGRESS':
-            percentage = int(msg[15:])
-            self.progressBar.setValue(percentage)
-        elif msg == 'STUB OV SUCCESS':
-            self.main_window_queue.put('STUB OV SUCCESS')
-            self.main_window_trigger.s.emit()
+        elif event == Event.UPDATE_PROGRESS:
+            self.progressBar.setValue(data)
+        elif event == Event.STUB_OV_PREVIEW:
+            # Show the mosaic acquired so far in the viewport:
+            self.main_window_events.put(Event.STUB_OV_PREVIEW, data)
+        elif event == Event.STUB_OV_SUCCESS:
+            self.main_window_events.put(Event.STUB_OV_SUCCESS)
             self.pushButton_acquire.setEnabled(True)
             self.pushButton_abort.setEnabled(False)
             self.buttonBox.setEnabled(True)
@@ -2409,9 +2417,8 @@ class StubOVDlg(QDialog):
                 'The stub overview was completed successfully.',
                 QMessageBox.Ok)
             self.acq_in_progress = False
-        elif msg == 'STUB OV FAILURE':
-            self.main_window_queue.put('STUB OV FAILURE')
-            self.main_window_trigger.s.emit()
+        elif event == Event.STUB_OV_FAILURE:
+            self.main_window_events.put(Event.STUB_OV_FAILURE)
             # Restore previous origin:
             self.cs.set_stub_ov_origin_s(self.previous_origin)
             self.cs.set_stub_ov_centre_s(self.previous_centre)
@@ -2426,9 +2433,8 @@ class StubOVDlg(QDialog):
                 QMessageBox.Ok)
             self.acq_in_progress = False
             self.close()
-        elif msg == 'STUB OV ABORT':
-            self.main_window_queue.put('STATUS IDLE')
-            self.main_window_trigger.s.emit()
+        elif event == Event.STUB_OV_ABORT:
+            self.main_window_events.put(Event.STUB_OV_ABORT)
             # Restore previous origin:
             self.cs.set_stub_ov_origin_s(self.previous_origin)
             self.cs.set_stub_ov_centre_s(self.previous_centre)
@@ -2445,12 +2451,10 @@ class StubOVDlg(QDialog):
             self.comboBox_sizeSelector.currentIndex()])
 
     def show_new_stage_pos(self):
-        self.main_window_queue.put('UPDATE XY')
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.UPDATE_XY)
 
     def add_to_log(self, msg):
-        self.main_window_queue.put(utils.format_log_entry(msg))
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.LOG, utils.format_log_entry(msg))
 
     def acquire_stub_ov(self):
         """Acquire the stub overview. Acquisition routine runs in
@@ -2469,8 +2473,7 @@ class StubOVDlg(QDialog):
         self.spinBox_Y.setEnabled(False)
         self.comboBox_sizeSelector.setEnabled(False)
         self.progressBar.setValue(0)
-        self.main_window_queue.put('STUB OV BUSY')
-        self.main_window_trigger.s.emit()
+        self.main_window_events.put(Event.STUB_OV_BUSY)
         QApplication.processEvents()
         stub_acq_thread = threading.Thread(
                               target=acq_func.acquire_stub_ov,
@@ -2478,8 +2481,7 @@ class StubOVDlg(QDialog):
                                     self.sem, self.microtome,
                                     position, size_selector,
                                     self.ovm, self.cs,
-                                    self.acq_thread_queue,
-                                    self.acq_thread_trigger,
+                                    self.acq_thread_events,
                                     self.abort_queue,))
         stub_acq_thread.start()
 
@@ -2496,6 +2498,124 @@ class StubOVDlg(QDialog):
 
 #------------------------------------------------------------------------------
 
+class QCDashboardDlg(QDialog):
+    """Show heatmaps and trends of the tile statistics (mean, SD, focus
+       estimate, number of rejected images) kept in the stats cube, and
+       find tiles whose statistics have changed over the recent slices.
+       The dialog is not modal and can stay open during the acquisition.
+    """
+
+    QUANTITIES = ['mean', 'stddev', 'focus', 'rejections']
+
+    def __init__(self, grid_manager, stats_cube):
+        super(QCDashboardDlg, self).__init__()
+        self.gm = grid_manager
+        self.stats_cube = stats_cube
+        loadUi('..\\gui\\qc_dashboard_dlg.ui', self)
+        self.setWindowIcon(QIcon('..\\img\\icon_16px.ico'))
+        self.setFixedSize(self.size())
+        # Colour table for the heatmaps: index 0 for tiles without data,
+        # 1-255 from blue (low) to red (high):
+        self.colour_table = [qRgb(64, 64, 64)] + [
+            qRgb(i, 0, 255 - i) for i in range(255)]
+        self.comboBox_grid.addItems(self.gm.get_grid_str_list())
+        self.spinBox_numberSlices.setMaximum(self.stats_cube.depth)
+        self.comboBox_quantity.currentIndexChanged.connect(self.refresh)
+        self.comboBox_grid.currentIndexChanged.connect(self.refresh)
+        self.pushButton_refresh.clicked.connect(self.refresh)
+        self.pushButton_find.clicked.connect(self.find_changed_tiles)
+        self.refresh()
+        self.show()
+
+    def get_quantity(self):
+        return self.QUANTITIES[self.comboBox_quantity.currentIndex()]
+
+    def refresh(self):
+        grid_number = self.comboBox_grid.currentIndex()
+        if grid_number < 0:
+            self.label_sliceInfo.setText('No grids.')
+            return
+        self.draw_heatmap(grid_number)
+        self.draw_trend(grid_number)
+
+    def draw_heatmap(self, grid_number):
+        rows = self.gm.get_number_rows(grid_number)
+        cols = self.gm.get_number_cols(grid_number)
+        heatmap, slice_number = self.stats_cube.get_heatmap(
+            self.get_quantity(), grid_number, rows, cols)
+        valid = ~np.isnan(heatmap)
+        if slice_number is None or not valid.any():
+            self.label_heatmap.clear()
+            self.label_sliceInfo.setText('No data available for this grid.')
+            self.label_range.setText('')
+            return
+        self.label_sliceInfo.setText(
+            'Slice %d, %d of %d tiles'
+            % (slice_number, np.count_nonzero(valid), rows * cols))
+        low, high = np.min(heatmap[valid]), np.max(heatmap[valid])
+        # Map values to colour table indices 1-255:
+        indices = np.zeros((rows, cols), dtype=np.uint8)
+        if high > low:
+            indices[valid] = 1 + (heatmap[valid] - low) / (high - low) * 254
+        else:
+            indices[valid] = 128
+        img = QImage(indices.data, cols, rows, cols, QImage.Format_Indexed8)
+        img.setColorTable(self.colour_table)
+        # Scale without interpolation to show one block per tile:
+        self.label_heatmap.setPixmap(QPixmap.fromImage(img).scaled(
+            self.label_heatmap.size() - QSize(2, 2),
+            Qt.KeepAspectRatio, Qt.FastTransformation))
+        self.label_range.setText(
+            'Blue: %.2f, red: %.2f, grey: no data' % (low, high))
+
+    def draw_trend(self, grid_number):
+        width = self.label_trend.width() - 2
+        height = self.label_trend.height() - 2
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.white)
+        slice_numbers, values = self.stats_cube.get_trend(
+            self.get_quantity(), grid_number)
+        valid = ~np.isnan(values)
+        if np.count_nonzero(valid) > 0:
+            values = values[valid]
+            low, high = np.min(values), np.max(values)
+            if high == low:
+                high = low + 1
+            # Use full width for the depth of the stats cube:
+            x_step = (width - 60) / max(self.stats_cube.depth - 1, 1)
+            x_offset = width - 10 - (len(valid) - 1) * x_step
+            positions = np.nonzero(valid)[0]
+            polygon = QPolygonF([
+                QPointF(x_offset + p * x_step,
+                        height - 10 - (v - low) / (high - low) * (height - 20))
+                for p, v in zip(positions, values)])
+            qp = QPainter()
+            qp.begin(pixmap)
+            qp.setPen(QPen(QColor(0, 0, 0), 1, Qt.SolidLine))
+            qp.drawText(2, 12, '%.2f' % high)
+            qp.drawText(2, height - 2, '%.2f' % low)
+            qp.setPen(QPen(QColor(0, 0, 255), 1, Qt.SolidLine))
+            qp.drawPolyline(polygon)
+            qp.end()
+        self.label_trend.setPixmap(pixmap)
+
+    def find_changed_tiles(self):
+        self.listWidget_results.clear()
+        relative_change = self.doubleSpinBox_change.value() / 100
+        if relative_change == 0:
+            return
+        results = self.stats_cube.find_changed_tiles(
+            self.get_quantity(), relative_change,
+            self.spinBox_numberSlices.value())
+        if not results:
+            self.listWidget_results.addItem('No tiles found.')
+        for grid_number, tile_number, change in results:
+            self.listWidget_results.addItem(
+                'Grid %d, tile %d: %+.1f%%'
+                % (grid_number, tile_number, change * 100))
+
+#------------------------------------------------------------------------------
+
 class AboutBox(QDialog):
     """Show the About dialog box with info about SBEMimage and the current
        version and release date.
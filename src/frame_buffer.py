@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides shared buffers for acquired frames. Each tile/OV
+   image is decoded once after acquisition (image_io.read_image). The
+   resulting numpy array is used by all consumers (inspection, debris
+   detection, autofocus, previews, status reports and the viewport) instead
+   of reading the file again.
+"""
+
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from PyQt5.QtGui import QImage
+
+
+class Frame(object):
+    """Decoded image (numpy array) shared by several consumers. Consumers
+       call acquire() before and release() after using the pixels. The
+       pixel buffer is dropped when the last reference is released.
+    """
+
+    def __init__(self, file_name, slice_number, pixels):
+        self.file_name = file_name
+        self.slice_number = slice_number
+        self.pixels = pixels
+        self.ref_count = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.ref_count += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.ref_count -= 1
+            if self.ref_count <= 0:
+                self.pixels = None
+
+    def get_size_bytes(self):
+        return 0 if self.pixels is None else self.pixels.nbytes
+
+    def get_qimage(self):
+        """Return a QImage that uses the pixel buffer without copying it.
+           The frame must be acquired as long as the QImage is in use.
+           16-bit images are converted to 8 bit (copy).
+        """
+        pixels = self.pixels
+        if pixels.dtype != np.uint8:
+            pixels = (pixels >> 8).astype(np.uint8)
+        pixels = np.ascontiguousarray(pixels)
+        height, width = pixels.shape[0], pixels.shape[1]
+        image = QImage(pixels.data, width, height, pixels.strides[0],
+                       QImage.Format_Grayscale8)
+        # Keep the array alive together with the QImage:
+        image.buffer = pixels
+        return image
+
+
+class FrameStore(object):
+    """Keep the most recent frame of each tile/OV (keys as in
+       MonitoringHistory: 'g0000_t0000' or 'OV000') for the consumers that
+       run after the image inspector. The store holds one reference per
+       frame and releases the least recently used frames when the total
+       size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, key, frame):
+        frame.acquire()
+        with self.lock:
+            old_frame = self.frames.pop(key, None)
+            if old_frame is not None:
+                self.total_bytes -= old_frame.get_size_bytes()
+                old_frame.release()
+            self.frames[key] = frame
+            self.total_bytes += frame.get_size_bytes()
+            while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+                old_key, old_frame = self.frames.popitem(last=False)
+                self.total_bytes -= old_frame.get_size_bytes()
+                old_frame.release()
+
+    def get(self, key, slice_number=None):
+        """Return the acquired frame for key (optionally only if it belongs
+           to slice_number), or None. The caller must release the frame.
+        """
+        with self.lock:
+            frame = self.frames.get(key)
+            if (frame is None or frame.pixels is None
+                    or (slice_number is not None
+                        and frame.slice_number != slice_number)):
+                return None
+            self.frames.move_to_end(key)
+            return frame.acquire()
+
+    def clear(self):
+        with self.lock:
+            for frame in self.frames.values():
+                frame.release()
+            self.frames.clear()
+            self.total_bytes = 0
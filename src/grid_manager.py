@@ -15,6 +15,8 @@
 """
 
 import json
+import numpy as np
+
 import utils
 
 
@@ -26,12 +28,23 @@ class GridManager(object):
         self.cs = coordinate_system
         self.grid_map_d = []
         self.grid_map_p = []
+        # Incremented whenever a working distance in grid_map_d changes:
+        self.wd_revision = 0
         self.number_grids = int(self.cfg['grids']['number_grids'])
         self.size = json.loads(self.cfg['grids']['size'])
         self.rotation = json.loads(self.cfg['grids']['rotation'])
         self.overlap = json.loads(self.cfg['grids']['overlap'])
         self.row_shift = json.loads(self.cfg['grids']['row_shift'])
-        self.active_tiles = json.loads(self.cfg['grids']['active_tiles'])
+        # Active tiles: one boolean mask (numpy array, one entry per tile)
+        # for each grid. The list of active tiles in acquisition order is
+        # created when needed and cached until the selection changes:
+        self.active_masks = []
+        self.acq_order = []
+        for grid_number, active_tiles in enumerate(
+                json.loads(self.cfg['grids']['active_tiles'])):
+            self.active_masks.append(
+                self.get_active_mask(grid_number, active_tiles))
+            self.acq_order.append(None)
         self.number_active_tiles = json.loads(
             self.cfg['grids']['number_active_tiles'])
         self.tile_size_px_py = json.loads(self.cfg['grids']['tile_size_px_py'])
@@ -84,52 +97,56 @@ class GridManager(object):
         self.grid_map_p_gaps.append({})
         self.calculate_grid_map(new_grid_number)
         self.number_grids += 1
-        self.cfg['grids']['number_grids'] = str(self.number_grids)
+        self.cfg.set_value('grids', 'number_grids', self.number_grids)
 
     def delete_grid(self):
         # Delete last item from each grid variable:
         self.cs.delete_grid_origin(self.number_grids - 1)
         del self.size[-1]
-        self.cfg['grids']['size'] = str(self.size)
+        self.cfg.set_value('grids', 'size', self.size)
         del self.rotation[-1]
-        self.cfg['grids']['rotation'] = str(self.rotation)
+        self.cfg.set_value('grids', 'rotation', self.rotation)
         del self.overlap[-1]
-        self.cfg['grids']['overlap'] = str(self.overlap)
+        self.cfg.set_value('grids', 'overlap', self.overlap)
         del self.row_shift[-1]
-        self.cfg['grids']['row_shift'] = str(self.row_shift)
-        del self.active_tiles[-1]
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
+        self.cfg.set_value('grids', 'row_shift', self.row_shift)
+        del self.active_masks[-1]
+        del self.acq_order[-1]
+        self.cfg.set_value('grids', 'active_tiles', self.get_all_active_tiles)
         del self.number_active_tiles[-1]
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.cfg.set_value('grids', 'number_active_tiles',
+                           self.number_active_tiles)
         del self.tile_size_px_py[-1]
-        self.cfg['grids']['tile_size_px_py'] = str(self.tile_size_px_py)
+        self.cfg.set_value('grids', 'tile_size_px_py', self.tile_size_px_py)
         del self.tile_size_selector[-1]
-        self.cfg['grids']['tile_size_selector'] = str(self.tile_size_selector)
+        self.cfg.set_value('grids', 'tile_size_selector',
+                           self.tile_size_selector)
         del self.pixel_size[-1]
-        self.cfg['grids']['pixel_size'] = str(self.pixel_size)
+        self.cfg.set_value('grids', 'pixel_size', self.pixel_size)
         del self.dwell_time[-1]
-        self.cfg['grids']['dwell_time'] = str(self.dwell_time)
+        self.cfg.set_value('grids', 'dwell_time', self.dwell_time)
         del self.dwell_time_selector[-1]
-        self.cfg['grids']['dwell_time_selector'] = str(
-            self.dwell_time_selector)
+        self.cfg.set_value('grids', 'dwell_time_selector',
+                           self.dwell_time_selector)
         del self.display_colour[-1]
-        self.cfg['grids']['display_colour'] = str(self.display_colour)
+        self.cfg.set_value('grids', 'display_colour', self.display_colour)
         del self.origin_wd[-1]
-        self.cfg['grids']['origin_wd'] = str(self.origin_wd)
+        self.cfg.set_value('grids', 'origin_wd', self.origin_wd)
         del self.acq_interval[-1]
-        self.cfg['grids']['acq_interval'] = str(self.acq_interval)
+        self.cfg.set_value('grids', 'acq_interval', self.acq_interval)
         del self.acq_interval_offset[-1]
-        self.cfg['grids']['acq_interval_offset'] = str(self.acq_interval_offset)
+        self.cfg.set_value('grids', 'acq_interval_offset',
+                           self.acq_interval_offset)
         del self.af_tiles[-1]
-        self.cfg['grids']['adaptive_focus_tiles'] = str(self.af_tiles)
+        self.cfg.set_value('grids', 'adaptive_focus_tiles', self.af_tiles)
         del self.af_gradient[-1]
-        self.cfg['grids']['adaptive_focus_gradient'] = str(self.af_gradient)
+        self.cfg.set_value('grids', 'adaptive_focus_gradient',
+                           self.af_gradient)
         del self.af_active[-1]
-        self.cfg['grids']['use_adaptive_focus'] = str(self.af_active)
+        self.cfg.set_value('grids', 'use_adaptive_focus', self.af_active)
         # Number of grids:
         self.number_grids -= 1
-        self.cfg['grids']['number_grids'] = str(self.number_grids)
+        self.cfg.set_value('grids', 'number_grids', self.number_grids)
 
     def get_number_grids(self):
         return self.number_grids
@@ -155,7 +172,7 @@ class GridManager(object):
                 self.size[grid_number] = list(size)
         else:
             self.size.append(list(size))
-        self.cfg['grids']['size'] = str(self.size)
+        self.cfg.set_value('grids', 'size', self.size)
 
     def get_number_rows(self, grid_number):
         return self.size[grid_number][0]
@@ -174,7 +191,7 @@ class GridManager(object):
             self.rotation[grid_number] = rotation
         else:
             self.rotation.append(rotation)
-        self.cfg['grids']['rotation'] = str(self.rotation)
+        self.cfg.set_value('grids', 'rotation', self.rotation)
 
     def get_display_colour(self, grid_number):
         return utils.COLOUR_SELECTOR[self.display_colour[grid_number]]
@@ -187,7 +204,7 @@ class GridManager(object):
             self.display_colour[grid_number] = colour
         else:
             self.display_colour.append(colour)
-        self.cfg['grids']['display_colour'] = str(self.display_colour)
+        self.cfg.set_value('grids', 'display_colour', self.display_colour)
 
     def get_overlap(self, grid_number):
         return self.overlap[grid_number]
@@ -197,7 +214,7 @@ class GridManager(object):
             self.overlap[grid_number] = overlap
         else:
             self.overlap.append(overlap)
-        self.cfg['grids']['overlap'] = str(self.overlap)
+        self.cfg.set_value('grids', 'overlap', self.overlap)
 
     def get_row_shift(self, grid_number):
         return self.row_shift[grid_number]
@@ -207,7 +224,7 @@ class GridManager(object):
             self.row_shift[grid_number] = row_shift
         else:
             self.row_shift.append(row_shift)
-        self.cfg['grids']['row_shift'] = str(self.row_shift)
+        self.cfg.set_value('grids', 'row_shift', self.row_shift)
 
     def get_tile_size_px_py(self, grid_number):
         return self.tile_size_px_py[grid_number]
@@ -220,13 +237,14 @@ class GridManager(object):
             self.tile_size_selector[grid_number] = selector
         else:
             self.tile_size_selector.append(selector)
-        self.cfg['grids']['tile_size_selector'] = str(self.tile_size_selector)
+        self.cfg.set_value('grids', 'tile_size_selector',
+                           self.tile_size_selector)
         # Update explicit storage of frame size:
         if grid_number < len(self.tile_size_px_py):
             self.tile_size_px_py[grid_number] = self.sem.STORE_RES[selector]
         else:
             self.tile_size_px_py.append(self.sem.STORE_RES[selector])
-        self.cfg['grids']['tile_size_px_py'] = str(self.tile_size_px_py)
+        self.cfg.set_value('grids', 'tile_size_px_py', self.tile_size_px_py)
 
     def get_tile_width_p(self, grid_number):
         return self.tile_size_px_py[grid_number][0]
@@ -247,7 +265,7 @@ class GridManager(object):
             self.tile_size_px_py[grid_number] = tile_size_px_py
         else:
             self.tile_size_px_py.append(tile_size_px_py)
-        self.cfg['grids']['tile_size_px_py'] = str(self.tile_size_px_py)
+        self.cfg.set_value('grids', 'tile_size_px_py', self.tile_size_px_py)
 
     def get_tile_position_d(self, grid_number, tile_number):
         return (self.grid_map_d[grid_number][tile_number][0],
@@ -264,7 +282,7 @@ class GridManager(object):
             self.pixel_size[grid_number] = pixel_size
         else:
             self.pixel_size.append(pixel_size)
-        self.cfg['grids']['pixel_size'] = str(self.pixel_size)
+        self.cfg.set_value('grids', 'pixel_size', self.pixel_size)
 
     def get_dwell_time(self, grid_number):
         return self.dwell_time[grid_number]
@@ -277,7 +295,7 @@ class GridManager(object):
             self.dwell_time[grid_number] = dwell_time
         else:
             self.dwell_time.append(dwell_time)
-        self.cfg['grids']['dwell_time'] = str(self.dwell_time)
+        self.cfg.set_value('grids', 'dwell_time', self.dwell_time)
 
     def get_dwell_time_selector(self, grid_number):
         return self.dwell_time_selector[grid_number]
@@ -287,14 +305,14 @@ class GridManager(object):
             self.dwell_time_selector[grid_number] = selector
         else:
             self.dwell_time_selector.append(selector)
-        self.cfg['grids']['dwell_time_selector'] = str(
-            self.dwell_time_selector)
+        self.cfg.set_value('grids', 'dwell_time_selector',
+                           self.dwell_time_selector)
         # Update explict storage of dwell times:
         if grid_number < len(self.dwell_time):
             self.dwell_time[grid_number] = self.sem.DWELL_TIME[selector]
         else:
             self.dwell_time.append(self.sem.DWELL_TIME[selector])
-        self.cfg['grids']['dwell_time'] = str(self.dwell_time)
+        self.cfg.set_value('grids', 'dwell_time', self.dwell_time)
 
     def get_origin_wd(self, grid_number):
         return self.origin_wd[grid_number]
@@ -304,7 +322,7 @@ class GridManager(object):
             self.origin_wd[grid_number] = origin_wd
         else:
             self.origin_wd.append(origin_wd)
-        self.cfg['grids']['origin_wd'] = str(self.origin_wd)
+        self.cfg.set_value('grids', 'origin_wd', self.origin_wd)
 
     def get_tile_wd(self, grid_number, tilenumber):
         return(self.grid_map_d[grid_number][tilenumber][3])
@@ -312,13 +330,56 @@ class GridManager(object):
     def set_tile_wd(self, grid_number, tile_number, wd):
         if grid_number < len(self.grid_map_d):
             self.grid_map_d[grid_number][tile_number][3] = wd
+            self.wd_revision += 1
+
+    def get_wd_revision(self):
+        return self.wd_revision
 
     def get_active_tiles(self, grid_number):
-        if grid_number is not None and grid_number < self.number_grids:
-            return self.active_tiles[grid_number]
+        """Return the active tiles in acquisition order. The list is
+           cached and must not be modified.
+        """
+        if grid_number is not None and grid_number < len(self.active_masks):
+            if self.acq_order[grid_number] is None:
+                self.acq_order[grid_number] = self.sort_acq_order(grid_number)
+            return self.acq_order[grid_number]
         else:
             return []
 
+    def get_all_active_tiles(self):
+        return [self.get_active_tiles(grid_number)
+                for grid_number in range(len(self.active_masks))]
+
+    def is_tile_active(self, grid_number, tile_number):
+        """Return False for tiles that do not exist (for example, tile
+           numbers stored before a grid was made smaller, or -1).
+        """
+        if not 0 <= grid_number < len(self.active_masks):
+            return False
+        mask = self.active_masks[grid_number]
+        if not 0 <= tile_number < len(mask):
+            return False
+        return bool(mask[tile_number])
+
+    def get_active_mask(self, grid_number, active_tiles):
+        rows, cols = self.size[grid_number]
+        mask = np.zeros(rows * cols, dtype=bool)
+        mask[np.array([t for t in active_tiles if 0 <= t < rows * cols],
+                      dtype=int)] = True
+        return mask
+
+    def update_active_tiles(self, grid_number):
+        """Must be called after the active mask of grid_number has been
+           changed.
+        """
+        self.acq_order[grid_number] = None
+        self.number_active_tiles[grid_number] = int(
+            np.count_nonzero(self.active_masks[grid_number]))
+        # The list of active tiles is created when the config is saved:
+        self.cfg.set_value('grids', 'active_tiles', self.get_all_active_tiles)
+        self.cfg.set_value('grids', 'number_active_tiles',
+                           self.number_active_tiles)
+
     def get_number_active_tiles(self, grid_number):
         return self.number_active_tiles[grid_number]
 
@@ -330,22 +391,24 @@ class GridManager(object):
         return sum_active_tiles
 
     def set_active_tiles(self, grid_number, active_tiles):
-        if grid_number < len(self.active_tiles):
-            self.active_tiles[grid_number] = active_tiles
+        mask = self.get_active_mask(grid_number, active_tiles)
+        if grid_number < len(self.active_masks):
+            self.active_masks[grid_number] = mask
         else:
-            self.active_tiles.append(active_tiles)
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
+            self.active_masks.append(mask)
+            self.acq_order.append(None)
+        self.update_active_tiles(grid_number)
 
     def set_number_active_tiles(self, grid_number, number):
         if grid_number < len(self.number_active_tiles):
             self.number_active_tiles[grid_number] = number
         else:
             self.number_active_tiles.append(number)
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.cfg.set_value('grids', 'number_active_tiles',
+                           self.number_active_tiles)
 
     def get_active_tile_str_list(self, grid_number):
-        return ['Tile %d' % t for t in self.active_tiles[grid_number]]
+        return ['Tile %d' % t for t in self.get_active_tiles(grid_number)]
 
     def get_tile_str_list(self, grid_number):
         return ['Tile %d' % t
@@ -363,7 +426,7 @@ class GridManager(object):
             self.acq_interval[grid_number] = interval
         else:
             self.acq_interval.append(interval)
-        self.cfg['grids']['acq_interval'] = str(self.acq_interval)
+        self.cfg.set_value('grids', 'acq_interval', self.acq_interval)
 
     def get_acq_interval_offset(self, grid_number):
         return self.acq_interval_offset[grid_number]
@@ -373,8 +436,8 @@ class GridManager(object):
             self.acq_interval_offset[grid_number] = offset
         else:
             self.acq_interval_offset.append(offset)
-        self.cfg['grids']['acq_interval_offset'] = str(
-            self.acq_interval_offset)
+        self.cfg.set_value('grids', 'acq_interval_offset',
+                           self.acq_interval_offset)
 
     def is_intervallic_acq_active(self):
         sum_intervals = 0
@@ -407,7 +470,7 @@ class GridManager(object):
             self.af_tiles[grid_number] = af_tiles
         else:
             self.af_tiles.append(af_tiles)
-        self.cfg['grids']['adaptive_focus_tiles'] = str(self.af_tiles)
+        self.cfg.set_value('grids', 'adaptive_focus_tiles', self.af_tiles)
 
     def get_adaptive_focus_gradient(self, grid_number):
         return self.af_gradient[grid_number]
@@ -417,7 +480,8 @@ class GridManager(object):
             self.af_gradient[grid_number] = af_gradient
         else:
             self.af_gradient.append(af_gradient)
-        self.cfg['grids']['adaptive_focus_gradient'] = str(self.af_gradient)
+        self.cfg.set_value('grids', 'adaptive_focus_gradient',
+                           self.af_gradient)
 
     def is_adaptive_focus_active(self, grid_number=-1):
         if grid_number == -1:
@@ -438,7 +502,7 @@ class GridManager(object):
             self.af_active[grid_number] = 1
         else:
             self.af_active[grid_number] = 0
-        self.cfg['grids']['use_adaptive_focus'] = str(self.af_active)
+        self.cfg.set_value('grids', 'use_adaptive_focus', self.af_active)
 
     def get_af_tile_str_list(self, grid_number):
         return ['Tile %d' % t for t in self.af_tiles[grid_number]]
@@ -446,25 +510,19 @@ class GridManager(object):
     def update_active_tiles_to_new_grid_size(self, grid_number, new_size):
         current_rows, current_cols = self.size[grid_number]
         new_rows, new_cols = new_size
-        new_active_tiles = []
-        # Calculate new active tiles or delete active tiles if no longer in grid:
-        for tile_number in self.active_tiles[grid_number]:
-            # Calculate coordinate in grid of current size:
-            x_pos = tile_number % current_cols
-            y_pos = tile_number // current_cols
-            # Calculate tile number in new grid:
-            if (x_pos < new_cols) and (y_pos < new_rows):
-                new_tile_number = x_pos + y_pos * new_cols
-                new_active_tiles.append(new_tile_number)
-        # Save new active tiles:
-        self.active_tiles[grid_number] = new_active_tiles
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
-        self.number_active_tiles[grid_number] = len(new_active_tiles)
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        # Keep the active tiles at the same row/column positions, delete
+        # active tiles that are no longer in the grid:
+        current_mask = self.active_masks[grid_number].reshape(
+            current_rows, current_cols)
+        new_mask = np.zeros((new_rows, new_cols), dtype=bool)
+        rows, cols = min(current_rows, new_rows), min(current_cols, new_cols)
+        new_mask[:rows, :cols] = current_mask[:rows, :cols]
+        self.active_masks[grid_number] = new_mask.ravel()
+        self.update_active_tiles(grid_number)
 
     def calculate_grid_map(self, grid_number):
         # Calculating tile positions in SEM coordinates, unit: micrometres
+        self.wd_revision += 1
         rows, cols = self.size[grid_number]
         width_p, height_p = self.tile_size_px_py[grid_number]
         pixel_size = self.pixel_size[grid_number]
@@ -492,7 +550,7 @@ class GridManager(object):
                 self.grid_map_d[grid_number][tile_number] = [
                     (x_coord + x_shift) * pixel_size / 1000,       # x
                     y_coord * pixel_size / 1000,                   # y
-                    tile_number in self.active_tiles[grid_number], # tile active?
+                    self.is_tile_active(grid_number, tile_number), # active?
                     self.origin_wd[grid_number]
                     + x_pos * wd_delta_x
                     + y_pos * wd_delta_y]                          # wd
@@ -509,7 +567,7 @@ class GridManager(object):
         self.af_tiles[grid_number][0] += diff
         self.af_tiles[grid_number][1] += diff
         self.af_tiles[grid_number][2] += diff
-        self.cfg['grids']['adaptive_focus_tiles'] = str(self.af_tiles)
+        self.cfg.set_value('grids', 'adaptive_focus_tiles', self.af_tiles)
         self.calculate_focus_map(grid_number)
 
     def calculate_focus_map(self, grid_number):
@@ -540,8 +598,8 @@ class GridManager(object):
 
             if success:
                 self.af_gradient[grid_number] = [wd_delta_x, wd_delta_y]
-                self.cfg['grids']['adaptive_focus_gradient'] = str(
-                    self.af_gradient)
+                self.cfg.set_value('grids', 'adaptive_focus_gradient',
+                                   self.af_gradient)
                 # Calculate wd at the origin of the tiling:
                 x_diff_origin = af_tiles[0] % row_length
                 y_diff_origin = af_tiles[0] // row_length
@@ -549,7 +607,7 @@ class GridManager(object):
                       self.grid_map_d[grid_number][af_tiles[0]][3]
                       - (x_diff_origin * wd_delta_x)
                       - (y_diff_origin * wd_delta_y))
-                self.cfg['grids']['origin_wd'] = str(self.origin_wd)
+                self.cfg.set_value('grids', 'origin_wd', self.origin_wd)
 
                 # Update wd for full grid:
                 for y_pos in range(0, self.size[grid_number][0]):
@@ -595,40 +653,28 @@ class GridManager(object):
         return file_name
 
     def sort_acq_order(self, grid_number):
+        """Return the list of active tiles in acquisition order."""
         # Use snake pattern to minimize number of long motor moves:
         rows = self.size[grid_number][0]
         cols = self.size[grid_number][1]
-        ordered_active_tiles = []
-
-        for row_pos in range(rows):
-            if (row_pos % 2 == 0):
-                start_col, end_col, step = 0, cols, 1
-            else:
-                start_col, end_col, step = cols-1, -1, -1
-            for col_pos in range(start_col, end_col, step):
-                tile_number = row_pos * cols + col_pos
-                if tile_number in self.active_tiles[grid_number]:
-                    ordered_active_tiles.append(tile_number)
-
-        self.active_tiles[grid_number] = ordered_active_tiles
+        order = np.arange(rows * cols).reshape(rows, cols)
+        order[1::2] = order[1::2, ::-1]
+        order = order.ravel()
+        return order[self.active_masks[grid_number][order]].tolist()
 
     def select_tile(self, grid_number, tile_number):
-        self.grid_map_d[grid_number][tile_number][2] = True
-        self.active_tiles[grid_number].append(tile_number)
-        self.number_active_tiles[grid_number] += 1
-        self.sort_acq_order(grid_number)
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.set_tiles_active(grid_number, [tile_number], True)
 
     def deselect_tile(self, grid_number, tile_number):
-        self.grid_map_d[grid_number][tile_number][2] = False
-        self.active_tiles[grid_number].remove(tile_number)
-        self.number_active_tiles[grid_number] -= 1
-        self.sort_acq_order(grid_number)
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.set_tiles_active(grid_number, [tile_number], False)
+
+    def set_tiles_active(self, grid_number, tile_numbers, active):
+        """Select (active=True) or deselect the tiles in tile_numbers."""
+        mask = self.active_masks[grid_number]
+        for tile_number in tile_numbers:
+            mask[tile_number] = active
+            self.grid_map_d[grid_number][tile_number][2] = active
+        self.update_active_tiles(grid_number)
 
     def toggle_tile(self, grid_number, tile_number):
         if self.grid_map_d[grid_number][tile_number][2]:
@@ -667,25 +713,16 @@ class GridManager(object):
         return self.grid_map_p[grid_number]
 
     def reset_active_tiles(self, grid_number):
-        self.active_tiles[grid_number] = []
+        self.active_masks[grid_number][:] = False
         for i in range(self.size[grid_number][0] * self.size[grid_number][1]):
             self.grid_map_d[grid_number][i][2] = False
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
-        self.number_active_tiles[grid_number] = 0
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.update_active_tiles(grid_number)
 
     def select_all_tiles(self, grid_number):
-        self.active_tiles[grid_number] = []
+        self.active_masks[grid_number][:] = True
         for i in range(self.size[grid_number][0] * self.size[grid_number][1]):
-            self.active_tiles[grid_number].append(i)
             self.grid_map_d[grid_number][i][2] = True
-        self.sort_acq_order(grid_number)
-        self.cfg['grids']['active_tiles'] = str(self.active_tiles)
-        self.number_active_tiles[grid_number] = len(
-            self.active_tiles[grid_number])
-        self.cfg['grids']['number_active_tiles'] = str(
-            self.number_active_tiles)
+        self.update_active_tiles(grid_number)
 
     def get_tile_bounding_box(self, grid_number, tile_number):
         origin_dx, origin_dy = self.cs.get_grid_origin_d(grid_number)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module re-encodes acquired tile and overview images with a lossless
+   TIFF codec in background processes. Each compressed file is verified
+   against the original pixel data before it replaces the original file.
+"""
+
+import os
+import numpy as np
+
+from time import sleep
+from concurrent.futures import ProcessPoolExecutor
+
+from image_io import TIFF_CODECS, is_tiff_codec_available, \
+                     read_image, write_image
+
+
+# Lossless codecs (see image_io.TIFF_CODECS):
+CODECS = [codec for codec in TIFF_CODECS if codec is not None]
+
+
+def compress_tiff(file_name, codec):
+    """Re-encode the TIFF file file_name with the specified codec. Runs in
+       a worker process. The compressed image is first written to a
+       temporary file, read back and compared with the original. Only if
+       the pixel data is identical, the temporary file replaces the original.
+       Return (file_name, original_size, compressed_size, success, msg).
+    """
+    # Extension must be kept, write_image() determines the format from it:
+    root, extension = os.path.splitext(file_name)
+    tmp_file_name = root + '.tmp' + extension
+    original_size = 0
+    compressed_size = 0
+    try:
+        original_size = os.path.getsize(file_name)
+        original_data = read_image(file_name)
+        write_image(tmp_file_name, original_data, compression=codec)
+        if not np.array_equal(original_data, read_image(tmp_file_name)):
+            os.remove(tmp_file_name)
+            return (file_name, original_size, 0, False,
+                    'round-trip check failed')
+        compressed_size = os.path.getsize(tmp_file_name)
+    except Exception as e:
+        if os.path.isfile(tmp_file_name):
+            os.remove(tmp_file_name)
+        return (file_name, original_size, 0, False, str(e))
+    # Swap files. The original may still be opened by another process,
+    # therefore try again after a short delay:
+    for attempt in range(3):
+        try:
+            os.replace(tmp_file_name, file_name)
+            return (file_name, original_size, compressed_size, True, '')
+        except:
+            sleep(1)
+    os.remove(tmp_file_name)
+    return (file_name, original_size, 0, False, 'file could not be replaced')
+
+
+class ImageCompressor(object):
+
+    def __init__(self, config):
+        self.cfg = config
+        self.pool = None
+        self.pending = []
+        self.update_settings()
+
+    def update_settings(self):
+        self.active = (self.cfg['acq']['compress_images'] == 'True')
+        self.codec = self.cfg['acq']['compression_codec']
+        if (self.codec not in CODECS
+                or not is_tiff_codec_available(self.codec)):
+            # Unknown codec or not supported by the installed libtiff:
+            self.codec = 'lzw'
+        self.number_workers = max(
+            1, int(self.cfg['acq']['compression_workers']))
+
+    def is_active(self):
+        return self.active
+
+    def get_codec(self):
+        return self.codec
+
+    def start(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.number_workers)
+
+    def submit(self, file_name):
+        """Queue file_name for compression. Returns immediately."""
+        self.start()
+        self.pending.append(self.pool.submit(compress_tiff,
+                                             file_name, self.codec))
+
+    def get_finished(self):
+        """Return the results of all finished compression jobs without
+           waiting for the others.
+        """
+        finished = []
+        still_pending = []
+        for job in self.pending:
+            if job.done():
+                finished.append(job)
+            else:
+                still_pending.append(job)
+        self.pending = still_pending
+        results = []
+        for job in finished:
+            try:
+                results.append(job.result())
+            except Exception as e:
+                # Worker process failed:
+                results.append((None, 0, 0, False, str(e)))
+        return results
+
+    def number_pending(self):
+        return len(self.pending)
+
+    def shut_down(self):
+        """Wait for all pending jobs and return their results."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        return self.get_finished()
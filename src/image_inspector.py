@@ -17,25 +17,49 @@ import os
 import json
 import numpy as np
 
-from scipy.misc import imresize, imsave
-from scipy.signal import medfilt2d
-from PIL import Image
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from scipy.ndimage import median_filter
 
 import utils
+from monitoring_history import get_histogram, StatsBuffer
+from qc_stats import get_focus_estimate
+from debris_detection import BlockChangeDetector
+from frame_buffer import Frame
+from image_io import read_image, write_image, append_rows, \
+                     get_preview_levels
 
 
 class ImageInspector(object):
 
-    def __init__(self, config, overview_manager):
+    def __init__(self, config, overview_manager, tile_preview_cache,
+                 monitoring_history, stats_cube, frame_store):
         self.cfg = config
         self.ovm = overview_manager
-        self.tile_means = {}
-        self.tile_stddevs = {}
+        self.tile_preview_cache = tile_preview_cache
+        self.monitoring_history = monitoring_history
+        self.stats_cube = stats_cube
+        # Decoded images shared with the other consumers:
+        self.frame_store = frame_store
+        self.base_dir = None
+        # Recent means and stddevs (StatsBuffer) for each tile and OV:
+        self.tile_stats = {}
+        self.tile_histograms = {}
+        self.tile_focus_estimates = {}
         self.tile_reslice_line = {}
-        self.ov_means = {}
-        self.ov_stddevs = {}
+        self.ov_stats = {}
+        self.ov_histograms = {}
         self.ov_images = {}
         self.ov_reslice_line = {}
+        # Median-filtered debris detection ROI of the most recent OV,
+        # ov_number -> [source image, area, kernel size, filtered ROI]:
+        self.ov_filtered_roi = {}
+        self.filter_pool = ThreadPoolExecutor(max_workers=2)
+        # Tile previews are saved in the background:
+        # (created when needed, shut down at the end of a stack):
+        self.preview_pool = None
+        self.preview_jobs = []
+        self.block_change_detector = BlockChangeDetector()
         self.prev_img_mean_stddev = [0, 0]
 
         self.update_acq_settings()
@@ -43,6 +67,11 @@ class ImageInspector(object):
         self.update_monitoring_settings()
 
     def update_acq_settings(self):
+        if self.cfg['acq']['base_dir'] != self.base_dir:
+            # New stack: statistics of the previous stack no longer needed
+            self.monitoring_history.reset()
+            self.stats_cube.reset()
+            self.block_change_detector.reset()
         self.base_dir = self.cfg['acq']['base_dir']
 
     def update_debris_settings(self):
@@ -60,6 +89,13 @@ class ImageInspector(object):
             self.cfg['debris']['image_diff_hist_lower_limit'])
         self.histogram_diff_threshold = int(
             self.cfg['debris']['histogram_diff_threshold'])
+        self.block_size = int(self.cfg['debris']['block_size'])
+        self.block_history_depth = int(
+            self.cfg['debris']['block_history_depth'])
+        self.block_score_threshold = float(
+            self.cfg['debris']['block_score_threshold'])
+        self.block_min_cluster_size = int(
+            self.cfg['debris']['block_min_cluster_size'])
 
     def update_monitoring_settings(self):
         # read params for monitoring image stats of tiles and OVs:
@@ -75,6 +111,24 @@ class ImageInspector(object):
             self.cfg['monitoring']['tile_mean_threshold'])
         self.tile_stddev_threshold = float(
             self.cfg['monitoring']['tile_stddev_threshold'])
+        # Number of previous slices used as baseline for the
+        # slice-by-slice test:
+        self.tile_history_depth = int(
+            self.cfg['monitoring']['tile_history_depth'])
+
+    def get_stats_buffer(self, buffers, key):
+        """Return the stats buffer for key (tile key or OV number). The
+           buffer holds the baseline slices and the current slice.
+        """
+        depth = self.tile_history_depth + 1
+        buffer = buffers.get(key)
+        if buffer is None:
+            buffer = StatsBuffer(depth)
+            buffers[key] = buffer
+        elif buffer.depth != depth:
+            buffer = buffer.resized(depth)
+            buffers[key] = buffer
+        return buffer
 
     def process_tile(self, filename, grid_number, tile_number, slice_number):
         img = None
@@ -84,15 +138,19 @@ class ImageInspector(object):
         grab_incomplete = False
         load_error = False
         tile_selected = False
+        tile_key = ('g' + str(grid_number).zfill(utils.GRID_DIGITS)
+                    + '_' + 't' + str(tile_number).zfill(utils.TILE_DIGITS))
         try:
-            img = Image.open(filename)
+            img = read_image(filename)
             load_error = False
         except:
             load_error = True
 
         if not load_error:
-            img = np.array(img)
-            # calculate mean and stddev:
+            # Share the decoded image with the other consumers:
+            self.frame_store.put(tile_key, Frame(filename, slice_number, img))
+            # calculate histogram (for display), mean and stddev:
+            histogram = get_histogram(img)
             mean = np.mean(img)
             stddev = np.std(img)
             # Compare with previous mean and std to check for same-frame
@@ -112,13 +170,17 @@ class ImageInspector(object):
             else:
                 grab_incomplete = False
 
-            tile_key = ('g' + str(grid_number).zfill(utils.GRID_DIGITS)
-                        + '_' + 't' + str(tile_number).zfill(utils.TILE_DIGITS))
             tile_key_short = str(grid_number) + '.' + str(tile_number)
+            # Kept until the tile is accepted:
+            self.tile_histograms[tile_key] = histogram
+            self.tile_focus_estimates[tile_key] = get_focus_estimate(img)
 
-            # Save preview image:
-            preview = imresize(img, (384, 512))
-            imsave(self.base_dir + '\\workspace\\' + tile_key + '.png', preview)
+            # Save preview images:
+            if self.preview_pool is None:
+                self.preview_pool = ThreadPoolExecutor(max_workers=1)
+            self.preview_jobs.append(self.preview_pool.submit(
+                self.save_tile_previews, img, self.base_dir,
+                grid_number, tile_number))
 
             # Save reslice line in memory:
             # Take a 400-px line from centre of the image:
@@ -126,37 +188,22 @@ class ImageInspector(object):
                 img[int(height/2):int(height/2)+1,
                     int(width/2)-200:int(width/2)+200])
 
-            # Save mean and std in memory:
-            # Add key to dictionary if tile is new:
-            if not tile_key in self.tile_means:
-                self.tile_means[tile_key] = []
-            # Save mean and stddev in tile list:
-            if len(self.tile_means[tile_key]) > 1:
-                # Remove the oldest entry:
-                self.tile_means[tile_key].pop(0)
-            # Add the newest:
-            self.tile_means[tile_key].append((slice_number, mean))
-
-            if not tile_key in self.tile_stddevs:
-                self.tile_stddevs[tile_key] = []
-            if len(self.tile_stddevs[tile_key]) > 1:
-                self.tile_stddevs[tile_key].pop(0)
-            # Add the newest:
-            self.tile_stddevs[tile_key].append((slice_number, stddev))
+            # Save mean and std in memory (a retake of the same slice
+            # replaces the previous entry):
+            stats = self.get_stats_buffer(self.tile_stats, tile_key)
+            stats.append(slice_number, mean, stddev)
 
             if (tile_key_short in self.monitoring_tiles
                 or 'all' in self.monitoring_tiles):
-                if len(self.tile_means[tile_key]) > 1:
-                    diff_mean = abs(self.tile_means[tile_key][0][1]
-                                    - self.tile_means[tile_key][1][1])
-                else:
-                    diff_mean = 0
-
-                if len(self.tile_stddevs[tile_key]) > 1:
-                    diff_stddev = abs(self.tile_stddevs[tile_key][0][1]
-                                      - self.tile_stddevs[tile_key][1][1])
-                else:
-                    diff_stddev = 0
+                # Compare with the rolling median of the previous slices,
+                # so that a single unusual slice does not affect the test:
+                diff_mean, diff_stddev = 0, 0
+                baseline = stats.get_baseline(StatsBuffer.MEAN)
+                if baseline is not None:
+                    diff_mean = abs(mean - baseline[1])
+                baseline = stats.get_baseline(StatsBuffer.STDDEV)
+                if baseline is not None:
+                    diff_stddev = abs(stddev - baseline[1])
                 slice_by_slice_test_passed = (
                     (diff_mean <= self.tile_mean_threshold)
                     and (diff_stddev <= self.tile_stddev_threshold))
@@ -181,23 +228,75 @@ class ImageInspector(object):
                                     slice_number):
         tile_key = ('g' + str(grid_number).zfill(utils.GRID_DIGITS)
                     + '_' + 't' + str(tile_number).zfill(utils.TILE_DIGITS))
+        mean, stddev = self.tile_stats[tile_key].last()[1:]
         # Write mean, stddev to file:
         stat_filename = self.base_dir + '\\meta\\stats\\' + tile_key + '.dat'
         with open(stat_filename, 'a') as file:
             file.write(str(slice_number).zfill(utils.SLICE_DIGITS)
-                       + ';' + str(self.tile_means[tile_key][-1][1])
-                       + ';' + str(self.tile_stddevs[tile_key][-1][1]) + '\n')
-
-        # Open reslice file if it exists:
+                       + ';' + str(mean) + ';' + str(stddev) + '\n')
+        # Make stats available to the monitoring tab:
+        self.monitoring_history.add(
+            tile_key, slice_number, mean, stddev,
+            self.tile_histograms.get(tile_key))
+        # Add to stats cube for QC dashboard:
+        self.stats_cube.add_tile(
+            grid_number, tile_number, slice_number, mean, stddev,
+            self.tile_focus_estimates.get(tile_key, np.nan))
+
+        # Add line to reslice file (created if it does not exist):
         reslice_filename = (self.base_dir + '\\workspace\\reslices\\r_'
                             + tile_key + '.png')
-        if os.path.isfile(reslice_filename):
-            reslice_img = np.array(Image.open(reslice_filename))
-            new_reslice_img = np.concatenate(
-                (reslice_img, self.tile_reslice_line[tile_key]))
-            imsave(reslice_filename, new_reslice_img)
-        else:
-            imsave(reslice_filename, self.tile_reslice_line[tile_key])
+        append_rows(reslice_filename, self.tile_reslice_line[tile_key])
+
+    def save_tile_previews(self, img, base_dir, grid_number, tile_number):
+        """Save the preview levels of a tile image (run in preview_pool)."""
+        try:
+            levels = get_preview_levels(img, utils.TILE_PREVIEW_WIDTH,
+                                        utils.TILE_PREVIEW_LEVELS)
+            for level, preview in enumerate(levels):
+                write_image(base_dir + '\\'
+                            + utils.get_tile_preview_save_path(
+                                grid_number, tile_number, level),
+                            preview)
+            # Remove finer levels from a previous (larger) tile image:
+            for level in range(len(levels), utils.TILE_PREVIEW_LEVELS):
+                file_name = (base_dir + '\\'
+                             + utils.get_tile_preview_save_path(
+                                 grid_number, tile_number, level))
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+        finally:
+            # Viewport must reload the previews:
+            self.tile_preview_cache.invalidate(grid_number, tile_number)
+
+    def get_preview_errors(self):
+        """Return the error messages of the finished preview jobs that
+           have failed, and remove the finished jobs.
+        """
+        errors = []
+        still_pending = []
+        for job in self.preview_jobs:
+            if not job.done():
+                still_pending.append(job)
+            elif job.exception() is not None:
+                errors.append(str(job.exception()))
+        self.preview_jobs = still_pending
+        return errors
+
+    def shut_down_previews(self):
+        """Wait for all preview jobs and return the errors of the failed
+           ones.
+        """
+        if self.preview_pool is not None:
+            self.preview_pool.shutdown(wait=True)
+            self.preview_pool = None
+        return self.get_preview_errors()
+
+    def add_tile_rejection(self, grid_number, tile_number, slice_number):
+        """Count a tile image that was not accepted (the tile is acquired
+           again or the acquisition is paused).
+        """
+        self.stats_cube.add_rejection(grid_number, tile_number, slice_number)
 
     def process_ov(self, filename, ov_number, slice_number):
         """Load overview image from disk and perform standard tests."""
@@ -208,12 +307,14 @@ class ImageInspector(object):
         range_test_passed = False
         # Try to load OV from disk:
         try:
-            ov_img = Image.open(filename)
+            ov_img = read_image(filename)
         except:
             load_error = True
 
         if not load_error:
-            ov_img = np.array(ov_img)
+            self.frame_store.put(
+                'OV' + str(ov_number).zfill(utils.OV_DIGITS),
+                Frame(filename, slice_number, ov_img))
             height, width = ov_img.shape[0], ov_img.shape[1]
 
             # Was complete image grabbed? Test if final line of image is black:
@@ -221,28 +322,18 @@ class ImageInspector(object):
             grab_incomplete = (np.min(final_line) == np.max(final_line))
 
             if not ov_number in self.ov_images:
-                self.ov_images[ov_number] = []
-            if len(self.ov_images[ov_number]) > 1:
                 # Only keep the current and the previous OV
-                self.ov_images[ov_number].pop(0)
+                self.ov_images[ov_number] = deque(maxlen=2)
             self.ov_images[ov_number].append((slice_number, ov_img))
 
-            # Calculate mean and standard deviation:
+            # Calculate histogram, mean and standard deviation:
+            self.ov_histograms[ov_number] = get_histogram(ov_img)
             mean = np.mean(ov_img)
             stddev = np.std(ov_img)
 
-            # Save mean and stddev in lists:
-            if not ov_number in self.ov_means:
-                self.ov_means[ov_number] = []
-            if len(self.ov_means[ov_number]) > 1:
-                self.ov_means[ov_number].pop(0)
-            self.ov_means[ov_number].append(mean)
-
-            if not ov_number in self.ov_stddevs:
-                self.ov_stddevs[ov_number] = []
-            if len(self.ov_stddevs[ov_number]) > 1:
-                self.ov_stddevs[ov_number].pop(0)
-            self.ov_stddevs[ov_number].append(stddev)
+            # Save mean and stddev in memory:
+            self.get_stats_buffer(self.ov_stats, ov_number).append(
+                slice_number, mean, stddev)
 
             # Keep central 400px line in memory for reslice.
             # Only saved to disk later (in statistics file) if OV accepted.
@@ -259,35 +350,34 @@ class ImageInspector(object):
                 range_test_passed, load_error, grab_incomplete)
 
     def save_ov_reslice_and_stats(self, ov_number, slice_number):
+        mean, stddev = self.ov_stats[ov_number].last()[1:]
         # Write mean, stddev to file:
         stats_filename = (self.base_dir + '\\meta\\stats\\OV'
                           + str(ov_number).zfill(utils.OV_DIGITS) + '.dat')
         with open(stats_filename, 'a') as file:
             file.write(str(slice_number) + ';'
-                       + str(self.ov_means[ov_number][-1]) + ';'
-                       + str(self.ov_stddevs[ov_number][-1]) + '\n')
+                       + str(mean) + ';' + str(stddev) + '\n')
+        self.monitoring_history.add(
+            'OV' + str(ov_number).zfill(utils.OV_DIGITS), slice_number,
+            mean, stddev, self.ov_histograms.get(ov_number))
+        # Accepted OV: its change map is part of the normal variation:
+        self.block_change_detector.accept(ov_number)
 
         # Reslice:
-        # Open reslice file if it exists:
+        # Add line to reslice file (created if it does not exist):
         reslice_filename = (self.base_dir
                             + '\\workspace\\reslices\\r_OV'
                             + str(ov_number).zfill(utils.OV_DIGITS)
                             + '.png')
-        if os.path.isfile(reslice_filename):
-            reslice_img = np.array(Image.open(reslice_filename))
-            new_reslice_img = np.concatenate(
-                (reslice_img, self.ov_reslice_line[ov_number]))
-            imsave(reslice_filename, new_reslice_img)
-        else:
-            imsave(reslice_filename, self.ov_reslice_line[ov_number])
+        append_rows(reslice_filename, self.ov_reslice_line[ov_number])
 
     def detect_debris(self, ov_number, method):
         debris_detected = False
         msg = 'CTRL: No debris detection method selected.'
         ov_roi = [None, None]
         # Crop to current debris detection area:
-        top_left_px, top_left_py, bottom_right_px, bottom_right_py = (
-            self.ovm.get_ov_debris_detection_area(ov_number))
+        area = list(self.ovm.get_ov_debris_detection_area(ov_number))
+        top_left_px, top_left_py, bottom_right_px, bottom_right_py = area
         for i in range(2):
             ov_img = self.ov_images[ov_number][i][1]
             ov_roi[i] = ov_img[top_left_py:bottom_right_py,
@@ -351,20 +441,15 @@ class ImageInspector(object):
             # specified threshold.
 
             # Apply median filter to denoise images:
-            ov_curr = medfilt2d(ov_roi[1], self.median_filter_kernel_size)
-            ov_prev = medfilt2d(ov_roi[0], self.median_filter_kernel_size)
+            ov_prev, ov_curr = self.get_filtered_rois(ov_number, area, ov_roi)
 
             # Pixel difference
             # Recast as int16 before subtraction:
-            ov_curr = ov_curr.astype(np.int16)
-            ov_prev = ov_prev.astype(np.int16)
-            ov_diff_img = np.absolute(np.subtract(ov_curr, ov_prev))
-            # Histogram of difference image:
-            diff_histogram, bin_edges = np.histogram(ov_diff_img, 256, [0, 256])
-            # Compute sum for counts above lower limit:
-            diff_sum = 0
-            for i in range(self.image_diff_hist_lower_limit, 256):
-                diff_sum += diff_histogram[i]
+            ov_diff_img = np.absolute(
+                ov_curr.astype(np.int16) - ov_prev.astype(np.int16))
+            # Count of difference image histogram above lower limit:
+            diff_sum = np.count_nonzero(
+                ov_diff_img >= self.image_diff_hist_lower_limit)
             threshold = self.image_diff_threshold * height * width / 1e6
             msg = ('CTRL: OV: image_diff_hist_sum: ' + str(diff_sum)
                    + ' (curr. threshold: ' + str(int(threshold)) + ')')
@@ -373,31 +458,78 @@ class ImageInspector(object):
         if method == 2:
             # Compare histograms directly (this is not very effective,
             # for testing purposes.)
-            hist_diff_sum = 0
             # Histogram from previous OV:
-            hist1, bin_edges = np.histogram(ov_roi[0], 256, [0, 256])
+            hist1 = get_histogram(ov_roi[0]).astype(np.int64)
             # Histogram from current OV
-            hist2, bin_edges = np.histogram(ov_roi[1], 256, [0, 256])
-            for i in range(256):
-                hist_diff_sum += abs(hist1[i] - hist2[i])
+            hist2 = get_histogram(ov_roi[1]).astype(np.int64)
+            hist_diff_sum = np.sum(np.absolute(hist1 - hist2))
             threshold = self.histogram_diff_threshold * height * width / 1e6
 
             msg = ('CTRL: OV: hist_diff_sum: ' + str(hist_diff_sum)
                    + ' (curr. threshold: ' + str(int(threshold)) + ')')
             debris_detected = (hist_diff_sum > threshold)
 
+        if method == 3:
+            # Block-wise change map, compared to the normal slice-to-slice
+            # changes of each block:
+            (debris_detected, number_outliers,
+             largest_cluster, history_length) = (
+                self.block_change_detector.detect(
+                    ov_number, ov_roi[0], ov_roi[1], area,
+                    self.ovm.get_ov_debris_tile_areas(ov_number),
+                    self.block_size, self.block_history_depth,
+                    self.block_score_threshold, self.block_min_cluster_size))
+            msg = ('CTRL: OV: outlier blocks: ' + str(number_outliers)
+                   + ', largest cluster: ' + str(largest_cluster)
+                   + ' (curr. threshold: '
+                   + str(self.block_min_cluster_size)
+                   + '; baseline: ' + str(history_length) + ' slices)')
+
         return debris_detected, msg
 
+    def get_filtered_rois(self, ov_number, area, ov_roi):
+        """Return the median-filtered ROIs of the previous and the current
+           OV. The filtered ROI of the previous OV is taken from the
+           previous check if the image, the area and the kernel size are
+           unchanged. Otherwise both ROIs are filtered concurrently.
+        """
+        kernel_size = self.median_filter_kernel_size
+        prev_img = self.ov_images[ov_number][0][1]
+        curr_img = self.ov_images[ov_number][1][1]
+        curr_job = self.filter_pool.submit(
+            median_filter, ov_roi[1], kernel_size)
+        cached = self.ov_filtered_roi.get(ov_number)
+        if (cached is not None and cached[0] is prev_img
+                and cached[1] == area and cached[2] == kernel_size):
+            ov_prev = cached[3]
+        else:
+            ov_prev = median_filter(ov_roi[0], kernel_size)
+        ov_curr = curr_job.result()
+        # The current OV will be the previous OV in the next check:
+        self.ov_filtered_roi[ov_number] = [
+            curr_img, area, kernel_size, ov_curr]
+        return ov_prev, ov_curr
+
     def discard_last_ov(self, ov_number):
-        if self.ov_means and self.ov_stddevs:
-            # Delete last entries in means/stddevs list:
-            self.ov_means[ov_number].pop()
-            self.ov_stddevs[ov_number].pop()
+        if ov_number in self.ov_stats:
+            # Delete last entry in means/stddevs buffer:
+            self.ov_stats[ov_number].pop()
         if self.ov_images:
             # Delete last image:
-            self.ov_images[ov_number].pop()
+            ov_img = self.ov_images[ov_number].pop()[1]
+            cached = self.ov_filtered_roi.get(ov_number)
+            if cached is not None and cached[0] is ov_img:
+                del self.ov_filtered_roi[ov_number]
+        self.block_change_detector.discard(ov_number)
+
+    def reserve_tile_stats(self, number_grids, number_tiles):
+        """Preallocate the stats cube for number_grids grids with up to
+           number_tiles tiles each.
+        """
+        self.stats_cube.reserve(number_grids, number_tiles)
 
     def reset_tile_stats(self):
-        self.tile_means = {}
-        self.tile_stddevs = {}
+        self.tile_stats = {}
+        self.tile_histograms = {}
+        self.tile_focus_estimates = {}
         self.tile_reslice_line = {}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides all reading, writing and resizing of image files,
+   so that image I/O can be profiled and tuned in one place.
+   Images are read as numpy arrays in their native dtype (uint8 or uint16).
+   Images written for display (previews, reslices, workspace images) are
+   converted to uint8 with to_uint8(). All functions are thread-safe; the
+   PIL and Qt decoders release the GIL, so images can be decoded in a
+   thread pool.
+"""
+
+import io
+import os
+import numpy as np
+
+from PIL import Image
+from PyQt5.QtGui import QPixmap, QImage
+
+
+# PIL modes that can be read directly from an uncompressed TIFF file:
+RAW_DTYPES = {'L': np.uint8, 'I;16': '<u2', 'I;16B': '>u2'}
+
+# Compression options for write_image() and the corresponding PIL/libtiff
+# compression names:
+TIFF_CODECS = {
+    None: 'raw',
+    'lzw': 'tiff_lzw',
+    'deflate': 'tiff_adobe_deflate',
+    'zstd': 'zstd'
+}
+# zlib level for PNG files: previews and reslices are rewritten often,
+# so speed is more important than file size:
+PNG_COMPRESS_LEVEL = 1
+
+
+def read_image(file_name, as_uint8=False):
+    """Read an image file into a numpy array. Uncompressed TIFF files (as
+       saved by SmartSEM) are read in a single call directly from the file
+       at the offset of the pixel data, without PIL decoding. Other files
+       are decoded with PIL. If as_uint8 is True, the image is converted to
+       8-bit greyscale.
+    """
+    with Image.open(file_name) as img:
+        width, height = img.size
+        offset = get_raw_offset(img)
+        if offset is None:
+            if as_uint8 and img.mode not in RAW_DTYPES:
+                return np.array(img.convert('L'))
+            pixels = np.array(img)
+            return to_uint8(pixels) if as_uint8 else pixels
+        dtype = RAW_DTYPES[img.mode]
+    # Not memory-mapped: an open mapping would prevent the file from
+    # being replaced (compression) or deleted on Windows.
+    pixels = np.fromfile(file_name, dtype=dtype,
+                         count=width * height, offset=offset)
+    pixels = pixels.reshape(height, width)
+    return to_uint8(pixels) if as_uint8 else pixels
+
+def get_raw_offset(img):
+    """Return the file offset of the pixel data if img is stored as
+       contiguous uncompressed strips, otherwise None.
+    """
+    if img.mode not in RAW_DTYPES or not img.tile:
+        return None
+    width, height = img.size
+    bytes_per_line = width * np.dtype(RAW_DTYPES[img.mode]).itemsize
+    offset = img.tile[0][2]
+    expected_offset, expected_y = offset, 0
+    for tile in img.tile:
+        decoder, (x0, y0, x1, y1), tile_offset, args = tile[:4]
+        if (decoder != 'raw' or args[0] != img.mode
+                or (len(args) > 1 and args[1] not in (0, bytes_per_line))
+                or (len(args) > 2 and args[2] != 1)
+                or x0 != 0 or x1 != width or y0 != expected_y
+                or tile_offset != expected_offset):
+            return None
+        expected_y = y1
+        expected_offset += (y1 - y0) * bytes_per_line
+    if expected_y != height:
+        return None
+    return offset
+
+def to_uint8(img):
+    """Convert img to uint8 (16-bit images: upper 8 bits)."""
+    if img.dtype == np.uint8:
+        return img
+    if img.dtype == np.uint16:
+        return (img >> 8).astype(np.uint8)
+    if img.dtype == bool:
+        return img.astype(np.uint8) * 255
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def downsample(img, factor):
+    """Reduce img by an integer factor by averaging blocks of
+       factor x factor pixels. Incomplete blocks at the right and bottom are
+       ignored.
+    """
+    if factor <= 1:
+        return img
+    height = img.shape[0] // factor * factor
+    width = img.shape[1] // factor * factor
+    blocks = img[:height, :width].reshape(
+        height // factor, factor, width // factor, factor)
+    if img.dtype in (np.uint8, np.uint16):
+        # Integer sums are much faster than mean() (float64):
+        return (blocks.sum(axis=(1, 3), dtype=np.uint32)
+                // (factor * factor)).astype(img.dtype)
+    return blocks.mean(axis=(1, 3)).astype(img.dtype)
+
+def get_preview_levels(img, width, number_levels):
+    """Return up to number_levels previews (uint8) of img in the order of
+       increasing resolution. The first level is at least width pixels
+       wide (if img is large enough), each further level has twice the
+       resolution of the previous one. Levels that would be wider than img
+       are omitted. The finest level is reduced from img by an integer
+       factor, all other levels from the next finer level.
+    """
+    # Number of levels i with width * 2**i <= image width (at least one):
+    number_levels = min(number_levels,
+                        max(1, (img.shape[1] // width).bit_length()))
+    factor = max(1, img.shape[1] // (width * 2**(number_levels - 1)))
+    levels = [to_uint8(downsample(img, factor))]
+    for i in range(number_levels - 1):
+        levels.insert(0, downsample(levels[0], 2))
+    return levels
+
+def resize(img, size):
+    """Resize img (numpy array) to size (height, width) by area averaging
+       and return a uint8 array. The image is first reduced by the largest
+       possible integer factor, the remaining scaling is done by PIL.
+    """
+    height, width = size
+    factor = int(min(img.shape[0] / height, img.shape[1] / width))
+    reduced = to_uint8(downsample(img, factor))
+    if reduced.shape[0] == height and reduced.shape[1] == width:
+        return reduced
+    return np.array(Image.fromarray(reduced).resize(
+        (width, height), Image.BOX))
+
+def write_image(file_name, img, compression=None):
+    """Write img (numpy array) to file_name. The format is determined by
+       the extension (.png, .bmp, .tif). compression: codec for TIFF files
+       (None, 'lzw', 'deflate', 'zstd') or zlib level for PNG files.
+       BMP files are always written as uint8.
+    """
+    extension = file_name[file_name.rfind('.') + 1:].lower()
+    if extension == 'bmp':
+        Image.fromarray(to_uint8(img)).save(file_name, format='BMP')
+    elif extension == 'png':
+        level = PNG_COMPRESS_LEVEL if compression is None else compression
+        Image.fromarray(img).save(file_name, format='PNG',
+                                  compress_level=level)
+    elif extension in ['tif', 'tiff']:
+        Image.fromarray(img).save(file_name, format='TIFF',
+                                  compression=TIFF_CODECS[compression])
+    else:
+        Image.fromarray(img).save(file_name)
+
+def is_tiff_codec_available(codec):
+    """Return True if PIL/libtiff can encode TIFF files with codec."""
+    try:
+        Image.new('L', (8, 8)).save(io.BytesIO(), format='TIFF',
+                                     compression=TIFF_CODECS[codec])
+        return True
+    except:
+        return False
+
+def append_rows(file_name, rows):
+    """Append rows (numpy array) to the image file_name (created if it does
+       not exist). Used for the reslices, which are stored as uint8.
+    """
+    rows = to_uint8(rows)
+    if os.path.isfile(file_name):
+        rows = np.concatenate((read_image(file_name, as_uint8=True), rows))
+    write_image(file_name, rows)
+
+def convert_image(source_file_name, target_file_name):
+    """Copy an image file in the format given by the target extension.
+       The colour mode (RGB, palette) is preserved. Return the image size
+       (width, height).
+    """
+    with Image.open(source_file_name) as img:
+        img.save(target_file_name)
+        return img.size
+
+def load_pixmap(file_name):
+    """Load an image file as a QPixmap for display (GUI thread only)."""
+    return QPixmap(file_name)
+
+def load_qimage(file_name):
+    """Load an image file as a QImage (can be used in any thread)."""
+    return QImage(file_name)
@@ -24,6 +24,7 @@ import requests
 
 from time import sleep
 from queue import Queue
+from collections import deque
 
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QObject, Qt, QRect, QSize, pyqtSignal, QEvent
@@ -34,6 +35,7 @@ from PyQt5.uic import loadUi
 
 import acq_func
 import utils
+from acq_events import Event, EventBus
 from sem_control import SEM
 from microtome_control import Microtome
 from plasma_cleaner import PlasmaCleaner
@@ -44,6 +46,12 @@ from coordinate_system import CoordinateSystem
 from viewport import Viewport
 from image_inspector import ImageInspector
 from autofocus import Autofocus
+from pixmap_cache import TilePreviewCache
+from monitoring_history import MonitoringHistory
+from qc_stats import StatsCube
+from frame_buffer import FrameStore
+from image_io import load_pixmap
+from config_saver import ConfigSaver
 from dlg_windows import SEMSettingsDlg, MicrotomeSettingsDlg, \
                         GridSettingsDlg, AutofocusSettingsDlg, \
                         EmailMonitoringSettingsDlg, DebrisSettingsDlg, \
@@ -52,7 +60,8 @@ from dlg_windows import SEMSettingsDlg, MicrotomeSettingsDlg, \
                         ApproachDlg, MirrorDriveDlg, ExportDlg, MotorTestDlg, \
                         CalibrationDlg, PreStackDlg, PauseDlg, StubOVDlg, \
                         EHTDlg, GrabFrameDlg, FTSetParamsDlg, AskUserDlg, \
-                        ImportImageDlg, AdjustImageDlg, DeleteImageDlg, AboutBox
+                        ImportImageDlg, AdjustImageDlg, DeleteImageDlg, \
+                        QCDashboardDlg, AboutBox
 
 
 class Trigger(QObject):
@@ -63,12 +72,24 @@ class Trigger(QObject):
 
 class MainControls(QMainWindow):
 
+    # Maximum number of pixels kept in the tile preview cache:
+    TILE_PREVIEW_CACHE_PIXELS = 64 * 10**6
+    # Number of slices for which image statistics are kept in memory
+    # (width of the plots in the monitoring tab):
+    MONITORING_HISTORY_DEPTH = 165
+    # Number of slices kept in the stats cube for the QC dashboard:
+    QC_STATS_DEPTH = 500
+    # Memory for the decoded images of the most recent tiles and OVs:
+    FRAME_STORE_BYTES = 512 * 2**20
+
     def __init__(self, config, sysconfig, config_file, VERSION):
         super(MainControls, self).__init__()
         self.cfg = config
         self.syscfg = sysconfig
         self.cfg_file = config_file # the file name
         self.VERSION = VERSION
+        # Configuration files are written in the background:
+        self.config_saver = ConfigSaver()
         # Show progress of initialization in console window:
         utils.show_progress_in_console(0)
         self.load_gui()
@@ -88,10 +109,15 @@ class MainControls(QMainWindow):
         self.viewport = Viewport(self.cfg, self.sem, self.microtome,
                                  self.ovm, self.gm, self.cs,
                                  self.viewport_trigger,
-                                 self.viewport_queue)
+                                 self.viewport_queue,
+                                 self.tile_preview_cache,
+                                 self.monitoring_history,
+                                 self.frame_store)
         self.viewport.show()
         # Draw the workspace
         self.viewport.mv_draw()
+        # Events from the acquisition threads are passed to the viewport:
+        self.set_up_acq_event_handlers()
 
         # Initialize focus tool:
         self.ft_initialize()
@@ -218,6 +244,7 @@ class MainControls(QMainWindow):
         self.actionStageCalibration.triggered.connect(
             self.open_calibration_dlg)
         self.actionExport.triggered.connect(self.open_export_dlg)
+        self.actionQCDashboard.triggered.connect(self.open_qc_dashboard_dlg)
         # Buttons for testing purposes (third tab)
         self.pushButton_testGetMag.clicked.connect(self.test_get_mag)
         self.pushButton_testSetMag.clicked.connect(self.test_set_mag)
@@ -365,7 +392,8 @@ class MainControls(QMainWindow):
         # in thread:
         self.acq_trigger = Trigger()
         self.acq_trigger.s.connect(self.process_acq_signal)
-        self.acq_queue = Queue()
+        self.acq_events = EventBus(self.acq_trigger)
+        self.acq_event_backlog = deque()
 
         # First log message:
         self.add_to_log('CTRL: SBEMimage Version ' + self.VERSION)
@@ -440,18 +468,41 @@ class MainControls(QMainWindow):
         self.checkBox_plasmaCleaner.setEnabled(self.plc_installed)
         self.actionPlasmaCleanerSettings.setEnabled(self.plc_installed)
 
+        # Cache for tile previews shown in the viewport. Previews are
+        # written by the image inspector and read by the viewport:
+        self.tile_preview_cache = TilePreviewCache(
+            self.TILE_PREVIEW_CACHE_PIXELS)
+
+        # Recent image statistics, written by the image inspector and
+        # shown in the monitoring tab of the viewport:
+        self.monitoring_history = MonitoringHistory(
+            self.MONITORING_HISTORY_DEPTH)
+
+        # Statistics of all tiles for the QC dashboard:
+        self.stats_cube = StatsCube(self.QC_STATS_DEPTH)
+        self.qc_dashboard_dlg = None
+
+        # Decoded images of the most recent tiles and OVs, shared by the
+        # image inspector, the stack acquisition and the viewport:
+        self.frame_store = FrameStore(self.FRAME_STORE_BYTES)
+
         # Set up Image Inspector instance:
-        self.img_inspector = ImageInspector(self.cfg, self.ovm)
+        self.img_inspector = ImageInspector(self.cfg, self.ovm,
+                                            self.tile_preview_cache,
+                                            self.monitoring_history,
+                                            self.stats_cube,
+                                            self.frame_store)
 
         # Set up autofocus instance:
         self.autofocus = Autofocus(self.cfg, self.sem,
-                                   self.acq_queue, self.acq_trigger)
+                                   self.acq_events)
         # Finally, the stack instance:
         self.stack = Stack(self.cfg,
                            self.sem, self.microtome,
                            self.ovm, self.gm, self.cs,
                            self.img_inspector, self.autofocus,
-                           self.acq_queue, self.acq_trigger)
+                           self.acq_events,
+                           self.frame_store)
 
     def try_to_create_directory(self, new_directory):
         """Create directory. If not possible: error message"""
@@ -614,14 +665,13 @@ class MainControls(QMainWindow):
                 self.cfg['sys']['sys_config_file'] = 'this_system.cfg'
             self.cfg_file = dialog.get_file_name()
             # Write all settings to disk
-            file = open('..\\cfg\\' + self.cfg_file, 'w')
-            self.cfg.write(file)
-            file.close()
+            self.config_saver.save('..\\cfg\\' + self.cfg_file, self.cfg)
             # also save system settings:
-            file = open('..\\cfg\\' + self.cfg['sys']['sys_config_file'], 'w')
-            self.syscfg.write(file)
-            file.close()
-            self.add_to_log('CTRL: Settings saved to disk.')
+            self.config_saver.save(
+                '..\\cfg\\' + self.cfg['sys']['sys_config_file'], self.syscfg)
+            # New file: make sure it has been written
+            if self.check_config_saved():
+                self.add_to_log('CTRL: Settings saved to disk.')
             # Show new config file name in status bar:
             self.set_statusbar(
                 'Ready. Active configuration: %s' % self.cfg_file)
@@ -671,7 +721,7 @@ class MainControls(QMainWindow):
 
     def open_adjust_image_dlg(self, selected_img):
         dialog = AdjustImageDlg(self.ovm, self.cs, selected_img,
-                                self.acq_queue, self.acq_trigger)
+                                self.acq_events)
         dialog.exec_()
 
     def open_delete_image_dlg(self):
@@ -722,6 +772,12 @@ class MainControls(QMainWindow):
         dialog = ExportDlg(self.cfg)
         dialog.exec_()
 
+    def open_qc_dashboard_dlg(self):
+        # Not modal, keep a reference while the dialog is open:
+        if self.qc_dashboard_dlg is not None:
+            self.qc_dashboard_dlg.close()
+        self.qc_dashboard_dlg = QCDashboardDlg(self.gm, self.stats_cube)
+
     def open_email_monitoring_dlg(self):
         dialog = EmailMonitoringSettingsDlg(self.cfg, self.stack)
         dialog.exec_()
@@ -756,13 +812,13 @@ class MainControls(QMainWindow):
         dialog.exec_()
 
     def open_approach_dlg(self):
-        # Trigger and queue needed to pass updates to main window (z coordinate)
-        dialog = ApproachDlg(self.microtome, self.acq_queue, self.acq_trigger)
+        # Events needed to pass updates to main window (z coordinate)
+        dialog = ApproachDlg(self.microtome, self.acq_events)
         dialog.exec_()
 
     def open_grab_frame_dlg(self):
         dialog = GrabFrameDlg(self.cfg, self.sem,
-                              self.acq_queue, self.acq_trigger)
+                              self.acq_events)
         dialog.exec_()
 
     def open_eht_dlg(self):
@@ -771,7 +827,7 @@ class MainControls(QMainWindow):
 
     def open_motor_test_dlg(self):
         dialog = MotorTestDlg(self.cfg, self.microtome,
-                              self.acq_queue, self.acq_trigger)
+                              self.acq_events)
         dialog.exec_()
 
     def open_stub_ov_dlg(self):
@@ -785,7 +841,7 @@ class MainControls(QMainWindow):
                            self.stack.get_slice_counter(),
                            self.sem, self.microtome,
                            self.ovm, self.cs,
-                           self.acq_queue, self.acq_trigger)
+                           self.acq_events)
         dialog.exec_()
 
     def open_about_box(self):
@@ -836,117 +892,143 @@ class MainControls(QMainWindow):
             e = QStatusTipEvent(self.statusbar_msg)
         return super().event(e)
 
+    def set_up_acq_event_handlers(self):
+        """Map the events from the acquisition threads to the functions that
+           process them. Each handler is called with the data of the event.
+        """
+        self.acq_event_handlers = {
+            Event.VP_LOG: self.viewport.add_to_viewport_log,
+            Event.OV_SUCCESS: lambda data: self.acquire_ov_success(True),
+            Event.OV_FAILURE: lambda data: self.acquire_ov_success(False),
+            Event.STUB_OV_SUCCESS:
+                lambda data: self.acquire_stub_ov_success(True),
+            Event.STUB_OV_FAILURE:
+                lambda data: self.acquire_stub_ov_success(False),
+            Event.STUB_OV_PREVIEW: self.viewport.mv_show_stub_ov_preview,
+            Event.STUB_OV_ABORT: self.stub_ov_abort,
+            Event.STUB_OV_BUSY: lambda data: self.show_busy_message(
+                'Stub overview acquisition in progress...'),
+            Event.APPROACH_BUSY: lambda data: self.show_busy_message(
+                'Approach cutting in progress...'),
+            Event.STATUS_IDLE: self.show_status_idle,
+            Event.SWEEP_SUCCESS: lambda data: self.sweep_success(True),
+            Event.SWEEP_FAILURE: lambda data: self.sweep_success(False),
+            Event.MOVE_SUCCESS: lambda data: self.move_stage_success(True),
+            Event.MOVE_FAILURE: lambda data: self.move_stage_success(False),
+            Event.FOCUS_ALERT: self.show_focus_alert,
+            Event.MAG_ALERT: self.show_mag_alert,
+            Event.UPDATE_XY: lambda data: self.show_current_stage_xy(),
+            Event.UPDATE_Z: lambda data: self.show_current_stage_z(),
+            Event.UPDATE_PROGRESS: self.show_stack_progress,
+            Event.ASK_DEBRIS_FIRST_OV: self.ask_debris_first_ov,
+            Event.ASK_DEBRIS_CONFIRMATION: self.ask_debris_confirmation,
+            Event.REMOTE_STOP: lambda data: self.remote_stop(),
+            Event.ERROR_PAUSE: lambda data: self.error_pause(),
+            Event.COMPLETION_STOP: lambda data: self.completion_stop(),
+            Event.ACQ_NOT_IN_PROGRESS:
+                lambda data: self.acq_not_in_progress_update_gui(),
+            Event.SAVE_CFG: lambda data: self.save_settings(),
+            Event.ACQ_IND_OV: self.viewport.mv_toggle_ov_acq_indicator,
+            Event.ACQ_IND_TILE:
+                lambda data: self.viewport.mv_toggle_tile_acq_indicator(*data),
+            Event.RESTRICT_GUI: lambda data: self.restrict_gui(True),
+            Event.RESTRICT_VP_GUI:
+                lambda data: self.viewport.restrict_gui(True),
+            Event.UNRESTRICT_GUI: lambda data: self.restrict_gui(False),
+            Event.SHOW_MSG: self.show_remote_message,
+            Event.MV_UPDATE_OV: self.mv_update_ov,
+            Event.GRAB_VP_SCREENSHOT: self.viewport.grab_viewport_screenshot,
+            Event.RELOAD_IMPORTED: self.reload_imported_image,
+            Event.DRAW_MV: lambda data: self.viewport.mv_request_draw(),
+        }
+
     def process_acq_signal(self):
-        """Process signals from acquisition thread. This trigger/queue approach
-           is required to pass information between threads.
+        """Process the events from the acquisition threads. All events that
+           have arrived since the last signal are processed in one batch;
+           consecutive log entries are added to the log in a single step.
+           The events are taken from a backlog, so that the order is
+           preserved if this function is called again while a message box
+           is shown.
         """
-        msg = self.acq_queue.get()
-        if msg == 'OV SUCCESS':
-            self.acquire_ov_success(True)
-        elif msg == 'OV FAILURE':
-            self.acquire_ov_success(False)
-        elif msg == 'STUB OV SUCCESS':
-            self.acquire_stub_ov_success(True)
-        elif msg == 'STUB OV FAILURE':
-            self.acquire_stub_ov_success(False)
-        elif msg == 'STUB OV BUSY':
-            self.show_status_busy()
-            self.set_statusbar(
-                'Stub overview acquisition in progress...')
-        elif msg == 'APPROACH BUSY':
-            self.show_status_busy()
-            self.set_statusbar(
-                'Approach cutting in progress...')
-        elif msg == 'STATUS IDLE':
-            self.label_acqIndicator.setText('')
-            self.set_statusbar(
-                'Ready. Active configuration: %s' % self.cfg_file)
-        elif msg == 'SWEEP SUCCESS':
-            self.sweep_success(True)
-        elif msg == 'SWEEP FAILURE':
-            self.sweep_success(False)
-        elif msg == 'MOVE SUCCESS':
-            self.move_stage_success(True)
-        elif msg == 'MOVE FAILURE':
-            self.move_stage_success(False)
-        elif msg == 'FOCUS ALERT':
-            QMessageBox.warning(
-                self, 'Focus/stigmation change detected',
-                'SBEMimage has detected an unexpected change in '
-                'focus/stigmation parameters. Target settings have been '
-                'restored.', QMessageBox.Ok)
-        elif msg == 'MAG ALERT':
-            QMessageBox.warning(
-                self, 'Magnification change detected',
-                'SBEMimage has detected an unexpected change in '
-                'magnification. Target setting has been restored.',
-                QMessageBox.Ok)
-        elif msg == 'UPDATE XY':
-            self.show_current_stage_xy()
-        elif msg == 'UPDATE Z':
-            self.show_current_stage_z()
-        elif msg == 'UPDATE PROGRESS':
-            self.update_stack_progress()
-            self.show_estimates()
-        elif msg == 'ASK DEBRIS FIRST OV':
-            reply = QMessageBox.question(
-                self, 'Debris on first OV? User input required',
-                'Is the overview image that has just been acquired free from '
-                'debris?',
-                QMessageBox.Yes | QMessageBox.No | QMessageBox.Abort,
-                QMessageBox.Yes)
-            self.stack.set_user_reply(reply)
-        elif msg == 'ASK DEBRIS CONFIRMATION':
-            reply = QMessageBox.question(
-                self, 'Debris detection',
-                'Potential debris has been detected in the area of interest. '
-                'Can you confirm that debris is visible in the detection '
-                'area?',
-                QMessageBox.Yes | QMessageBox.No | QMessageBox.Abort,
-                QMessageBox.Yes)
-            self.stack.set_user_reply(reply)
-        elif msg == 'REMOTE STOP':
-            self.remote_stop()
-        elif msg == 'ERROR PAUSE':
-            self.error_pause()
-        elif msg == 'COMPLETION STOP':
-            self.completion_stop()
-        elif msg == 'ACQ NOT IN PROGRESS':
-            self.acq_not_in_progress_update_gui()
-        elif msg == 'SAVE CFG':
-            self.save_settings()
-        elif msg[:10] == 'ACQ IND OV':
-            self.viewport.mv_toggle_ov_acq_indicator(int(msg[10:]))
-        elif msg[:12] == 'ACQ IND TILE':
-            position = msg[12:].split('.')
-            self.viewport.mv_toggle_tile_acq_indicator(
-                int(position[0]), int(position[1]))
-        elif msg == 'RESTRICT GUI':
-            self.restrict_gui(True)
-        elif msg == 'RESTRICT VP GUI':
-            self.viewport.restrict_gui(True)
-        elif msg == 'UNRESTRICT GUI':
-            self.restrict_gui(False)
-        elif msg[:8] == 'SHOW MSG':
-            QMessageBox.information(self,
-                'Message received from remote server',
-                'Message text: ' + msg[8:],
-                 QMessageBox.Ok)
-        elif msg[:12] == 'MV UPDATE OV':
-            self.viewport.mv_load_overview(int(msg[12:]))
-            self.viewport.mv_draw()
-        elif msg[:18] == 'GRAB VP SCREENSHOT':
-            self.viewport.grab_viewport_screenshot(msg[18:])
-        elif msg[:15] == 'RELOAD IMPORTED':
-            self.viewport.mv_load_imported_image(int(msg[15:]))
-            self.viewport.mv_draw()
-        elif msg == 'DRAW MV':
-            self.viewport.mv_draw()
-        elif msg[:6] == 'VP LOG':
-            self.viewport.add_to_viewport_log(msg[6:])
-        else:
-            # If msg is not a command, show it in log:
-            self.textarea_log.appendPlainText(msg)
+        self.acq_event_backlog.extend(self.acq_events.get_batch())
+        log_entries = []
+        while self.acq_event_backlog:
+            event, data = self.acq_event_backlog.popleft()
+            if event == Event.LOG:
+                log_entries.append(data)
+                continue
+            if log_entries:
+                self.textarea_log.appendPlainText('\n'.join(log_entries))
+                log_entries = []
+            self.acq_event_handlers[event](data)
+        if log_entries:
+            self.textarea_log.appendPlainText('\n'.join(log_entries))
+
+    def stub_ov_abort(self, data):
+        # Show previous stub OV again:
+        self.viewport.mv_load_stub_overview()
+        self.viewport.mv_draw()
+        self.show_status_idle(data)
+
+    def show_busy_message(self, msg):
+        self.show_status_busy()
+        self.set_statusbar(msg)
+
+    def show_status_idle(self, data):
+        self.label_acqIndicator.setText('')
+        self.set_statusbar(
+            'Ready. Active configuration: %s' % self.cfg_file)
+
+    def show_stack_progress(self, data):
+        self.update_stack_progress()
+        self.show_estimates()
+
+    def show_focus_alert(self, data):
+        QMessageBox.warning(
+            self, 'Focus/stigmation change detected',
+            'SBEMimage has detected an unexpected change in '
+            'focus/stigmation parameters. Target settings have been '
+            'restored.', QMessageBox.Ok)
+
+    def show_mag_alert(self, data):
+        QMessageBox.warning(
+            self, 'Magnification change detected',
+            'SBEMimage has detected an unexpected change in '
+            'magnification. Target setting has been restored.',
+            QMessageBox.Ok)
+
+    def ask_debris_first_ov(self, data):
+        reply = QMessageBox.question(
+            self, 'Debris on first OV? User input required',
+            'Is the overview image that has just been acquired free from '
+            'debris?',
+            QMessageBox.Yes | QMessageBox.No | QMessageBox.Abort,
+            QMessageBox.Yes)
+        self.stack.set_user_reply(reply)
+
+    def ask_debris_confirmation(self, data):
+        reply = QMessageBox.question(
+            self, 'Debris detection',
+            'Potential debris has been detected in the area of interest. '
+            'Can you confirm that debris is visible in the detection '
+            'area?',
+            QMessageBox.Yes | QMessageBox.No | QMessageBox.Abort,
+            QMessageBox.Yes)
+        self.stack.set_user_reply(reply)
+
+    def show_remote_message(self, msg):
+        QMessageBox.information(self,
+            'Message received from remote server',
+            'Message text: ' + msg,
+             QMessageBox.Ok)
+
+    def mv_update_ov(self, ov_number):
+        self.viewport.mv_load_overview(ov_number)
+        self.viewport.mv_request_draw()
+
+    def reload_imported_image(self, img_number):
+        self.viewport.mv_load_imported_image(img_number)
+        self.viewport.mv_draw()
 
     def process_viewport_signal(self):
         """Process signals from the viewport."""
@@ -1056,7 +1138,7 @@ class MainControls(QMainWindow):
                     args=(base_dir, ov_selection,
                           self.sem, self.microtome,
                           self.ovm, self.cs,
-                          self.acq_queue, self.acq_trigger,))
+                          self.acq_events,))
                 ov_acq_thread.start()
         else:
             QMessageBox.information(
@@ -1113,6 +1195,9 @@ class MainControls(QMainWindow):
         else:
             self.add_to_log('CTRL: ERROR ocurred during stub overview '
                             'acquisition.')
+            # Previous stub OV origin has been restored, show previous image:
+            self.viewport.mv_load_stub_overview()
+            self.viewport.mv_draw()
 
         self.label_acqIndicator.setText('')
         self.set_statusbar(
@@ -1134,8 +1219,7 @@ class MainControls(QMainWindow):
             move_thread = threading.Thread(target=acq_func.move,
                                            args=(self.microtome,
                                                  target_pos,
-                                                 self.acq_queue,
-                                                 self.acq_trigger,))
+                                                 self.acq_events,))
             move_thread.start()
             self.show_status_busy()
             self.set_statusbar('Stage move in progress...')
@@ -1171,8 +1255,7 @@ class MainControls(QMainWindow):
             QApplication.processEvents()
             user_sweep_thread = threading.Thread(target=acq_func.sweep,
                                                  args=(self.microtome,
-                                                       self.acq_queue,
-                                                       self.acq_trigger,))
+                                                       self.acq_events,))
             user_sweep_thread.start()
             self.show_status_busy()
             self.set_statusbar('Sweep in progress...')
@@ -1315,6 +1398,7 @@ class MainControls(QMainWindow):
             debris_detected0, msg0 = self.img_inspector.detect_debris(0, 0)
             debris_detected1, msg1 = self.img_inspector.detect_debris(0, 1)
             debris_detected2, msg2 = self.img_inspector.detect_debris(0, 2)
+            debris_detected3, msg3 = self.img_inspector.detect_debris(0, 3)
             QMessageBox.information(
                 self, 'Debris detection test results',
                 'Method 0:\n' + str(debris_detected0) + '; ' + msg0
@@ -1322,7 +1406,8 @@ class MainControls(QMainWindow):
                 + self.cfg['debris']['mean_diff_threshold']
                 + ', ' + self.cfg['debris']['stddev_diff_threshold']
                 + '\n\nMethod 1: ' + str(debris_detected1) + '; ' + msg1
-                + '\n\nMethod 2: ' + str(debris_detected2) + '; ' + msg2,
+                + '\n\nMethod 2: ' + str(debris_detected2) + '; ' + msg2
+                + '\n\nMethod 3: ' + str(debris_detected3) + '; ' + msg3,
                 QMessageBox.Ok)
             # Clean up:
             self.img_inspector.discard_last_ov(0)
@@ -1519,19 +1604,34 @@ class MainControls(QMainWindow):
             self.actionLeaveSimulationMode.setEnabled(False)
             self.save_settings()
 
+    def check_config_saved(self):
+        """Wait until the configuration files have been written. Show an
+           error message and return False if saving failed.
+        """
+        self.config_saver.wait()
+        error = self.config_saver.get_error()
+        if error is not None:
+            self.add_to_log('CTRL: Error while saving settings: ' + error)
+            QMessageBox.warning(
+                self, 'Error while saving settings',
+                'The configuration could not be saved: ' + error,
+                QMessageBox.Ok)
+            return False
+        return True
+
     def save_settings(self):
         if self.cfg_file != 'default.ini':
             if self.cfg['sys']['sys_config_file'] == 'system.cfg':
                 # Preserve system.cfg as template, rename:
                 self.cfg['sys']['sys_config_file'] = 'this_system.cfg'
-            cfgfile = open('..\\cfg\\' + self.cfg_file, 'w')
-            self.cfg.write(cfgfile)
-            cfgfile.close()
+            # Report errors of the previous save:
+            error = self.config_saver.get_error()
+            if error is not None:
+                self.add_to_log('CTRL: Error while saving settings: ' + error)
+            self.config_saver.save('..\\cfg\\' + self.cfg_file, self.cfg)
             # Also save system settings:
-            syscfgfile = open('..\\cfg\\'
-                              + self.cfg['sys']['sys_config_file'], 'w')
-            self.syscfg.write(syscfgfile)
-            syscfgfile.close()
+            self.config_saver.save(
+                '..\\cfg\\' + self.cfg['sys']['sys_config_file'], self.syscfg)
             self.add_to_log('CTRL: Settings saved to disk.')
         elif not self.acq_in_progress:
             QMessageBox.information(
@@ -1598,6 +1698,9 @@ class MainControls(QMainWindow):
                 self.viewport.close()
                 QApplication.processEvents()
                 sleep(1)
+                # Finish writing the configuration files:
+                self.check_config_saved()
+                self.config_saver.shut_down()
                 # Recreate status.dat to indicate that program was closed
                 # normally and didn't crash:
                 status_file = open('..\\cfg\\status.dat', 'w+')
@@ -1821,7 +1924,7 @@ class MainControls(QMainWindow):
             filename = (self.cfg['acq']['base_dir']
                         + '\\workspace\\ft' + str(i) + '.bmp')
             self.sem.acquire_frame(filename)
-            self.ft_series_img.append(QPixmap(filename))
+            self.ft_series_img.append(load_pixmap(filename))
         self.sem.set_beam_blanking(1)
         # Display current focus:
         self.ft_index = 4
@@ -1850,7 +1953,7 @@ class MainControls(QMainWindow):
             filename = (self.cfg['acq']['base_dir']
                         + '\\workspace\\ft' + str(i) + '.bmp')
             self.sem.acquire_frame(filename)
-            self.ft_series_img.append(QPixmap(filename))
+            self.ft_series_img.append(load_pixmap(filename))
         self.sem.set_beam_blanking(1)
         # Display at current stigmation setting:
         self.ft_index = 4
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module keeps the recent image statistics (mean, standard deviation
+   and histogram) of all tiles and OVs in memory. The image inspector adds
+   an entry for each accepted image, and the monitoring tab of the viewport
+   reads from here. The statistics files on disk are only read once per
+   tile/OV (for example after a restart in the middle of a stack).
+"""
+
+import os
+import threading
+import numpy as np
+
+from collections import deque
+
+from image_io import to_uint8
+
+
+def get_histogram(img):
+    """Return the 256-bin grey value histogram of img (numpy array). Images
+       that are not 8-bit are converted with to_uint8() first.
+    """
+    return np.bincount(to_uint8(img).ravel(), minlength=256)
+
+def get_mean_stddev(hist):
+    """Calculate mean and standard deviation from a 256-bin histogram
+       (for display only; use the pixel values for image statistics).
+    """
+    values = np.arange(len(hist), dtype=np.float64)
+    number_pixels = hist.sum()
+    mean = np.dot(hist, values) / number_pixels
+    variance = np.dot(hist, (values - mean)**2) / number_pixels
+    return mean, np.sqrt(variance)
+
+def read_last_lines(file_name, number_lines):
+    """Return the last number_lines lines of a text file without reading
+       the entire file.
+    """
+    block_size = 4096
+    with open(file_name, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= number_lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            data = file.read(read_size) + data
+    lines = data.decode('utf-8', errors='ignore').splitlines()
+    return lines[-number_lines:]
+
+
+class StatsBuffer(object):
+    """Fixed-size ring buffer (numpy array) of (slice_number, mean, stddev)
+       for one tile or OV. Appending is O(1) and the memory is bounded by
+       the depth. A slice that is acquired again replaces the previous
+       entry for that slice.
+    """
+
+    MEAN, STDDEV = 1, 2
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.data = np.zeros((depth, 3))
+        # Index of the most recent entry and number of entries:
+        self.newest = -1
+        self.length = 0
+
+    def append(self, slice_number, mean, stddev):
+        if self.length > 0 and self.data[self.newest, 0] == slice_number:
+            self.data[self.newest] = slice_number, mean, stddev
+            return
+        self.newest = (self.newest + 1) % self.depth
+        self.data[self.newest] = slice_number, mean, stddev
+        self.length = min(self.length + 1, self.depth)
+
+    def pop(self):
+        """Remove the most recent entry."""
+        if self.length > 0:
+            self.newest = (self.newest - 1) % self.depth
+            self.length -= 1
+
+    def last(self):
+        """Return (slice_number, mean, stddev) of the most recent entry."""
+        slice_number, mean, stddev = self.data[self.newest]
+        return int(slice_number), mean, stddev
+
+    def get_values(self, column, skip_newest=False):
+        """Return the values of column (MEAN or STDDEV) from the oldest to
+           the most recent (or second most recent) entry.
+        """
+        number = self.length - 1 if skip_newest else self.length
+        if number <= 0:
+            return np.zeros(0)
+        indices = np.arange(self.newest - self.length + 1,
+                            self.newest - self.length + 1 + number)
+        return self.data[indices % self.depth, column]
+
+    def get_baseline(self, column):
+        """Return the rolling mean, median and median absolute deviation of
+           column over the entries before the most recent one, or None if
+           there are no previous entries.
+        """
+        values = self.get_values(column, skip_newest=True)
+        if len(values) == 0:
+            return None
+        median = np.median(values)
+        return np.mean(values), median, np.median(np.absolute(values - median))
+
+    def resized(self, depth):
+        """Return a buffer with the new depth and the most recent entries."""
+        buffer = StatsBuffer(depth)
+        for slice_number, mean, stddev in zip(
+                self.get_values(0), self.get_values(self.MEAN),
+                self.get_values(self.STDDEV)):
+            buffer.append(slice_number, mean, stddev)
+        return buffer
+
+
+class MonitoringHistory(object):
+    """Ring buffers (one per tile/OV) of (slice_number, mean, stddev,
+       histogram) for the most recent slices. Entries are added by the
+       acquisition thread and read by the GUI thread.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        # source_key ('g0000_t0000' or 'OV000') -> deque of entries:
+        self.entries = {}
+        # Sources for which the statistics file has been read:
+        self.disk_checked = set()
+        self.lock = threading.Lock()
+
+    def add(self, source_key, slice_number, mean, stddev, histogram):
+        with self.lock:
+            buffer = self.entries.setdefault(
+                source_key, deque(maxlen=self.depth))
+            # A slice that is acquired again replaces the previous entry:
+            if buffer and buffer[-1][0] == slice_number:
+                buffer.pop()
+            buffer.append([slice_number, mean, stddev, histogram])
+
+    def set_histogram(self, source_key, slice_number, histogram):
+        """Store a histogram calculated from an image on disk."""
+        with self.lock:
+            for entry in self.entries.get(source_key, []):
+                if entry[0] == slice_number:
+                    entry[3] = histogram
+
+    def get_stats(self, source_key, stats_file_name=None):
+        """Return lists of slice numbers, means and stddevs for the
+           specified source. If stats_file_name is given and the file has
+           not been read yet, older entries are loaded from it.
+        """
+        if (stats_file_name is not None
+                and source_key not in self.disk_checked):
+            self.load_stats_file(source_key, stats_file_name)
+        with self.lock:
+            buffer = list(self.entries.get(source_key, []))
+        return ([entry[0] for entry in buffer],
+                [entry[1] for entry in buffer],
+                [entry[2] for entry in buffer])
+
+    def get_histogram(self, source_key, slice_number=None):
+        """Return the histogram of the specified slice (most recent slice
+           if slice_number is None), or None if not in memory.
+        """
+        with self.lock:
+            buffer = self.entries.get(source_key)
+            if not buffer:
+                return None
+            if slice_number is None:
+                return buffer[-1][3]
+            for entry in buffer:
+                if entry[0] == slice_number:
+                    return entry[3]
+        return None
+
+    def get_last_slice_number(self, source_key):
+        with self.lock:
+            buffer = self.entries.get(source_key)
+            if buffer:
+                return buffer[-1][0]
+        return None
+
+    def load_stats_file(self, source_key, stats_file_name):
+        """Read the most recent entries from the statistics file and add
+           those older than the entries already in memory.
+        """
+        disk_entries = []
+        if os.path.isfile(stats_file_name):
+            try:
+                for line in read_last_lines(stats_file_name, self.depth):
+                    values = line.split(';')
+                    disk_entries.append([int(values[0]), float(values[1]),
+                                         float(values[2]), None])
+            except:
+                disk_entries = []
+        with self.lock:
+            buffer = self.entries.get(source_key, deque())
+            if buffer:
+                disk_entries = [entry for entry in disk_entries
+                                if entry[0] < buffer[0][0]]
+            self.entries[source_key] = deque(
+                disk_entries + list(buffer), maxlen=self.depth)
+            self.disk_checked.add(source_key)
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+            self.disk_checked = set()
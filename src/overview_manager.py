@@ -47,6 +47,9 @@ class OverviewManager(object):
             self.cfg['debris']['detection_area'])
         self.auto_debris_area_margin = int(
             self.cfg['debris']['auto_area_margin'])
+        # Areas of the active tiles within each OV in OV pixel coordinates
+        # (not saved in config, updated with the debris detection area):
+        self.debris_tile_areas = {}
         # Stub OV settings:
         # The acq parameters (frame size, dwell time, magnification) can only
         # be changed manually in the config file, are therefore loaded as
@@ -102,39 +105,44 @@ class OverviewManager(object):
         self.update_ov_file_list(new_ov_number, '')
         self.set_ov_debris_detection_area(new_ov_number, [])
         self.number_ov += 1
-        self.cfg['overviews']['number_ov'] = str(self.number_ov)
+        self.cfg.set_value('overviews', 'number_ov', self.number_ov)
 
     def delete_ov(self):
         # Delete last item from each variable:
         self.cs.delete_ov_centre(self.number_ov - 1)
         del self.ov_rotation[-1]
-        self.cfg['overviews']['ov_rotation'] = str(self.ov_rotation)
+        self.cfg.set_value('overviews', 'ov_rotation', self.ov_rotation)
         del self.ov_size_selector[-1]
-        self.cfg['overviews']['ov_size_selector'] = str(self.ov_size_selector)
+        self.cfg.set_value('overviews', 'ov_size_selector',
+                           self.ov_size_selector)
         del self.ov_size_px_py[-1]
-        self.cfg['overviews']['ov_size_px_py'] = str(self.ov_size_px_py)
+        self.cfg.set_value('overviews', 'ov_size_px_py', self.ov_size_px_py)
         del self.ov_magnification[-1]
-        self.cfg['overviews']['ov_magnification'] = str(self.ov_magnification)
+        self.cfg.set_value('overviews', 'ov_magnification',
+                           self.ov_magnification)
         del self.ov_dwell_time[-1]
-        self.cfg['overviews']['ov_dwell_time'] = str(self.ov_dwell_time)
+        self.cfg.set_value('overviews', 'ov_dwell_time', self.ov_dwell_time)
         del self.ov_dwell_time_selector[-1]
-        self.cfg['overviews']['ov_dwell_time_selector'] = str(
-            self.ov_dwell_time_selector)
+        self.cfg.set_value('overviews', 'ov_dwell_time_selector',
+                           self.ov_dwell_time_selector)
         del self.ov_wd[-1]
-        self.cfg['overviews']['ov_wd'] = str(self.ov_wd)
+        self.cfg.set_value('overviews', 'ov_wd', self.ov_wd)
         del self.debris_detection_area[-1]
-        self.cfg['debris']['detection_area'] = str(self.debris_detection_area)
+        self.cfg.set_value('debris', 'detection_area',
+                           self.debris_detection_area)
+        self.debris_tile_areas.pop(self.number_ov - 1, None)
         del self.ov_file_list[-1]
         self.cfg['overviews']['ov_viewport_images'] = json.dumps(
             self.ov_file_list)
         del self.ov_acq_interval[-1]
-        self.cfg['overviews']['ov_acq_interval'] = str(self.ov_acq_interval)
+        self.cfg.set_value('overviews', 'ov_acq_interval',
+                           self.ov_acq_interval)
         del self.ov_acq_interval_offset[-1]
-        self.cfg['overviews']['ov_acq_interval_offset'] = str(
-            self.ov_acq_interval_offset)
+        self.cfg.set_value('overviews', 'ov_acq_interval_offset',
+                           self.ov_acq_interval_offset)
         # Number of OV:
         self.number_ov -= 1
-        self.cfg['overviews']['number_ov'] = str(self.number_ov)
+        self.cfg.set_value('overviews', 'number_ov', self.number_ov)
 
     def get_number_ov(self):
         return self.number_ov
@@ -150,8 +158,8 @@ class OverviewManager(object):
             self.ov_size_selector[ov_number] = size_selector
         else:
             self.ov_size_selector.append(size_selector)
-        self.cfg['overviews']['ov_size_selector'] = str(
-            self.ov_size_selector)
+        self.cfg.set_value('overviews', 'ov_size_selector',
+                           self.ov_size_selector)
         # Update explicit storage of frame size:
         if ov_number < len(self.ov_size_px_py):
             self.ov_size_px_py[ov_number] = (
@@ -159,7 +167,7 @@ class OverviewManager(object):
         else:
             self.ov_size_px_py.append(
                 self.sem.STORE_RES[size_selector])
-        self.cfg['overviews']['ov_size_px_py'] = str(self.ov_size_px_py)
+        self.cfg.set_value('overviews', 'ov_size_px_py', self.ov_size_px_py)
 
     def get_ov_size_px_py(self, ov_number):
         return self.ov_size_px_py[ov_number]
@@ -192,7 +200,7 @@ class OverviewManager(object):
             self.ov_rotation[ov_number] = rotation
         else:
             self.ov_rotation.append(rotation)
-        self.cfg['overviews']['ov_rotation'] = str(self.ov_rotation)
+        self.cfg.set_value('overviews', 'ov_rotation', self.ov_rotation)
 
     def get_ov_magnification(self, ov_number):
         return self.ov_magnification[ov_number]
@@ -202,8 +210,8 @@ class OverviewManager(object):
             self.ov_magnification[ov_number] = mag
         else:
             self.ov_magnification.append(mag)
-        self.cfg['overviews']['ov_magnification'] = str(
-            self.ov_magnification)
+        self.cfg.set_value('overviews', 'ov_magnification',
+                           self.ov_magnification)
 
     def get_ov_pixel_size(self, ov_number):
         return (self.sem.MAG_PX_SIZE_FACTOR
@@ -215,8 +223,7 @@ class OverviewManager(object):
 
     def set_ov_dwell_time(self, ov_number, dwell_time):
         self.ov_dwell_time[ov_number] = dwell_time
-        self.cfg['overviews']['ov_dwell_time'] = str(
-            self.ov_dwell_time)
+        self.cfg.set_value('overviews', 'ov_dwell_time', self.ov_dwell_time)
 
     def get_ov_dwell_time_selector(self, ov_number):
         return self.ov_dwell_time_selector[ov_number]
@@ -226,14 +233,14 @@ class OverviewManager(object):
             self.ov_dwell_time_selector[ov_number] = selector
         else:
             self.ov_dwell_time_selector.append(selector)
-        self.cfg['overviews']['ov_dwell_time_selector'] = str(
-            self.ov_dwell_time_selector)
+        self.cfg.set_value('overviews', 'ov_dwell_time_selector',
+                           self.ov_dwell_time_selector)
         # Update explict storage of dwell times:
         if ov_number < len(self.ov_dwell_time):
             self.ov_dwell_time[ov_number] = self.sem.DWELL_TIME[selector]
         else:
             self.ov_dwell_time.append(self.sem.DWELL_TIME[selector])
-        self.cfg['overviews']['ov_dwell_time'] = str(self.ov_dwell_time)
+        self.cfg.set_value('overviews', 'ov_dwell_time', self.ov_dwell_time)
 
     def get_ov_wd(self, ov_number):
         return self.ov_wd[ov_number]
@@ -243,7 +250,7 @@ class OverviewManager(object):
             self.ov_wd[ov_number] = wd
         else:
             self.ov_wd.append(wd)
-        self.cfg['overviews']['ov_wd'] = str(self.ov_wd)
+        self.cfg.set_value('overviews', 'ov_wd', self.ov_wd)
 
     def get_ov_acq_settings(self, ov_number):
         return [self.ov_size_selector[ov_number],
@@ -259,7 +266,8 @@ class OverviewManager(object):
             self.ov_acq_interval[ov_number] = interval
         else:
             self.ov_acq_interval.append(interval)
-        self.cfg['overviews']['ov_acq_interval'] = str(self.ov_acq_interval)
+        self.cfg.set_value('overviews', 'ov_acq_interval',
+                           self.ov_acq_interval)
 
     def get_ov_acq_interval_offset(self, ov_number):
         return self.ov_acq_interval_offset[ov_number]
@@ -269,8 +277,8 @@ class OverviewManager(object):
             self.ov_acq_interval_offset[ov_number] = offset
         else:
             self.ov_acq_interval_offset.append(offset)
-        self.cfg['overviews']['ov_acq_interval_offset'] = str(
-            self.ov_acq_interval_offset)
+        self.cfg.set_value('overviews', 'ov_acq_interval_offset',
+                           self.ov_acq_interval_offset)
 
     def is_intervallic_acq_active(self):
         sum_intervals = 0
@@ -321,16 +329,16 @@ class OverviewManager(object):
 
     def set_stub_ov_file(self, img_path_file_name):
         self.stub_ov_file = img_path_file_name
-        self.cfg['overviews']['stub_ov_viewport_image'] = str(
-            self.stub_ov_file)
+        self.cfg.set_value('overviews', 'stub_ov_viewport_image',
+                           self.stub_ov_file)
 
     def get_stub_ov_size_selector(self):
         return self.stub_ov_size_selector
 
     def set_stub_ov_size_selector(self, size_selector):
         self.stub_ov_size_selector = size_selector
-        self.cfg['overviews']['stub_ov_size_selector'] = str(
-            self.stub_ov_size_selector)
+        self.cfg.set_value('overviews', 'stub_ov_size_selector',
+                           self.stub_ov_size_selector)
         self.calculate_stub_ov_grid()
 
     def get_stub_ov_grid(self):
@@ -381,7 +389,8 @@ class OverviewManager(object):
         self.set_imported_img_transparency(new_img_number, 0)
 
         self.number_imported += 1
-        self.cfg['overviews']['number_imported'] = str(self.number_imported)
+        self.cfg.set_value('overviews', 'number_imported',
+                           self.number_imported)
 
     def delete_imported_img(self, img_number):
         if img_number < self.number_imported:
@@ -393,21 +402,21 @@ class OverviewManager(object):
             self.cfg['overviews']['imported_names'] = json.dumps(
                 self.imported_names)
             del self.imported_pixel_size[img_number]
-            self.cfg['overviews']['imported_pixel_size'] = str(
-                self.imported_pixel_size)
+            self.cfg.set_value('overviews', 'imported_pixel_size',
+                               self.imported_pixel_size)
             del self.imported_size_px_py[img_number]
-            self.cfg['overviews']['imported_size_px_py'] = str(
-                self.imported_size_px_py)
+            self.cfg.set_value('overviews', 'imported_size_px_py',
+                               self.imported_size_px_py)
             del self.imported_transparency[img_number]
-            self.cfg['overviews']['imported_transparency'] = str(
-                self.imported_transparency)
+            self.cfg.set_value('overviews', 'imported_transparency',
+                               self.imported_transparency)
             del self.imported_rotation[img_number]
-            self.cfg['overviews']['imported_rotation'] = str(
-                self.imported_rotation)
+            self.cfg.set_value('overviews', 'imported_rotation',
+                               self.imported_rotation)
             # Number of imported images:
             self.number_imported -= 1
-            self.cfg['overviews']['number_imported'] = str(
-                self.number_imported)
+            self.cfg.set_value('overviews', 'number_imported',
+                               self.number_imported)
 
     def get_number_imported(self):
         return self.number_imported
@@ -431,8 +440,8 @@ class OverviewManager(object):
             self.imported_rotation[img_number] = angle
         else:
             self.imported_rotation.append(angle)
-        self.cfg['overviews']['imported_rotation'] = str(
-            self.imported_rotation)
+        self.cfg.set_value('overviews', 'imported_rotation',
+                           self.imported_rotation)
 
     def get_imported_img_pixel_size(self, img_number):
         return self.imported_pixel_size[img_number]
@@ -442,8 +451,8 @@ class OverviewManager(object):
             self.imported_pixel_size[img_number] = pixel_size
         else:
             self.imported_pixel_size.append(pixel_size)
-        self.cfg['overviews']['imported_pixel_size'] = str(
-            self.imported_pixel_size)
+        self.cfg.set_value('overviews', 'imported_pixel_size',
+                           self.imported_pixel_size)
 
     def get_imported_img_width_p(self, img_number):
         return self.imported_size_px_py[img_number][0]
@@ -464,8 +473,8 @@ class OverviewManager(object):
             self.imported_size_px_py[img_number] = [px, py]
         else:
             self.imported_size_px_py.append([px, py])
-        self.cfg['overviews']['imported_size_px_py'] = str(
-            self.imported_size_px_py)
+        self.cfg.set_value('overviews', 'imported_size_px_py',
+                           self.imported_size_px_py)
 
     def get_imported_img_file(self, img_number):
         return self.imported_file_list[img_number]
@@ -492,15 +501,16 @@ class OverviewManager(object):
             self.imported_transparency[img_number] = transparency
         else:
             self.imported_transparency.append(transparency)
-        self.cfg['overviews']['imported_transparency'] = str(
-            self.imported_transparency)
+        self.cfg.set_value('overviews', 'imported_transparency',
+                           self.imported_transparency)
 
     def get_ov_auto_debris_detection_area_margin(self):
         return self.auto_debris_area_margin
 
     def set_ov_auto_debris_detection_area_margin(self, margin):
         self.auto_debris_area_margin = margin
-        self.cfg['debris']['auto_area_margin'] = str(self.auto_debris_area_margin)
+        self.cfg.set_value('debris', 'auto_area_margin',
+                           self.auto_debris_area_margin)
 
     def get_ov_debris_detection_area(self, ov_number):
         return self.debris_detection_area[ov_number]
@@ -510,14 +520,22 @@ class OverviewManager(object):
             self.debris_detection_area[ov_number] = list(area)
         else:
             self.debris_detection_area.append(list(area))
-        self.cfg['debris']['detection_area'] = str(
-            self.debris_detection_area)
+        self.cfg.set_value('debris', 'detection_area',
+                           self.debris_detection_area)
+
+    def get_ov_debris_tile_areas(self, ov_number):
+        """Return the list of active tile areas [x0, y0, x1, y1] (including
+           margin) within the OV, or None if the full debris detection area
+           is to be used.
+        """
+        return self.debris_tile_areas.get(ov_number)
 
     def update_all_ov_debris_detections_areas(self, gm):
         for ov_number in range(self.number_ov):
             self.update_ov_debris_detection_area(ov_number, gm)
 
     def update_ov_debris_detection_area(self, ov_number, gm):
+        self.debris_tile_areas[ov_number] = None
         if self.cfg['debris']['auto_detection_area'] == 'False':
             # set full detection area:
             self.set_ov_debris_detection_area(ov_number,
@@ -531,6 +549,7 @@ class OverviewManager(object):
             ov_pixel_size = self.get_ov_pixel_size(ov_number)
             top_left_dx_min, top_left_dy_min = None, None
             bottom_right_dx_max, bottom_right_dy_max = None, None
+            tile_areas = []
             #extra_margin = 20
             # Check all grids for active tile overlap with OV
             for grid_number in range(gm.get_number_grids()):
@@ -549,6 +568,16 @@ class OverviewManager(object):
                         top_left_dy -= ov_top_left_dy
                         bottom_right_dx -= ov_top_left_dx
                         bottom_right_dy -= ov_top_left_dy
+                        # Tile area in OV pixel coordinates with margin:
+                        tile_areas.append([
+                            int(top_left_dx * 1000 / ov_pixel_size)
+                            - self.auto_debris_area_margin,
+                            int(top_left_dy * 1000 / ov_pixel_size)
+                            - self.auto_debris_area_margin,
+                            int(bottom_right_dx * 1000 / ov_pixel_size)
+                            + self.auto_debris_area_margin,
+                            int(bottom_right_dy * 1000 / ov_pixel_size)
+                            + self.auto_debris_area_margin])
 
                         if (top_left_dx_min is None
                             or top_left_dx < top_left_dx_min):
@@ -588,6 +617,7 @@ class OverviewManager(object):
                 bottom_right_py = utils.fit_in_range(
                     bottom_right_py + self.auto_debris_area_margin,
                     0, self.get_ov_height_p(ov_number))
+                self.debris_tile_areas[ov_number] = tile_areas
 
             # set detection area:
             self.set_ov_debris_detection_area(ov_number,
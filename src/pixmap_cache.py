@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides caches for the images displayed in the viewport,
+   so that redrawing the viewport does not require rescaling large images.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+
+import utils
+from image_io import load_pixmap
+
+
+class PyramidCache(object):
+    """Keep downsampled versions (power-of-two levels) of QPixmaps in a
+       size-bounded LRU cache. Levels are generated on demand from the next
+       finer level. Entries are keyed by the cacheKey() of the source
+       pixmap, so a reloaded image automatically gets new entries, and the
+       outdated ones are evicted eventually.
+    """
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.total_pixels = 0
+        self.levels = OrderedDict()
+
+    def select_level(self, source, resize_ratio):
+        """Return the coarsest level that still provides at least the
+           resolution needed for the given resize ratio.
+        """
+        level = 0
+        size = min(source.width(), source.height())
+        while resize_ratio * 2**(level + 1) <= 1 and size >> (level + 1) > 0:
+            level += 1
+        return level
+
+    def get_level(self, source, level):
+        if level == 0:
+            return source
+        key = (source.cacheKey(), level)
+        if key in self.levels:
+            self.levels.move_to_end(key)
+            return self.levels[key]
+        finer = self.get_level(source, level - 1)
+        pixmap = finer.scaled(max(1, finer.width() // 2),
+                              max(1, finer.height() // 2),
+                              Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.levels[key] = pixmap
+        self.total_pixels += pixmap.width() * pixmap.height()
+        self.evict()
+        return pixmap
+
+    def get_scaled_source(self, source, resize_ratio):
+        """Return the pyramid level for the given resize ratio and the
+           resize ratio that must be applied to that level.
+        """
+        level_img = self.get_level(
+            source, self.select_level(source, resize_ratio))
+        return (level_img,
+                resize_ratio * source.width() / level_img.width())
+
+    def evict(self):
+        while self.total_pixels > self.max_pixels and len(self.levels) > 1:
+            key, pixmap = self.levels.popitem(last=False)
+            self.total_pixels -= pixmap.width() * pixmap.height()
+
+    def clear(self):
+        self.levels.clear()
+        self.total_pixels = 0
+
+
+class TilePreviewCache(object):
+    """Keep decoded tile previews and their scaled versions (one per zoom
+       level, i.e. per tile width in viewport pixels) in a size-bounded LRU
+       cache. Each tile has several preview levels (see
+       utils.TILE_PREVIEW_LEVELS); the coarsest level that is at least as
+       wide as the tile in the viewport is shown. Entries are keyed by
+       (grid_number, tile_number, level) and store the modification time of
+       the preview file. The image inspector calls invalidate() when it has
+       written new previews. Only then the files are checked again, so
+       redrawing the viewport does not access the disk.
+       QPixmaps are only created and released in the GUI thread;
+       invalidate() can be called from any thread.
+    """
+
+    # Maximum number of scaled versions kept per preview:
+    MAX_VARIANTS = 2
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.total_pixels = 0
+        self.base_dir = None
+        # (grid_number, tile_number, level) -> [mtime, pixmap, variants]
+        self.entries = OrderedDict()
+        self.stale = set()
+        # Incremented whenever a preview is invalidated:
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self, grid_number, tile_number):
+        with self.lock:
+            for level in range(utils.TILE_PREVIEW_LEVELS):
+                self.stale.add((grid_number, tile_number, level))
+            self.generation += 1
+
+    def get_generation(self):
+        """Return a counter that changes whenever a preview is updated."""
+        with self.lock:
+            return self.generation
+
+    def clear(self):
+        self.entries.clear()
+        self.total_pixels = 0
+        with self.lock:
+            self.stale.clear()
+
+    def get_preview(self, base_dir, grid_number, tile_number, width):
+        """Return the preview of the specified tile scaled to width, or None
+           if no preview is available.
+        """
+        if base_dir != self.base_dir:
+            self.clear()
+            self.base_dir = base_dir
+        entry = self.get_entry((grid_number, tile_number, 0))
+        if entry[1] is None:
+            return None
+        width = int(width)
+        # Each level doubles the width of level 0:
+        level = 0
+        while (level + 1 < utils.TILE_PREVIEW_LEVELS
+               and entry[1].width() << level < width):
+            level += 1
+        # Use the next coarser level if a level is not available (for
+        # example, previews saved by previous versions):
+        while level > 0:
+            level_entry = self.get_entry((grid_number, tile_number, level))
+            if level_entry[1] is not None:
+                entry = level_entry
+                break
+            level -= 1
+        # Zoom bucket:
+        variants = entry[2]
+        if width in variants:
+            variants.move_to_end(width)
+            return variants[width]
+        variant = entry[1].scaledToWidth(width, Qt.SmoothTransformation)
+        variants[width] = variant
+        self.total_pixels += self.pixels(variant)
+        while len(variants) > self.MAX_VARIANTS:
+            old_width, old_variant = variants.popitem(last=False)
+            self.total_pixels -= self.pixels(old_variant)
+        self.evict()
+        return variant
+
+    def get_entry(self, key):
+        """Return the entry for key. The preview file is only loaded if
+           the entry is new or has been invalidated (and the file has
+           changed).
+        """
+        with self.lock:
+            is_stale = key in self.stale
+            self.stale.discard(key)
+        entry = self.entries.get(key)
+        if entry is None or is_stale:
+            file_name = (self.base_dir + '\\'
+                + utils.get_tile_preview_save_path(*key))
+            try:
+                mtime = os.path.getmtime(file_name)
+            except OSError:
+                mtime = None
+            if entry is None or entry[0] != mtime:
+                if entry is not None:
+                    self.remove(key)
+                pixmap = None
+                if mtime is not None:
+                    pixmap = load_pixmap(file_name)
+                    if pixmap.isNull():
+                        pixmap = None
+                    else:
+                        self.total_pixels += self.pixels(pixmap)
+                entry = [mtime, pixmap, OrderedDict()]
+                self.entries[key] = entry
+        self.entries.move_to_end(key)
+        return entry
+
+    def pixels(self, pixmap):
+        return pixmap.width() * pixmap.height()
+
+    def remove(self, key):
+        mtime, pixmap, variants = self.entries.pop(key)
+        if pixmap is not None:
+            self.total_pixels -= self.pixels(pixmap)
+        for variant in variants.values():
+            self.total_pixels -= self.pixels(variant)
+
+    def evict(self):
+        while self.total_pixels > self.max_pixels and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
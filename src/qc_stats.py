@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module keeps the image statistics of all tiles of the recent slices
+   in a stats cube (slice x grid x tile) for stack-wide quality control:
+   heatmaps for a slice, trends over slices, and queries for tiles whose
+   statistics have changed.
+"""
+
+import threading
+import warnings
+import numpy as np
+
+
+# Quantities stored in the cube:
+QUANTITIES = ['mean', 'stddev', 'focus', 'rejections']
+
+# Size of the central region used for the focus estimate:
+FOCUS_REGION_SIZE = 1024
+
+
+def get_focus_estimate(img):
+    """Return a sharpness estimate (mean squared difference between
+       neighbouring pixels) calculated from the central region of img.
+       Higher values indicate a sharper image.
+    """
+    height, width = img.shape[0], img.shape[1]
+    y0 = max(0, (height - FOCUS_REGION_SIZE) // 2)
+    x0 = max(0, (width - FOCUS_REGION_SIZE) // 2)
+    region = img[y0:y0 + FOCUS_REGION_SIZE,
+                 x0:x0 + FOCUS_REGION_SIZE].astype(np.float32)
+    if region.shape[0] < 2 or region.shape[1] < 2:
+        return 0.0
+    return float(np.mean(np.diff(region, axis=0)**2)
+                 + np.mean(np.diff(region, axis=1)**2))
+
+
+class StatsCube(object):
+    """Ring buffer over the most recent slices. For each quantity, a numpy
+       array of shape (depth, number_grids, number_tiles) holds the values
+       of all tiles (NaN if not acquired). The arrays are preallocated
+       with reserve() at the start of an acquisition and enlarged (doubled)
+       when a grid or tile number beyond the current size is added.
+       Memory: 4 quantities x depth x number_grids x number_tiles x 4 bytes
+       (for example 16 MB for depth 100 and 5 grids with 2000 tiles each),
+       up to four times as much if the arrays had to be enlarged.
+       Entries are added by the acquisition thread and read by the GUI
+       thread.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.slice_numbers = np.full(self.depth, -1, dtype=np.int64)
+            self.current = -1
+            self.cube = {}
+            for quantity in QUANTITIES:
+                self.cube[quantity] = np.full(
+                    (self.depth, 0, 0), np.nan, dtype=np.float32)
+
+    def reserve(self, number_grids, number_tiles):
+        """Make room for number_grids grids with up to number_tiles tiles
+           each, so that the arrays do not have to be enlarged during the
+           acquisition.
+        """
+        with self.lock:
+            self.resize(number_grids, number_tiles)
+
+    def enlarge(self, grid_number, tile_number):
+        # Lock must be held.
+        shape = self.cube['mean'].shape
+        if grid_number < shape[1] and tile_number < shape[2]:
+            return
+        # Grow geometrically to avoid copying the arrays for every new tile:
+        new_grids = shape[1]
+        if grid_number >= shape[1]:
+            new_grids = max(grid_number + 1, 2 * shape[1])
+        new_tiles = shape[2]
+        if tile_number >= shape[2]:
+            new_tiles = max(tile_number + 1, 2 * shape[2])
+        self.resize(new_grids, new_tiles)
+
+    def resize(self, number_grids, number_tiles):
+        # Lock must be held. The arrays are never made smaller.
+        shape = self.cube['mean'].shape
+        new_grids = max(shape[1], number_grids)
+        new_tiles = max(shape[2], number_tiles)
+        if (new_grids, new_tiles) != shape[1:]:
+            for quantity in QUANTITIES:
+                new_array = np.full(
+                    (self.depth, new_grids, new_tiles), np.nan,
+                    dtype=np.float32)
+                new_array[:, :shape[1], :shape[2]] = self.cube[quantity]
+                self.cube[quantity] = new_array
+
+    def get_row(self, slice_number):
+        """Return the ring buffer row for slice_number. A new slice
+           replaces the oldest row. Return None for old slices that are no
+           longer in the buffer.
+        """
+        # Lock must be held.
+        if self.current >= 0:
+            if self.slice_numbers[self.current] == slice_number:
+                return self.current
+            if slice_number < self.slice_numbers[self.current]:
+                rows = np.nonzero(self.slice_numbers == slice_number)[0]
+                if len(rows) > 0:
+                    return rows[0]
+                return None
+        self.current = (self.current + 1) % self.depth
+        self.slice_numbers[self.current] = slice_number
+        for quantity in QUANTITIES:
+            self.cube[quantity][self.current] = np.nan
+        return self.current
+
+    def add_tile(self, grid_number, tile_number, slice_number,
+                 mean, stddev, focus):
+        with self.lock:
+            self.enlarge(grid_number, tile_number)
+            row = self.get_row(slice_number)
+            if row is not None:
+                self.cube['mean'][row, grid_number, tile_number] = mean
+                self.cube['stddev'][row, grid_number, tile_number] = stddev
+                self.cube['focus'][row, grid_number, tile_number] = focus
+
+    def add_rejection(self, grid_number, tile_number, slice_number):
+        """Count a tile image that failed a quality check."""
+        with self.lock:
+            self.enlarge(grid_number, tile_number)
+            row = self.get_row(slice_number)
+            if row is not None:
+                rejections = self.cube['rejections']
+                if np.isnan(rejections[row, grid_number, tile_number]):
+                    rejections[row, grid_number, tile_number] = 0
+                rejections[row, grid_number, tile_number] += 1
+
+    def get_ordered_rows(self):
+        """Return the valid rows from the oldest to the most recent slice."""
+        # Lock must be held.
+        if self.current < 0:
+            return np.array([], dtype=np.int64)
+        rows = np.roll(np.arange(self.depth), -(self.current + 1))
+        return rows[self.slice_numbers[rows] >= 0]
+
+    def get_slice_numbers(self):
+        with self.lock:
+            return self.slice_numbers[self.get_ordered_rows()].copy()
+
+    def get_slice_values(self, quantity, grid_number, slice_offset=0):
+        """Return the values of all tiles of grid_number for the most recent
+           slice (slice_offset=0) or an earlier slice (slice_offset=1, 2,
+           ...), and the slice number. Return (None, None) if not
+           available.
+        """
+        with self.lock:
+            rows = self.get_ordered_rows()
+            if (slice_offset >= len(rows)
+                    or grid_number >= self.cube[quantity].shape[1]):
+                return None, None
+            row = rows[-1 - slice_offset]
+            return (self.cube[quantity][row, grid_number].copy(),
+                    int(self.slice_numbers[row]))
+
+    def get_heatmap(self, quantity, grid_number, rows, cols, slice_offset=0):
+        """Return the values of the tiles of grid_number as a 2D array
+           (rows x cols) for display, and the slice number.
+        """
+        values, slice_number = self.get_slice_values(
+            quantity, grid_number, slice_offset)
+        heatmap = np.full(rows * cols, np.nan, dtype=np.float32)
+        if values is not None:
+            number_tiles = min(len(values), rows * cols)
+            heatmap[:number_tiles] = values[:number_tiles]
+        return heatmap.reshape(rows, cols), slice_number
+
+    def get_trend(self, quantity, grid_number=None):
+        """Return the slice numbers and the average of quantity across all
+           tiles (of grid_number, or of all grids) for each slice.
+        """
+        with self.lock:
+            rows = self.get_ordered_rows()
+            data = self.cube[quantity][rows]
+            if grid_number is not None:
+                data = data[:, grid_number:grid_number + 1]
+            slice_numbers = self.slice_numbers[rows].copy()
+        if data.size == 0:
+            return slice_numbers, np.full(len(slice_numbers), np.nan)
+        data = data.reshape(len(rows), -1)
+        with warnings.catch_warnings():
+            # Slices without values:
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if quantity == 'rejections':
+                return slice_numbers, np.nansum(data, axis=1)
+            return slice_numbers, np.nanmean(data, axis=1)
+
+    def find_changed_tiles(self, quantity, relative_change, number_slices,
+                           window=5):
+        """Return a list of (grid_number, tile_number, change) for all tiles
+           whose value of quantity changed by at least relative_change
+           (for example -0.1 for a drop by more than 10%) within the last
+           number_slices slices. The average of the first and last window
+           slices is compared to reduce the influence of noise.
+        """
+        with self.lock:
+            rows = self.get_ordered_rows()[-number_slices:]
+            data = self.cube[quantity][rows].copy()
+        if len(rows) < 2:
+            return []
+        window = max(1, min(window, len(rows) // 2))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            start = np.nanmean(data[:window], axis=0)
+            end = np.nanmean(data[-window:], axis=0)
+            change = (end - start) / np.abs(start)
+        if relative_change < 0:
+            selected = change <= relative_change
+        else:
+            selected = change >= relative_change
+        # NaN comparisons are False, so tiles without data are not selected
+        grids, tiles = np.nonzero(selected)
+        result = [(int(g), int(t), float(change[g, t]))
+                  for g, t in zip(grids, tiles)]
+        # Largest changes first:
+        result.sort(key=lambda entry: -abs(entry[2]))
+        return result
@@ -17,10 +17,10 @@
 import os
 import sys
 import ctypes
-from configparser import ConfigParser
 from PyQt5.QtWidgets import QApplication
 import colorama # needed to suppress TIFFReadDirectory warnings in the console
 
+from settings import Settings
 from dlg_windows import ConfigDlg
 from config_template import process_cfg
 from main_controls import MainControls
@@ -66,7 +66,7 @@ def main():
                     default_configuration = True
                 print('Loading configuration file %s ...'
                       % config_file, end='')
-                config = ConfigParser()
+                config = Settings()
                 with open('..\\cfg\\' + config_file, 'r') as file:
                     config.read_file(file)
                 print(' Done.\n')
@@ -77,7 +77,7 @@ def main():
                     config['sys']['sys_config_file'] = 'system.cfg'
                 print('Loading system settings file %s ...'
                       % sysconfig_file, end='')
-                sysconfig = ConfigParser()
+                sysconfig = Settings()
                 with open('..\\cfg\\' + sysconfig_file, 'r') as file:
                     sysconfig.read_file(file)
                 configuration_loaded = True
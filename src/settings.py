@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the Settings class, a ConfigParser with typed and
+   cached access to the configuration. Existing code can still read and
+   write strings (cfg['acq']['paused'] = 'True'); the typed getters parse
+   each value only once after it has been changed. Values stored with
+   set_value() are converted to strings only when the configuration is
+   written to disk (or read as a string). Subscribers are notified when
+   the values of their keys change, so that frequently used settings can
+   be kept in plain attributes. Each section has a version number that is
+   incremented on every change (for caches that depend on a section).
+"""
+
+import io
+import json
+import threading
+
+from configparser import ConfigParser
+
+
+def parse_bool(value):
+    return value == 'True'
+
+
+class Settings(ConfigParser):
+
+    def __init__(self, *args, **kwargs):
+        # Must exist before ConfigParser.__init__() calls set():
+        # (section, option) -> (parse function, parsed value):
+        self.parsed = {}
+        # (section, option) -> value not yet converted to a string:
+        self.deferred = {}
+        # section -> number of changes:
+        self.versions = {}
+        # [callback, section, set of options or None]:
+        self.subscribers = []
+        self.settings_lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def get(self, section, option, **kwargs):
+        self.flush(section, option)
+        return super().get(section, option, **kwargs)
+
+    def set(self, section, option, value=None):
+        key = (section, self.optionxform(option))
+        with self.settings_lock:
+            self.deferred.pop(key, None)
+            self.parsed.pop(key, None)
+            super().set(section, option, value)
+            self.versions[section] = self.versions.get(section, 0) + 1
+        self.notify(*key)
+
+    def remove_option(self, section, option):
+        key = (section, self.optionxform(option))
+        with self.settings_lock:
+            self.deferred.pop(key, None)
+            self.parsed.pop(key, None)
+            self.versions[section] = self.versions.get(section, 0) + 1
+            return super().remove_option(section, option)
+
+    def _read(self, fp, fpname):
+        # Values are replaced without calling set():
+        with self.settings_lock:
+            super()._read(fp, fpname)
+            self.deferred.clear()
+            self.parsed.clear()
+            for section in self.sections():
+                self.versions[section] = self.versions.get(section, 0) + 1
+
+    def get_version(self, section):
+        """Return the version number of section. It changes whenever a
+           value in section is changed, without converting deferred values.
+        """
+        with self.settings_lock:
+            return self.versions.get(section, 0)
+
+    def items(self, *args, **kwargs):
+        self.flush()
+        return super().items(*args, **kwargs)
+
+    def write(self, fp, *args, **kwargs):
+        self.flush()
+        super().write(fp, *args, **kwargs)
+
+    def to_string(self):
+        """Return a consistent snapshot of the configuration in the format
+           of the .ini file.
+        """
+        with self.settings_lock:
+            output = io.StringIO()
+            self.write(output)
+            return output.getvalue()
+
+    def flush(self, section=None, option=None):
+        """Convert the deferred values (all, or only the specified value) to
+           strings.
+        """
+        with self.settings_lock:
+            if not self.deferred:
+                return
+            if section is None:
+                keys = list(self.deferred)
+            else:
+                keys = [(section, self.optionxform(option))]
+            for key in keys:
+                if key in self.deferred:
+                    value = self.deferred.pop(key)
+                    if callable(value):
+                        value = value()
+                    ConfigParser.set(self, key[0], key[1], str(value))
+
+    def set_value(self, section, option, value):
+        """Store value (bool, number, list...) without converting it to a
+           string. The conversion (str(value)) is done when the
+           configuration is saved. A list stored here may be modified in
+           place later; the current content is saved. value can also be a
+           function that returns the current value.
+        """
+        key = (section, self.optionxform(option))
+        with self.settings_lock:
+            if not self.has_option(section, option):
+                ConfigParser.set(self, section, option, str(value))
+            else:
+                self.deferred[key] = value
+            self.parsed.pop(key, None)
+            self.versions[section] = self.versions.get(section, 0) + 1
+        self.notify(*key)
+
+    def get_value(self, section, option, parse):
+        """Return the value parsed with parse(string). The result is cached
+           until the value is changed. Lists are returned without a copy
+           and must not be modified by the caller.
+        """
+        key = (section, self.optionxform(option))
+        with self.settings_lock:
+            if key in self.deferred:
+                value = self.deferred[key]
+                return value() if callable(value) else value
+            cached = self.parsed.get(key)
+            if cached is not None and cached[0] is parse:
+                return cached[1]
+            value = parse(ConfigParser.get(self, section, option))
+            self.parsed[key] = (parse, value)
+            return value
+
+    def get_bool(self, section, option):
+        return self.get_value(section, option, parse_bool)
+
+    def get_int(self, section, option):
+        return self.get_value(section, option, int)
+
+    def get_float(self, section, option):
+        return self.get_value(section, option, float)
+
+    def get_json(self, section, option):
+        return self.get_value(section, option, json.loads)
+
+    def subscribe(self, callback, section, options=None):
+        """Call callback(section, option) whenever a value in section (or
+           only the specified options) is changed. The callback is run in
+           the thread that changes the value and should only update
+           attributes.
+        """
+        if options is not None:
+            options = set(self.optionxform(option) for option in options)
+        with self.settings_lock:
+            self.subscribers.append([callback, section, options])
+
+    def unsubscribe(self, callback):
+        with self.settings_lock:
+            self.subscribers = [s for s in self.subscribers
+                                if s[0] != callback]
+
+    def notify(self, section, option):
+        with self.settings_lock:
+            callbacks = [s[0] for s in self.subscribers
+                         if s[1] == section
+                         and (s[2] is None or option in s[2])]
+        for callback in callbacks:
+            callback(section, option)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the image cache for the slice viewer. Slices are
+   decoded in background threads (optionally downsampled by a power of two
+   to match the display resolution) and kept in a memory-bounded LRU cache.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+
+from image_io import load_qimage
+
+
+class Trigger(QObject):
+    """Custom signal for updating GUI from within running threads."""
+    s = pyqtSignal()
+
+
+class SliceCache(object):
+    """Load images in a thread pool and cache them as QImages (which,
+       unlike QPixmaps, can be created outside the GUI thread). Entries are
+       keyed by (slice_id, level), where slice_id is (file_name, mtime) and
+       level is the downsampling level (image size divided by 2**level).
+       loaded_trigger is emitted whenever an image has been loaded.
+    """
+
+    # Coarsest downsampling level:
+    MAX_LEVEL = 3
+
+    def __init__(self, max_bytes, number_workers):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.images = OrderedDict()
+        # Jobs that have been submitted, but not finished:
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=number_workers)
+        self.loaded_trigger = Trigger()
+
+    def get(self, slice_id, level):
+        """Return the cached image or None."""
+        with self.lock:
+            image = self.images.get((slice_id, level))
+            if image is not None:
+                self.images.move_to_end((slice_id, level))
+            return image
+
+    def get_closest(self, slice_id, level):
+        """Return the cached image with the level closest to the requested
+           level (finer levels preferred) and its level, or (None, None).
+        """
+        candidates = sorted(range(self.MAX_LEVEL + 1),
+                            key=lambda l: (abs(l - level), l > level))
+        for candidate in candidates:
+            image = self.get(slice_id, candidate)
+            if image is not None:
+                return image, candidate
+        return None, None
+
+    def request(self, slice_id, level):
+        """Queue the image for loading unless it is cached or queued."""
+        key = (slice_id, level)
+        with self.lock:
+            if key in self.images or key in self.pending:
+                return
+            self.pending[key] = self.pool.submit(self.load, slice_id, level)
+
+    def cancel_pending(self, keep):
+        """Cancel the queued jobs (that have not started yet) for all
+           entries not in keep.
+        """
+        with self.lock:
+            for key in list(self.pending):
+                if key not in keep and self.pending[key].cancel():
+                    del self.pending[key]
+
+    def load(self, slice_id, level):
+        file_name = slice_id[0]
+        image = load_qimage(file_name)
+        if not image.isNull() and level > 0:
+            image = image.scaled(max(1, image.width() >> level),
+                                 max(1, image.height() >> level),
+                                 Qt.IgnoreAspectRatio,
+                                 Qt.SmoothTransformation)
+        with self.lock:
+            self.pending.pop((slice_id, level), None)
+            if not image.isNull():
+                self.images[(slice_id, level)] = image
+                self.total_bytes += image.byteCount()
+                self.evict()
+        self.loaded_trigger.s.emit()
+
+    def evict(self):
+        # Lock must be held.
+        while self.total_bytes > self.max_bytes and len(self.images) > 1:
+            key, image = self.images.popitem(last=False)
+            self.total_bytes -= image.byteCount()
+
+    def shut_down(self):
+        self.cancel_pending([])
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the SliceScheduler, which collects per-slice work
+   that does not have to be done immediately (copying files to the mirror
+   drive, status reports, compression results) and runs it while the
+   microtome is cutting. run_window() runs the pending jobs in the
+   acquisition thread until the end of the cut (deadline). Jobs that would
+   not finish in time according to their previous durations are passed to
+   a background thread (spill-over). Jobs added with background=False
+   (because they access objects that are not thread-safe) are always run
+   in the acquisition thread. If they would not finish before the end of
+   the cut, they can be kept for the next call of run_window() (after the
+   cut) instead of delaying the cut.
+"""
+
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep
+
+
+# Assumed duration (s) of a job that has not been run before:
+DEFAULT_JOB_DURATION = 1.0
+
+
+class SliceScheduler(object):
+
+    def __init__(self):
+        # Pending jobs: (function, args, error_state, background):
+        self.jobs = deque()
+        # Function name -> average duration in seconds:
+        self.durations = {}
+        # (error_state, message) of failed jobs:
+        self.errors = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.spilled = []
+
+    def add(self, function, *args, error_state=None, background=True):
+        """Schedule function(*args) for the next cut window. If the function
+           raises an exception, (error_state, message) is recorded (see
+           get_errors()). Can be called from any thread.
+        """
+        with self.lock:
+            self.jobs.append((function, args, error_state, background))
+
+    def has_pending(self):
+        with self.lock:
+            return len(self.jobs) > 0
+
+    def run_window(self, deadline, defer_foreground=False):
+        """Run the pending jobs until deadline (time in seconds since the
+           epoch), then wait until deadline has passed. Jobs that do not fit
+           into the window are run in the background thread. If
+           defer_foreground is True, jobs added with background=False that
+           do not fit are kept for the next call, otherwise they are run
+           even if the deadline is exceeded.
+        """
+        deferred = []
+        while True:
+            with self.lock:
+                if not self.jobs:
+                    break
+                job = self.jobs.popleft()
+            function, args, error_state, background = job
+            estimate = self.durations.get(function.__name__,
+                                          DEFAULT_JOB_DURATION)
+            if time() + estimate <= deadline:
+                self.run_job(job)
+            elif background:
+                self.spill(job)
+            elif defer_foreground:
+                deferred.append(job)
+            else:
+                self.run_job(job)
+        if deferred:
+            with self.lock:
+                # Keep the original order, before jobs added in the meantime:
+                self.jobs.extendleft(reversed(deferred))
+        remaining = deadline - time()
+        if remaining > 0:
+            sleep(remaining)
+
+    def spill(self, job):
+        self.spilled = [f for f in self.spilled if not f.done()]
+        self.spilled.append(self.executor.submit(self.run_job, job))
+
+    def run_job(self, job):
+        function, args, error_state, background = job
+        start = time()
+        try:
+            function(*args)
+        except Exception as e:
+            with self.lock:
+                self.errors.append((error_state, str(e)))
+        duration = time() - start
+        with self.lock:
+            name = function.__name__
+            if name in self.durations:
+                # Moving average:
+                duration = 0.8 * self.durations[name] + 0.2 * duration
+            self.durations[name] = duration
+
+    def get_errors(self):
+        """Return and clear the list of (error_state, message) of the jobs
+           that have failed.
+        """
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def finish(self):
+        """Run all pending jobs in the calling thread and wait for the jobs
+           in the background thread. Jobs added by the running jobs are also
+           completed.
+        """
+        while True:
+            for future in self.spilled:
+                future.result()
+            self.spilled = []
+            with self.lock:
+                if not self.jobs:
+                    break
+                job = self.jobs.popleft()
+            self.run_job(job)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides spatial indexes over the tile bounding boxes of the
+   grids. They are used by the viewport to draw only the visible tiles and
+   to find the tile under the mouse cursor without iterating over all tiles.
+"""
+
+from math import floor
+
+
+class TileIndex(object):
+    """Uniform bucket grid over the bounding boxes of the tiles of one grid.
+       The bucket size is the tile size, so each tile is stored in at most
+       four buckets, and a point query only has to check the tiles of a
+       single bucket. Coordinates are relative to the grid origin, so that
+       moving a grid does not require rebuilding its index.
+    """
+
+    def __init__(self, boxes):
+        # boxes: list of (x0, y0, x1, y1), index is the tile number
+        self.boxes = boxes
+        self.buckets = {}
+        if not boxes:
+            self.bounds = None
+            return
+        self.cell_width = max(max(b[2] - b[0] for b in boxes), 1e-6)
+        self.cell_height = max(max(b[3] - b[1] for b in boxes), 1e-6)
+        self.bounds = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                       max(b[2] for b in boxes), max(b[3] for b in boxes))
+        for tile_number, box in enumerate(boxes):
+            cx0, cy0, cx1, cy1 = self.get_cell_range(*box)
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    self.buckets.setdefault((cx, cy), []).append(tile_number)
+
+    def get_cell_range(self, x0, y0, x1, y1):
+        return (floor(x0 / self.cell_width), floor(y0 / self.cell_height),
+                floor(x1 / self.cell_width), floor(y1 / self.cell_height))
+
+    def query_rect(self, x0, y0, x1, y1):
+        """Return the sorted list of tiles that intersect the specified
+           rectangle.
+        """
+        if self.bounds is None:
+            return []
+        # Clip the query rectangle to the extent of the grid:
+        x0, y0 = max(x0, self.bounds[0]), max(y0, self.bounds[1])
+        x1, y1 = min(x1, self.bounds[2]), min(y1, self.bounds[3])
+        if x0 > x1 or y0 > y1:
+            return []
+        cx0, cy0, cx1, cy1 = self.get_cell_range(x0, y0, x1, y1)
+        found = set()
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                found.update(self.buckets.get((cx, cy), []))
+        return sorted(
+            tile_number for tile_number in found
+            if (self.boxes[tile_number][0] <= x1
+                and self.boxes[tile_number][2] >= x0
+                and self.boxes[tile_number][1] <= y1
+                and self.boxes[tile_number][3] >= y0))
+
+    def query_point(self, x, y):
+        """Return the tile that contains the point (x, y), or None. Where
+           tiles overlap, the tile with the highest number is returned.
+        """
+        if self.bounds is None:
+            return None
+        cell = (floor(x / self.cell_width), floor(y / self.cell_height))
+        selected_tile = None
+        for tile_number in self.buckets.get(cell, []):
+            x0, y0, x1, y1 = self.boxes[tile_number]
+            if x0 <= x < x1 and y0 <= y < y1:
+                if selected_tile is None or tile_number > selected_tile:
+                    selected_tile = tile_number
+        return selected_tile
+
+
+class GridIndexes(object):
+    """Keep one TileIndex per grid (and tile map variant). An index is only
+       rebuilt when the layout of its grid (signature) has changed.
+    """
+
+    def __init__(self):
+        # key -> [signature, TileIndex]
+        self.indexes = {}
+
+    def get_index(self, key, signature, get_boxes):
+        """Return the index for key. get_boxes() is called to obtain the
+           tile bounding boxes if the index must be (re)built.
+        """
+        entry = self.indexes.get(key)
+        if entry is None or entry[0] != signature:
+            entry = [signature, TileIndex(get_boxes())]
+            self.indexes[key] = entry
+        return entry[1]
+
+    def remove_grids(self, number_grids):
+        """Remove the indexes of deleted grids."""
+        for key in list(self.indexes):
+            if key[0] >= number_grids:
+                del self.indexes[key]
+
+    def clear(self):
+        self.indexes = {}
@@ -18,19 +18,37 @@ import datetime
 import json
 
 from time import sleep
-from PIL import Image
-from scipy.misc import imsave
 from dateutil.relativedelta import relativedelta
 from PyQt5.QtWidgets import QMessageBox
 
 import utils
+from acq_events import Event
+from image_io import read_image, write_image
+from acq_journal import AcqJournal
+from acq_logger import AcqLogger, DEBUG, INFO
+from slice_scheduler import SliceScheduler
+from tile_container import TileContainer
+from image_compressor import ImageCompressor
 
 
 class Stack():
 
+    # Settings read in the acquisition loop (see update_run_settings()):
+    RUN_SETTINGS = {
+        'acq': ['use_debris_detection', 'monitor_images', 'ask_user',
+                'use_email_monitoring'],
+        'debris': ['max_number_sweeps', 'continue_after_max_sweeps',
+                   'detection_method'],
+        'monitoring': ['remote_commands_enabled', 'remote_check_interval',
+                       'report_interval', 'watch_tiles', 'watch_ov']
+    }
+    # Entries of the main log below this level (per-tile details) are only
+    # written to the log file:
+    GUI_LOG_LEVEL = INFO
+
     def __init__(self, config, sem, microtome,
                  overview_manager, grid_manager, coordinate_system,
-                 image_inspector, autofocus, acq_queue, acq_trigger):
+                 image_inspector, autofocus, acq_events, frame_store):
         self.cfg = config
         self.sem = sem
         self.microtome = microtome
@@ -39,8 +57,9 @@ class Stack():
         self.cs = coordinate_system
         self.img_inspector = image_inspector
         self.af = autofocus
-        self.queue = acq_queue
-        self.trigger = acq_trigger
+        self.events = acq_events
+        # Decoded images of the most recent tiles/OVs:
+        self.frame_store = frame_store
 
         self.email_pw = ''  # provided by user at runtime
 
@@ -95,8 +114,44 @@ class Stack():
             601: 'Test case error'
         }
 
+        self.tile_container = TileContainer(self.cfg)
+        self.img_compressor = ImageCompressor(self.cfg)
+        # Crash-safe record of the acquisition progress:
+        self.journal = AcqJournal()
+        # Log files, written in a background thread:
+        self.acq_log = AcqLogger()
+        self.log_mirror_warning = False
+        # Work that is done while the microtome is cutting:
+        self.scheduler = SliceScheduler()
+        # Settings that can be changed during a run are kept in attributes,
+        # which are updated whenever the settings change:
+        self.update_run_settings()
+        for section, options in self.RUN_SETTINGS.items():
+            self.cfg.subscribe(self.update_run_settings, section, options)
         self.acq_setup()
 
+    def update_run_settings(self, section=None, option=None):
+        self.use_debris_detection = self.cfg.get_bool(
+            'acq', 'use_debris_detection')
+        self.monitor_images = self.cfg.get_bool('acq', 'monitor_images')
+        self.ask_user = self.cfg.get_bool('acq', 'ask_user')
+        self.use_email_monitoring = self.cfg.get_bool(
+            'acq', 'use_email_monitoring')
+        self.max_number_sweeps = self.cfg.get_int(
+            'debris', 'max_number_sweeps')
+        self.continue_after_max_sweeps = self.cfg.get_bool(
+            'debris', 'continue_after_max_sweeps')
+        self.debris_detection_method = self.cfg.get_int(
+            'debris', 'detection_method')
+        self.remote_commands_enabled = self.cfg.get_bool(
+            'monitoring', 'remote_commands_enabled')
+        self.remote_check_interval = self.cfg.get_int(
+            'monitoring', 'remote_check_interval')
+        self.report_interval = self.cfg.get_int(
+            'monitoring', 'report_interval')
+        self.watch_tiles = self.cfg.get_json('monitoring', 'watch_tiles')
+        self.watch_ov = self.cfg.get_json('monitoring', 'watch_ov')
+
 
     def acq_setup(self):
         """Set up all variables for a new stack acquisition, or update
@@ -129,6 +184,14 @@ class Stack():
         self.user_email_addresses = [self.cfg['monitoring']['user_email'],
                                      self.cfg['monitoring']['cc_user_email']]
         self.base_dir = self.cfg['acq']['base_dir']
+        # The journal is updated after each tile and is more recent than
+        # the saved configuration if the program was not closed normally:
+        try:
+            state = self.journal.open(self.base_dir)
+        except:
+            state = None
+        if state is not None:
+            self.apply_resume_state(state)
         # Extract the name of the stack from the base directory:
         self.stack_name = self.base_dir[self.base_dir.rfind('\\') + 1:]
         self.viewport_filename = None
@@ -149,6 +212,12 @@ class Stack():
         self.use_mirror_drive = (self.cfg['sys']['use_mirror_drive'] == 'True')
         self.take_overviews = (self.cfg['acq']['take_overviews'] == 'True')
         self.use_adaptive_focus = False
+        # Optional container output for tiles:
+        self.tile_container.update_settings()
+        self.use_tile_container = self.tile_container.is_active()
+        # Lossless compression of tiles and OVs in background processes:
+        self.img_compressor.update_settings()
+        self.compress_images = self.img_compressor.is_active()
 
         # autofocus and autostig interval status:
         self.autofocus_stig_current_slice = (False, False)
@@ -168,6 +237,49 @@ class Stack():
         self.user_reply = None
         self.user_reply_received = False
 
+    def get_resume_state(self):
+        return {
+            'slice_counter': self.slice_counter,
+            'total_z_diff': self.total_z_diff,
+            'interrupted': self.acq_interrupted,
+            'interrupted_at': self.acq_interrupted_at,
+            'grids_acquired': self.grids_acquired,
+            'tiles_acquired': self.tiles_acquired
+        }
+
+    def apply_resume_state(self, state):
+        """Restore the acquisition progress from the journal."""
+        self.slice_counter = state['slice_counter']
+        self.cfg['acq']['slice_counter'] = str(self.slice_counter)
+        self.total_z_diff = state['total_z_diff']
+        self.cfg['acq']['total_z_diff'] = str(self.total_z_diff)
+        self.acq_interrupted = state['interrupted']
+        self.cfg['acq']['interrupted'] = str(self.acq_interrupted)
+        self.acq_interrupted_at = state['interrupted_at']
+        self.cfg['acq']['interrupted_at'] = str(self.acq_interrupted_at)
+        self.grids_acquired = state['grids_acquired']
+        self.cfg.set_value('acq', 'grids_acquired', self.grids_acquired)
+        self.tiles_acquired = state['tiles_acquired']
+        self.cfg.set_value('acq', 'tiles_acquired', self.tiles_acquired)
+
+    def save_journal_state(self):
+        """Save the current acquisition progress in the journal (if the
+           meta folder of the stack exists).
+        """
+        base_dir = self.cfg['acq']['base_dir']
+        if os.path.isdir(base_dir + '\\meta'):
+            try:
+                if self.journal.base_dir != base_dir:
+                    self.journal.open(base_dir)
+                self.journal.save_state(self.get_resume_state())
+            except:
+                self.add_journal_error()
+
+    def add_journal_error(self):
+        # Main log file may not be open, only show in main window:
+        self.events.put(Event.LOG, utils.format_log_entry(
+            'CTRL: Error while writing to the acquisition journal.'))
+
     def get_remote_password(self):
         return self.email_pw
 
@@ -289,9 +401,9 @@ class Stack():
             # Log in viewport window:
             log_str = (str(self.slice_counter) + ': WARNING ('
                        + 'Could not mirror file(s))')
-            self.error_log_file.write(log_str + '\n')
+            self.acq_log.write('error', log_str + '\n')
             # Signal to main window to update log in viewport:
-            self.transmit_cmd('VP LOG' + log_str)
+            self.transmit_cmd(Event.VP_LOG, log_str)
             sleep(2)
             # Try again:
             try:
@@ -304,6 +416,88 @@ class Stack():
                 self.pause_acquisition(2)
                 self.error_state = 402
 
+    def mirror_files_deferred(self, file_list):
+        """Copy files given in file_list to mirror drive during the next
+           cut (or in the background).
+        """
+        self.scheduler.add(self.copy_to_mirror, file_list, error_state=402)
+
+    def copy_to_mirror(self, file_list):
+        """Copy files to mirror drive, try again once if copying fails.
+           Files that have been deleted in the meantime (discarded tiles)
+           are skipped.
+        """
+        file_list = [f for f in file_list if os.path.isfile(f)]
+        try:
+            for file_name in file_list:
+                shutil.copy(file_name, self.mirror_drive + file_name[2:])
+        except:
+            sleep(2)
+            try:
+                for file_name in file_list:
+                    shutil.copy(file_name, self.mirror_drive + file_name[2:])
+            except Exception as e:
+                raise Exception('Copying file(s) to mirror drive failed ('
+                                + str(e) + ')')
+
+    def process_deferred_errors(self):
+        """Log the errors of deferred jobs. A job with an error_state
+           pauses the acquisition after the current slice.
+        """
+        for error_state, msg in self.scheduler.get_errors():
+            self.add_to_main_log('CTRL: ' + msg)
+            if error_state is not None and self.error_state == 0:
+                self.error_state = error_state
+                self.pause_acquisition(2)
+        self.log_preview_errors(self.img_inspector.get_preview_errors())
+
+    def log_preview_errors(self, errors):
+        for msg in errors:
+            self.add_to_main_log(
+                'CTRL: WARNING: Tile preview could not be saved: ' + msg)
+
+    def mirror_container(self, container_path):
+        """Copy a tile container (HDF5 file or Zarr directory) to the
+           mirror drive.
+        """
+        dst_path = self.mirror_drive + container_path[2:]
+        try:
+            if os.path.isdir(container_path):
+                if os.path.exists(dst_path):
+                    shutil.rmtree(dst_path)
+                shutil.copytree(container_path, dst_path)
+            else:
+                shutil.copy(container_path, dst_path)
+        except:
+            self.add_to_main_log('CTRL: Copying tile container to mirror '
+                                 'drive failed.')
+
+    def check_log_files(self):
+        """Check whether the log writer thread could write the log files
+           and copy them to the mirror drive. Show a warning after the first
+           failed attempt to mirror, pause the acquisition if the next
+           attempt also fails.
+        """
+        error = self.acq_log.get_error()
+        if error is not None:
+            self.add_to_main_log('CTRL: Error writing log file: ' + error)
+        if not self.use_mirror_drive:
+            return
+        failures = self.acq_log.get_mirror_failures()
+        if failures == 0:
+            self.log_mirror_warning = False
+        elif failures == 1 and not self.log_mirror_warning:
+            self.log_mirror_warning = True
+            log_str = (str(self.slice_counter) + ': WARNING ('
+                       + 'Could not mirror log file(s))')
+            self.acq_log.write('error', log_str + '\n')
+            self.transmit_cmd(Event.VP_LOG, log_str)
+        elif failures > 1:
+            self.add_to_main_log('CTRL: Copying log file(s) to mirror '
+                                 'drive failed.')
+            self.pause_acquisition(2)
+            self.error_state = 402
+
     def set_up_acq_subdirectories(self):
         """Set up and mirror all subdirectories for the stack acquisition"""
         subdirectory_list = [
@@ -353,45 +547,24 @@ class Stack():
         f.close()
         # Save current grid setup:
         gridmap_filename = self.gm.save_grid_setup(timestamp)
-        # Create main log file:
-        self.main_log_filename = (self.base_dir + '\\meta\\logs\\'
-                                  + 'log_' + timestamp + '.txt')
-        # A buffer_size of 1 ensures that all log entries are immediately
-        # written to disk:
-        buffer_size = 1
-        self.main_log_file = open(self.main_log_filename, 'w', buffer_size)
-        # Set up imagelist file:
-        self.imagelist_filename = (self.base_dir + '\\meta\\logs\\'
-                                   + 'imagelist_' + timestamp + '.txt')
-        self.imagelist_file = open(self.imagelist_filename, 'w')
-        # Log files for debris and errors:
-        self.debris_log_filename = (self.base_dir + '\\meta\\logs\\'
-                                    + 'debris_log_' + timestamp + '.txt')
-        self.debris_log_file = open(self.debris_log_filename,
-                                    'w', buffer_size)
-        self.error_log_filename = (self.base_dir + '\\meta\\logs\\'
-                                   + 'error_log_' + timestamp + '.txt')
-        self.error_log_file = open(self.error_log_filename, 'w', buffer_size)
-
-        self.metadata_filename = (self.base_dir + '\\meta\\logs\\'
-                                    + 'metadata_' + timestamp + '.txt')
-        self.metadata_file = open(self.metadata_filename, 'w', buffer_size)
-
+        # Log files that are updated continuously during the acquisition:
+        log_dir = self.base_dir + '\\meta\\logs\\'
+        log_files = {
+            'main': log_dir + 'log_' + timestamp + '.txt',
+            'imagelist': log_dir + 'imagelist_' + timestamp + '.txt',
+            'debris': log_dir + 'debris_log_' + timestamp + '.txt',
+            'error': log_dir + 'error_log_' + timestamp + '.txt',
+            'metadata': log_dir + 'metadata_' + timestamp + '.txt'
+        }
         # Note that the config file and the gridmap file are only saved once
-        # in the beginning of the acquisition. The other log files are updated
-        # continously during the acq.
-        log_file_list = [
-            config_filename,
-            gridmap_filename,
-            self.main_log_filename,
-            self.imagelist_filename,
-            self.debris_log_filename,
-            self.error_log_filename,
-            self.metadata_filename
-        ]
-        # Copy all log files to mirror drive:
+        # in the beginning of the acquisition. The other log files are
+        # written by the log writer thread and mirrored incrementally.
         if self.use_mirror_drive:
-            self.mirror_files(log_file_list)
+            self.mirror_files([config_filename, gridmap_filename])
+            self.acq_log.open(log_files, self.mirror_drive)
+            self.acq_log.mirror()
+        else:
+            self.acq_log.open(log_files)
 
 # ===================== STACK ACQUISITION THREAD run() ========================
 
@@ -400,30 +573,55 @@ class Stack():
         self.acq_setup()
         self.set_up_acq_subdirectories()
         self.set_up_acq_logs()
+        self.save_journal_state()
 
-        self.main_log_file.write('*** SBEMimage log for acquisition '
-                                 + self.cfg['acq']['base_dir'] + ' ***\n\n')
+        self.acq_log.write('main', '*** SBEMimage log for acquisition '
+                           + self.cfg['acq']['base_dir'] + ' ***\n\n')
         if self.acq_paused:
-            self.main_log_file.write('\n*** STACK ACQUISITION RESTARTED ***\n')
+            self.acq_log.write('main',
+                               '\n*** STACK ACQUISITION RESTARTED ***\n')
             self.add_to_main_log('CTRL: Stack restarted.')
             self.acq_paused = False
         else:
-            self.main_log_file.write('\n*** STACK ACQUISITION STARTED ***\n')
+            self.acq_log.write('main',
+                               '\n*** STACK ACQUISITION STARTED ***\n')
             self.add_to_main_log('CTRL: Stack started.')
 
         number_ov = self.ovm.get_number_ov()
         number_grids = self.gm.get_number_grids()
         self.first_ov = [True] * number_ov
         self.img_inspector.reset_tile_stats()
+        self.img_inspector.reserve_tile_stats(
+            number_grids,
+            max([self.gm.get_number_tiles(g) for g in range(number_grids)],
+                default=0))
 
         if self.use_mirror_drive:
             self.add_to_main_log(
                 'CTRL: Mirror drive directory: ' + self.mirror_drive_directory)
 
+        if self.use_tile_container:
+            if self.tile_container.is_format_available():
+                self.add_to_main_log(
+                    'CTRL: Tiles will be stored in grid containers ('
+                    + self.cfg['acq']['tile_container_format'] + ').')
+            else:
+                self.use_tile_container = False
+                self.add_to_main_log(
+                    'CTRL: WARNING: Library for tile container format '
+                    + self.cfg['acq']['tile_container_format']
+                    + ' not installed. Tiles saved as individual files only.')
+
+        if self.compress_images:
+            self.img_compressor.start()
+            self.add_to_main_log(
+                'CTRL: Tiles and OVs will be compressed in the background ('
+                + self.img_compressor.get_codec() + ').')
+
         # save current configuration to disk:
-        self.transmit_cmd('SAVE CFG')
+        self.transmit_cmd(Event.SAVE_CFG)
         # Update progress bar and slice counter:
-        self.transmit_cmd('UPDATE PROGRESS')
+        self.transmit_cmd(Event.UPDATE_PROGRESS)
 
         # Metadata summary for this run
         # Write summary to disk and send to remote server (if feature enabled)
@@ -447,7 +645,8 @@ class Stack():
             'email_addresses: ': [self.cfg['monitoring']['user_email'],
                                   self.cfg['monitoring']['cc_user_email']]
             }
-        self.metadata_file.write('SESSION: ' + str(session_metadata) + '\n')
+        self.acq_log.write('metadata',
+                           'SESSION: ' + str(session_metadata) + '\n')
         # Send to server?
         if self.send_metadata:
             url = self.metadata_server + '/session/metadata'
@@ -488,10 +687,10 @@ class Stack():
                 self.pause_acquisition(1)
                 self.add_to_main_log('CTRL: Error reading initial Z position.')
 
-        self.transmit_cmd('UPDATE Z')
+        self.transmit_cmd(Event.UPDATE_Z)
 
         self.microtome.get_stage_xy(wait_interval=1)
-        self.transmit_cmd('UPDATE XY')
+        self.transmit_cmd(Event.UPDATE_XY)
 
         # ========================= ACQUISITION LOOP ==========================
         while not (self.acq_paused or self.stack_completed):
@@ -522,12 +721,9 @@ class Stack():
 
             # ============= Overview (OV) image acquisition ===================
             if self.take_overviews:
-                use_debris_detection = (
-                    self.cfg['acq']['use_debris_detection'] == 'True')
-                max_number_sweeps = int(
-                    self.cfg['debris']['max_number_sweeps'])
-                continue_after_max_sweeps = (
-                    self.cfg['debris']['continue_after_max_sweeps'] == 'True')
+                use_debris_detection = self.use_debris_detection
+                max_number_sweeps = self.max_number_sweeps
+                continue_after_max_sweeps = self.continue_after_max_sweeps
 
                 for ov_number in range(number_ov):
                     if (self.error_state > 0) or (self.pause_state == 1):
@@ -599,16 +795,18 @@ class Stack():
                             # Write stats to disk:
                             self.img_inspector.save_ov_reslice_and_stats(
                                 ov_number, self.slice_counter)
-                        # Mirror:
-                        if self.use_mirror_drive:
-                            self.mirror_files([ov_filename])
+                        # Compress and/or mirror:
+                        if self.compress_images and ov_accepted:
+                            self.img_compressor.submit(ov_filename)
+                        elif self.use_mirror_drive:
+                            self.mirror_files_deferred([ov_filename])
                         if sweep_counter > 0:
                             log_str = (str(self.slice_counter)
                                        + ': Debris, ' + str(sweep_counter)
                                        + ' sweep(s)')
-                            self.debris_log_file.write(log_str + '\n')
+                            self.acq_log.write('debris', log_str + '\n')
                             # Signal to main window to update log in viewport:
-                            self.transmit_cmd('VP LOG' + log_str)
+                            self.transmit_cmd(Event.VP_LOG, log_str)
                     else:
                         self.add_to_main_log(
                             'CTRL: Skip OV %d (intervallic acquisition)'
@@ -619,10 +817,11 @@ class Stack():
                 # Grid in which interruption occured has been deleted.
                 self.acq_interrupted = False
                 self.cfg['acq']['interrupted'] = 'False'
-                self.interrupted_at = []
+                self.acq_interrupted_at = []
                 self.cfg['acq']['interrupted_at'] = '[]'
                 self.tiles_acquired = []
                 self.cfg['acq']['tiles_acquired'] = '[]'
+                self.save_journal_state()
 
             # =================== Grid acquistion loop ========================
             for grid_number in range(number_grids):
@@ -656,19 +855,20 @@ class Stack():
                     and self.acq_interrupted_at[0] in self.grids_acquired):
                 # Reset interruption info:
                 self.cfg['acq']['interrupted_at'] = '[]'
-                self.interrupted_at = []
+                self.acq_interrupted_at = []
                 self.cfg['acq']['interrupted'] = 'False'
                 self.acq_interrupted = False
 
             if not self.acq_interrupted:
                 self.grids_acquired = []
                 self.cfg['acq']['grids_acquired'] = '[]'
+            self.save_journal_state()
 
             # Save current viewport:
             self.viewport_filename = (self.base_dir + '\\workspace\\viewport\\'
                 + self.stack_name + '_viewport_' + 's'
                 + str(self.slice_counter).zfill(utils.SLICE_DIGITS) + '.png')
-            self.transmit_cmd('GRAB VP SCREENSHOT' + self.viewport_filename)
+            self.transmit_cmd(Event.GRAB_VP_SCREENSHOT, self.viewport_filename)
             # Give main controls time to grab and save viewport screenshot:
             time_out = 0
             while not os.path.isfile(self.viewport_filename) and time_out < 20:
@@ -679,8 +879,8 @@ class Stack():
             slice_complete_metadata = {
                 'timestamp': timestamp,
                 'completed_slice': self.slice_counter}
-            self.metadata_file.write('SLICE COMPLETE: '
-                                      + str(slice_complete_metadata) + '\n')
+            self.acq_log.write('metadata', 'SLICE COMPLETE: '
+                               + str(slice_complete_metadata) + '\n')
 
             if self.send_metadata:
                 # Notify remote server that slice has been imaged
@@ -723,34 +923,38 @@ class Stack():
                         else:
                             self.add_to_main_log(
                                 'CTRL: ERROR sending notification email.')
-                        self.transmit_cmd('REMOTE STOP')
+                        self.transmit_cmd(Event.REMOTE_STOP)
                     if command == 'SHOWMESSAGE':
-                        self.transmit_cmd('SHOW MSG' + msg)
+                        self.transmit_cmd(Event.SHOW_MSG, msg)
                 else:
                     self.add_to_main_log(
                         'CTRL: Unknown signal from metadata server '
                         'received.')
 
             # ======================= E-mail monitoring =======================
-            use_email_monitoring = (
-                self.cfg['acq']['use_email_monitoring'] == 'True')
-            remote_commands_enabled = (
-                self.cfg['monitoring']['remote_commands_enabled'] == 'True')
-            remote_check_interval = int(
-                self.cfg['monitoring']['remote_check_interval'])
+            use_email_monitoring = self.use_email_monitoring
+            remote_commands_enabled = self.remote_commands_enabled
+            remote_check_interval = self.remote_check_interval
             scheduled_report = (
-                self.slice_counter
-                % int(self.cfg['monitoring']['report_interval']) == 0)
+                self.slice_counter % self.report_interval == 0)
             # If remote commands are enabled, check email account:
             if (use_email_monitoring and remote_commands_enabled
                 and self.slice_counter % remote_check_interval == 0):
                 self.process_remote_commands()
 
-            # Check if report should be sent:
+            # Check if report should be sent (during the cut):
             if (use_email_monitoring
                     and (self.slice_counter > 0)
                     and (scheduled_report or self.report_requested)):
-                self.send_status_report()
+                self.scheduler.add(self.send_status_report,
+                                   self.slice_counter, self.viewport_filename,
+                                   background=False)
+                self.report_requested = False
+
+            # Log results of finished compression jobs (during the cut):
+            if self.compress_images:
+                self.scheduler.add(self.process_finished_compression_jobs,
+                                   background=False)
 
             # Check if single slice acquisition -> NO CUT
             if self.number_slices == 0:
@@ -763,18 +967,23 @@ class Stack():
 
             # Imaging and cutting for current slice completed.
 
+            # Jobs not done during the cut (no cut, cut failed, or too
+            # long for the cut) are run now or in the background:
+            if self.scheduler.has_pending():
+                self.scheduler.run_window(time.time())
+            self.process_deferred_errors()
+
             # Save current cfg to disk:
-            self.transmit_cmd('SAVE CFG')
+            self.transmit_cmd(Event.SAVE_CFG)
 
-            self.transmit_cmd('UPDATE PROGRESS')
+            self.transmit_cmd(Event.UPDATE_PROGRESS)
             if self.slice_counter == self.number_slices:
                 self.stack_completed = True
 
-            # Copy log file and imagelist file to mirror disk
-            # (Error handling in self.mirror_files())
-            if self.use_mirror_drive:
-                self.mirror_files([self.main_log_filename,
-                                   self.imagelist_filename])
+            # Copy new log entries to mirror disk (in log writer thread):
+            # Wait for the copy, so that a failure is detected in this slice:
+            self.acq_log.mirror(wait=True)
+            self.check_log_files()
             sleep(0.1)
 
         # ===================== END OF ACQUISITION LOOP =======================
@@ -788,7 +997,7 @@ class Stack():
 
         if self.stack_completed and not (self.number_slices == 0):
             self.add_to_main_log('CTRL: Stack completed.')
-            self.transmit_cmd('COMPLETION STOP')
+            self.transmit_cmd(Event.COMPLETION_STOP)
             if use_email_monitoring:
                 # Send notification email:
                 msg_subject = 'Stack ' + self.stack_name + ' COMPLETED.'
@@ -811,22 +1020,29 @@ class Stack():
             self.add_to_main_log('CTRL: Stack paused.')
 
         # Update acquisition status:
-        self.transmit_cmd('ACQ NOT IN PROGRESS')
-        # Write last entry in log and close log file.
-        self.main_log_file.write('*** END OF LOG ***\n')
-        # Close all log files:
-        self.main_log_file.close()
-        self.imagelist_file.close()
-        self.debris_log_file.close()
-        self.error_log_file.close()
-        self.metadata_file.close()
-        # Finally, copy files to mirror drive:
-        if self.use_mirror_drive:
-            self.mirror_files([self.main_log_filename,
-                               self.imagelist_filename,
-                               self.debris_log_filename,
-                               self.error_log_filename,
-                               self.metadata_filename])
+        self.transmit_cmd(Event.ACQ_NOT_IN_PROGRESS)
+        # Wait for remaining compression jobs:
+        if self.compress_images:
+            self.add_to_main_log('CTRL: Waiting for %d compression job(s).'
+                                 % self.img_compressor.number_pending())
+            self.process_compression_results(
+                self.img_compressor.shut_down())
+        # Complete deferred work (mirroring, reports) and tile previews:
+        self.scheduler.finish()
+        self.log_preview_errors(self.img_inspector.shut_down_previews())
+        self.process_deferred_errors()
+        # Close tile containers and copy them to mirror drive:
+        if self.use_tile_container:
+            container_list = self.tile_container.get_open_container_paths()
+            self.tile_container.close_all()
+            if self.use_mirror_drive:
+                for container_path in container_list:
+                    self.mirror_container(container_path)
+        # Write last entry in log and close log files. The remaining
+        # entries are copied to the mirror drive when the files are closed.
+        self.acq_log.write('main', '*** END OF LOG ***\n')
+        self.acq_log.close()
+        self.check_log_files()
 
     # =============== END OF STACK ACQUISITION THREAD run() ===================
 
@@ -836,7 +1052,7 @@ class Stack():
                                            self.email_account,
                                            self.email_pw,
                                            self.user_email_addresses)
-        # Send command to main program via trigger, queue:
+        # Send command to main program:
         if command in ['STOP', 'PAUSE']:
             self.add_to_main_log('CTRL: STOP/PAUSE remote command received.')
             utils.send_email(self.smtp_server,
@@ -845,7 +1061,7 @@ class Stack():
                              'Command received',
                              '')
             self.pause_acquisition(2)
-            self.transmit_cmd('REMOTE STOP')
+            self.transmit_cmd(Event.REMOTE_STOP)
         if command in ['CONTINUE', 'START']:
             pass
             # TODO: let user continue paused acq with remote command
@@ -867,16 +1083,19 @@ class Stack():
         self.add_to_main_log('CTRL: ' + error_str)
         # Log in viewport window:
         log_str = str(self.slice_counter) + ': ERROR (' + error_str + ')'
-        self.error_log_file.write(log_str + '\n')
+        self.acq_log.write('error', log_str + '\n')
         # Signal to main window to update log in viewport:
-        self.transmit_cmd('VP LOG' + log_str)
+        self.transmit_cmd(Event.VP_LOG, log_str)
         # Send notification e-mail about error:
         if self.cfg['acq']['use_email_monitoring'] == 'True':
+            # Make sure the attached log file is complete:
+            self.acq_log.flush()
+            main_log_filename = self.acq_log.get_file_name('main')
             if self.viewport_filename is not None:
-                attachment_list = [self.main_log_filename,
+                attachment_list = [main_log_filename,
                                    self.viewport_filename]
             else:
-                attachment_list = [self.main_log_filename]
+                attachment_list = [main_log_filename]
             msg_subject = ('Stack ' + self.stack_name + ': slice '
                            + str(self.slice_counter) + ', ERROR')
             success = utils.send_email(self.smtp_server,
@@ -890,29 +1109,33 @@ class Stack():
             else:
                 self.add_to_main_log('CTRL: ERROR sending notification email.')
         # Tell main window that there was an error:
-        self.transmit_cmd('ERROR PAUSE')
+        self.transmit_cmd(Event.ERROR_PAUSE)
 
-    def send_status_report(self):
-        """Compile a status report and send it via e-mail."""
+    def send_status_report(self, slice_counter, viewport_filename):
+        """Compile a status report for slice slice_counter and send it via
+           e-mail.
+        """
         attachment_list = []
         temp_file_list = []
         missing_list = []
-        tile_list = json.loads(self.cfg['monitoring']['watch_tiles'])
-        ov_list = json.loads(self.cfg['monitoring']['watch_ov'])
+        tile_list = self.watch_tiles
+        ov_list = self.watch_ov
+        # Make sure the attached log files are complete:
+        self.acq_log.flush()
         if self.cfg['monitoring']['send_logfile'] == 'True':
-            attachment_list.append(self.main_log_filename)
+            attachment_list.append(self.acq_log.get_file_name('main'))
         if self.cfg['monitoring']['send_additional_logs'] == 'True':
-            attachment_list.append(self.debris_log_filename)
-            attachment_list.append(self.error_log_filename)
+            attachment_list.append(self.acq_log.get_file_name('debris'))
+            attachment_list.append(self.acq_log.get_file_name('error'))
         if self.cfg['monitoring']['send_viewport'] == 'True':
-            if os.path.isfile(self.viewport_filename):
-                attachment_list.append(self.viewport_filename)
+            if os.path.isfile(viewport_filename):
+                attachment_list.append(viewport_filename)
             else:
-                missing_list.append(self.viewport_filename)
+                missing_list.append(viewport_filename)
         if (self.cfg['monitoring']['send_ov'] == 'True'):
             for ov_number in ov_list:
                 save_path = self.base_dir + '\\' + utils.get_ov_save_path(
-                            self.stack_name, ov_number, self.slice_counter)
+                            self.stack_name, ov_number, slice_counter)
                 if os.path.isfile(save_path):
                     attachment_list.append(save_path)
                 else:
@@ -923,20 +1146,39 @@ class Stack():
                 [grid_number, tile_number] = tile_key.split('.')
                 save_path = self.base_dir + '\\' + utils.get_tile_save_path(
                             self.stack_name, grid_number, tile_number,
-                            self.slice_counter)
-                if os.path.isfile(save_path):
+                            slice_counter)
+                tile_image = None
+                # Use the decoded image if still in memory:
+                frame = self.frame_store.get(
+                    'g' + grid_number.zfill(utils.GRID_DIGITS)
+                    + '_t' + tile_number.zfill(utils.TILE_DIGITS),
+                    slice_counter)
+                if frame is not None:
+                    tile_image = frame.pixels
+                    frame.release()
+                elif os.path.isfile(save_path):
                     # If it exists, load image and crop it:
-                    tile_image = Image.open(save_path)
-                    (r_width, r_height) = tile_image.size
+                    tile_image = read_image(save_path)
+                elif self.use_tile_container:
+                    # Tile file may have been removed after storing the
+                    # tile in the grid container:
+                    tile_array = self.tile_container.get_tile(
+                        int(grid_number), int(tile_number),
+                        slice_counter)
+                    self.log_tile_container_error()
+                    if tile_array is not None:
+                        tile_image = tile_array
+                if tile_image is not None:
+                    r_height, r_width = tile_image.shape[:2]
                     cropped_tile_filename = (
                         self.base_dir
                         + '\\workspace\\tile_g'
                         + str(grid_number).zfill(utils.GRID_DIGITS)
                         + 't' + str(tile_number).zfill(utils.TILE_DIGITS)
                         + '_cropped.tif')
-                    tile_image.crop((int(r_width/3), int(r_height/3),
-                         int(2*r_width/3), int(2*r_height/3))).save(
-                         cropped_tile_filename)
+                    write_image(cropped_tile_filename,
+                                tile_image[int(r_height/3):int(2*r_height/3),
+                                           int(r_width/3):int(2*r_width/3)])
                     temp_file_list.append(cropped_tile_filename)
                     attachment_list.append(cropped_tile_filename)
                 else:
@@ -947,16 +1189,13 @@ class Stack():
                 save_path = (self.base_dir + '\\'
                              + utils.get_ov_reslice_save_path(ov_number))
                 if os.path.isfile(save_path):
-                    ov_reslice_img = Image.open(save_path)
-                    height = ov_reslice_img.size[1]
+                    ov_reslice_img = read_image(save_path)
                     cropped_ov_reslice_save_path = (
                         self.base_dir + '\\workspace\\reslice_OV'
                         + str(ov_number).zfill(utils.OV_DIGITS) + '.png')
-                    if height>1000:
-                        ov_reslice_img.crop(0, height-1000, 400, height).save(
-                            cropped_ov_reslice_save_path)
-                    else:
-                        ov_reslice_img.save(cropped_ov_reslice_save_path)
+                    # Most recent 1000 slices:
+                    write_image(cropped_ov_reslice_save_path,
+                                ov_reslice_img[-1000:])
                     attachment_list.append(cropped_ov_reslice_save_path)
                     temp_file_list.append(cropped_ov_reslice_save_path)
                 else:
@@ -969,18 +1208,14 @@ class Stack():
                              + utils.get_tile_reslice_save_path(
                              grid_number, tile_number))
                 if os.path.isfile(save_path):
-                    reslice_img = Image.open(save_path)
-                    height = reslice_img.size[1]
+                    reslice_img = read_image(save_path)
                     cropped_reslice_save_path = (
                         self.base_dir + '\\workspace\\reslice_tile_g'
                         + str(grid_number).zfill(utils.GRID_DIGITS)
                         + 't' + str(tile_number).zfill(utils.TILE_DIGITS)
                         + '.png')
-                    if height>1000:
-                        reslice_img.crop(0, height-1000, 400, height).save(
-                            cropped_reslice_save_path)
-                    else:
-                        reslice_img.save(cropped_reslice_save_path)
+                    write_image(cropped_reslice_save_path,
+                                reslice_img[-1000:])
                     attachment_list.append(cropped_reslice_save_path)
                     temp_file_list.append(cropped_reslice_save_path)
                 else:
@@ -988,7 +1223,7 @@ class Stack():
 
         # Send report email:
         msg_subject = ('Status report for stack ' + self.stack_name
-                       + ': slice ' + str(self.slice_counter))
+                       + ': slice ' + str(slice_counter))
         msg_text = 'See attachments.'
         if missing_list:
             msg_text += ('\n\nThe following file(s) could not be attached. '
@@ -1009,7 +1244,6 @@ class Stack():
         # clean up:
         for file in temp_file_list:
             os.remove(file)
-        self.report_requested = False
 
     def perform_cutting_sequence(self):
         # Move to new z position:
@@ -1019,7 +1253,7 @@ class Stack():
             self.stage_z_position))
         self.microtome.move_stage_to_z(self.stage_z_position)
         # Show new Z position in main window:
-        self.transmit_cmd('UPDATE Z')
+        self.transmit_cmd(Event.UPDATE_Z)
         # Check if there were microtome problems:
         self.error_state = self.microtome.get_error_state()
         if self.error_state == 0:
@@ -1028,7 +1262,11 @@ class Stack():
                           + ' nm cutting thickness).')
             # do the cut (near, cut, retract, clear)
             self.microtome.do_full_cut()
-            sleep(self.full_cut_duration)
+            # Run deferred work while the microtome is cutting. Jobs that
+            # must run in this thread and would not finish in time are
+            # kept for after the cut:
+            self.scheduler.run_window(time.time() + self.full_cut_duration,
+                                      defer_foreground=True)
             self.error_state = self.microtome.get_error_state()
             self.microtome.reset_error_state()
         if self.error_state > 0:
@@ -1060,8 +1298,8 @@ class Stack():
                 log_str = (str(self.slice_counter) + ': WARNING ('
                            + 'Move to OV%d position failed)'
                            % ov_number)
-                self.error_log_file.write(log_str + '\n')
-                self.transmit_cmd('VP LOG' + log_str)
+                self.acq_log.write('error', log_str + '\n')
+                self.transmit_cmd(Event.VP_LOG, log_str)
                 # Try again
                 sleep(2)
                 self.microtome.move_stage_to_xy(ov_stage_position)
@@ -1073,7 +1311,7 @@ class Stack():
                     move_success = False
                 else:
                     # Show new stage coordinates in GUI:
-                    self.transmit_cmd('UPDATE XY')
+                    self.transmit_cmd(Event.UPDATE_XY)
         if move_success:
             self.set_target_wd_stig()
             self.add_to_main_log(
@@ -1099,11 +1337,11 @@ class Stack():
                                                      ov_number,
                                                      self.slice_counter))
             # Indicate the overview being acquired in the viewport
-            self.transmit_cmd('ACQ IND OV' + str(ov_number))
+            self.transmit_cmd(Event.ACQ_IND_OV, ov_number)
             # Grab the image from SmartSEM
             self.sem.acquire_frame(ov_save_path)
             # Remove indicator colour
-            self.transmit_cmd('ACQ IND OV' + str(ov_number))
+            self.transmit_cmd(Event.ACQ_IND_OV, ov_number)
 
             # Check if OV saved and show in viewport
             if os.path.isfile(ov_save_path):
@@ -1124,10 +1362,10 @@ class Stack():
                         + ', SD:' + '{0:.2f}'.format(stddev))
                     workspace_save_path = (self.base_dir + '\\workspace\\OV'
                                            + str(ov_number).zfill(3) + '.bmp')
-                    imsave(workspace_save_path, ov_img)
+                    write_image(workspace_save_path, ov_img)
                     self.ovm.update_ov_file_list(ov_number, workspace_save_path)
                     # Signal to update viewport:
-                    self.transmit_cmd('MV UPDATE OV' + str(ov_number))
+                    self.transmit_cmd(Event.MV_UPDATE_OV, ov_number)
                 if load_error:
                     self.error_state = 404
                     ov_accepted = False
@@ -1136,8 +1374,7 @@ class Stack():
                     self.error_state = 303
                     ov_accepted = False
                     # don't pause yet, will try again
-                elif ((self.cfg['acq']['monitor_images'] == 'True')
-                    and not range_test_passed):
+                elif self.monitor_images and not range_test_passed:
                     ov_accepted = False
                     self.error_state = 502    # OV image error
                     self.pause_acquisition(1)
@@ -1148,7 +1385,7 @@ class Stack():
                     ov_accepted = True
                     # Check for debris:
                     if self.first_ov[ov_number]:
-                        self.transmit_cmd('ASK DEBRIS FIRST OV')
+                        self.transmit_cmd(Event.ASK_DEBRIS_FIRST_OV)
                         # The command above causes message box to be displayed
                         # and variables self.user_reply_received and
                         # self.user_reply to be updated
@@ -1160,17 +1397,17 @@ class Stack():
                             self.pause_acquisition(1)
                         self.user_reply_received = False
 
-                    elif (self.cfg['acq']['use_debris_detection'] == 'True'):
+                    elif self.use_debris_detection:
                         # Detect potential debris:
                         debris_detected, msg = self.img_inspector.detect_debris(
-                            ov_number,
-                            int(self.cfg['debris']['detection_method']))
+                            ov_number, self.debris_detection_method)
                         self.add_to_main_log(msg)
                         if debris_detected:
                             ov_accepted = False
                             # Ask user?
-                            if self.cfg['acq']['ask_user'] == 'True':
-                                self.transmit_cmd('ASK DEBRIS CONFIRMATION')
+                            if self.ask_user:
+                                self.transmit_cmd(
+                                    Event.ASK_DEBRIS_CONFIRMATION)
                                 while not self.user_reply_received:
                                     sleep(0.1)
                                 ov_accepted = (
@@ -1194,7 +1431,7 @@ class Stack():
         shutil.copy(ov_file_name, debris_save_path)
 
         if self.use_mirror_drive:
-            self.mirror_files([debris_save_path])
+            self.mirror_files_deferred([debris_save_path])
 
     def remove_debris(self):
         """Try to remove detected debris by sweeping the surface."""
@@ -1206,8 +1443,8 @@ class Stack():
             # Print warning in viewport window:
             log_str = (str(self.slice_counter)
                        + ': WARNING (' + 'Problem during sweep)')
-            self.error_log_file.write(log_str + '\n')
-            self.transmit_cmd('VP LOG' + log_str)
+            self.acq_log.write('error', log_str + '\n')
+            self.transmit_cmd(Event.VP_LOG, log_str)
             # Trying again after 3 sec:
             sleep(3)
             self.microtome.do_sweep(self.stage_z_position)
@@ -1235,14 +1472,19 @@ class Stack():
         retake_img = (
             ([grid_number, tile_number] == self.acq_interrupted_at)
             and not (tile_number in self.tiles_acquired))
-        # Check if file already exists:
-        if (not os.path.isfile(save_path) or retake_img):
+        # Check if file already exists (or has been stored in container):
+        tile_exists = os.path.isfile(save_path)
+        if not tile_exists and self.use_tile_container:
+            tile_exists = self.tile_container.contains_tile(
+                grid_number, tile_number, self.slice_counter)
+            self.log_tile_container_error()
+        if (not tile_exists or retake_img):
             # Read target coordinates for current tile:
             stage_x, stage_y = self.gm.get_tile_coordinates_s(
                 grid_number, tile_number)
             # Move to that position:
             self.add_to_main_log('3VIEW: Moving stage to position '
-                          'of tile %s' % tile_id)
+                          'of tile %s' % tile_id, DEBUG)
             self.microtome.move_stage_to_xy((stage_x, stage_y))
             # The move function waits for the specified stage move wait interval
             # Check if there were microtome problems:
@@ -1254,9 +1496,9 @@ class Stack():
                 # Error_log in viewport window:
                 error_log_str = (str(self.slice_counter)
                     + ': WARNING (Problem with XY stage move)')
-                self.error_log_file.write(error_log_str + '\n')
+                self.acq_log.write('error', error_log_str + '\n')
                 # Signal to main window to update log in viewport:
-                self.transmit_cmd('VP LOG' + error_log_str)
+                self.transmit_cmd(Event.VP_LOG, error_log_str)
                 sleep(2)
                 # Try to move to tile position again:
                 self.add_to_main_log('3VIEW: Moving stage to position '
@@ -1276,7 +1518,8 @@ class Stack():
                 tile_skipped = True
                 tile_accepted = True
                 self.add_to_main_log(
-                    'CTRL: Tile %s already acquired. Skipping.' % tile_id)
+                    'CTRL: Tile %s already acquired. Skipping.' % tile_id,
+                    DEBUG)
             else:
                 # If tile already exists without being listed as acquired
                 # and no indication of previous interruption:
@@ -1290,7 +1533,7 @@ class Stack():
         if self.error_state == 0 and not tile_skipped:
 
             # Show updated stage coordinates in main window:
-            self.transmit_cmd('UPDATE XY')
+            self.transmit_cmd(Event.UPDATE_XY)
 
             # Perform autofocus (method 0, SmartSEM) on current tile?
             if (self.af.is_active() and self.af.get_method() == 0
@@ -1319,18 +1562,22 @@ class Stack():
             # (even if failure detected. May be helpful.)
             self.add_to_main_log('SEM: Acquiring tile at X:'
                           + '{0:.3f}'.format(stage_x)
-                          + ', Y:' + '{0:.3f}'.format(stage_y))
+                          + ', Y:' + '{0:.3f}'.format(stage_y), DEBUG)
             # Indicate current tile in Viewport:
-            self.transmit_cmd('ACQ IND TILE'
-                              + str(grid_number) + '.' + str(tile_number))
+            self.transmit_cmd(Event.ACQ_IND_TILE, (grid_number, tile_number))
             # Grab frame:
             self.sem.acquire_frame(save_path)
             # Remove indication in Viewport:
-            self.transmit_cmd('ACQ IND TILE'
-                              + str(grid_number) + '.' + str(tile_number))
-            # Copy to mirror drive:
-            if self.use_mirror_drive:
-                self.mirror_files([save_path])
+            self.transmit_cmd(Event.ACQ_IND_TILE, (grid_number, tile_number))
+            # Copy to mirror drive (if compression is active, the tile is
+            # mirrored after compression):
+            if self.use_mirror_drive and not self.compress_images:
+                if (self.use_tile_container
+                        and not self.tile_container.keep_files()):
+                    # File will be removed after storing it in container:
+                    self.mirror_files([save_path])
+                else:
+                    self.mirror_files_deferred([save_path])
             # Check if image was saved and process it:
             if os.path.isfile(save_path):
                 (tile_img, mean, stddev,
@@ -1348,11 +1595,11 @@ class Stack():
                                   + ': M:' + '{0:.2f}'.format(mean)
                                   + ', SD:' + '{0:.2f}'.format(stddev))
                     # New thumbnail available, show it:
-                    self.transmit_cmd('DRAW MV')
+                    self.transmit_cmd(Event.DRAW_MV)
 
                     # When monitoring enabled check if tile ok:
                     tile_accepted = True
-                    if self.cfg['acq']['monitor_images'] == 'True':
+                    if self.monitor_images:
                         if not range_test_passed:
                             tile_accepted = False
                             self.error_state = 503
@@ -1404,7 +1651,8 @@ class Stack():
             for tile in all_autofocus_tiles:
                 g = int(tile.split('.')[0])
                 t = int(tile.split('.')[1])
-                if g == grid_number and not t in active_tiles:
+                if (g == grid_number
+                        and not self.gm.is_tile_active(grid_number, t)):
                     autofocus_tiles.append(str(g) + '.' + str(t))
             # Perform Zeiss autofocus for non_active_autofocus_tiles:
             for tile in autofocus_tiles:
@@ -1433,10 +1681,9 @@ class Stack():
 
             if self.acq_interrupted:
                 # Remove tiles that are no longer active from acquired_tiles list
-                acq_tmp = list(self.tiles_acquired)
-                for tile in acq_tmp:
-                    if not (tile in active_tiles):
-                        self.tiles_acquired.remove(tile)
+                self.tiles_acquired[:] = [
+                    tile for tile in self.tiles_acquired
+                    if self.gm.is_tile_active(grid_number, tile)]
 
             tile_width, tile_height = self.gm.get_tile_size_px_py(grid_number)
 
@@ -1460,6 +1707,10 @@ class Stack():
                      tile_accepted, tile_skipped, tile_selected) = (
                         self.acquire_tile(grid_number, tile_number))
 
+                    if not tile_accepted and not tile_skipped:
+                        self.img_inspector.add_tile_rejection(
+                            grid_number, tile_number, self.slice_counter)
+
                     if self.error_state in [302, 303, 304, 404]:
                         self.add_to_main_log(
                             'CTRL: Problem with tile detected. Trying again.')
@@ -1481,12 +1732,20 @@ class Stack():
                     # Save stats and reslice:
                     self.img_inspector.save_tile_reslice_and_stats(
                         grid_number, tile_number, self.slice_counter)
+                    # Store tile in grid container:
+                    if self.use_tile_container:
+                        self.store_tile_in_container(
+                            tile_img, save_path, grid_number, tile_number)
                     # If heuristic autofocus enabled and tile selected as
                     # reference tile, process tile:
                     if (self.af.is_active() and self.af.get_method() == 1
                             and self.af.is_tile_selected(grid_number, tile_number)):
                         self.perform_heuristic_autofocus(
                             tile_img, grid_number, tile_number)
+                    # Compress in background (file may have been removed
+                    # after storing it in the tile container):
+                    if self.compress_images and os.path.isfile(save_path):
+                        self.img_compressor.submit(save_path)
 
                 elif (not tile_selected
                       and not tile_skipped
@@ -1499,6 +1758,16 @@ class Stack():
                     except:
                         self.add_to_main_log(
                             'CTRL: Tile image file could not be deleted.')
+                elif (self.use_mirror_drive and self.compress_images
+                      and not tile_skipped and os.path.isfile(save_path)):
+                    # Tile not accepted, but kept on disk. It is not
+                    # compressed, therefore mirror it now:
+                    self.mirror_files_deferred([save_path])
+                # Record tiles that have been compressed in the meantime
+                # (they are mirrored during the next cut):
+                if self.compress_images:
+                    self.process_compression_results(
+                        self.img_compressor.get_finished())
                 # Was acq paused by user or interrupted by error? Save current pos:
                 if self.pause_state == 1:
                     self.save_interruption_point(grid_number, tile_number)
@@ -1508,10 +1777,12 @@ class Stack():
             if len(active_tiles) == len(self.tiles_acquired):
                 # Grid is complete, add it to the grids_acquired list:
                 self.grids_acquired.append(grid_number)
-                self.cfg['acq']['grids_acquired'] = str(self.grids_acquired)
+                self.cfg.set_value('acq', 'grids_acquired',
+                                   self.grids_acquired)
                 # Empty the tile list since all tiles were acquired:
                 self.tiles_acquired = []
                 self.cfg['acq']['tiles_acquired'] = '[]'
+                self.save_journal_state()
 
 
     def register_accepted_tile(self, save_path, grid_number, tile_number,
@@ -1525,14 +1796,17 @@ class Stack():
         pos_x, pos_y = self.gm.get_tile_coordinates_p(grid_number, tile_number)
         global_px = int(pos_x - tile_width/2)
         global_py = int(pos_y - tile_height/2)
-        self.imagelist_file.write(
+        self.acq_log.write('imagelist',
             save_path + ';'
             + str(global_px) + ';'
             + str(global_py) + ';'
             + str(self.slice_counter) + '\n')
         self.tiles_acquired.append(tile_number)
-        self.cfg['acq']['tiles_acquired'] = str(
-            self.tiles_acquired)
+        self.cfg.set_value('acq', 'tiles_acquired', self.tiles_acquired)
+        try:
+            self.journal.add_tile(grid_number, tile_number)
+        except:
+            self.add_journal_error()
         wd = 0
         tile_metadata = {
             'timestamp': timestamp,
@@ -1544,7 +1818,7 @@ class Stack():
             'glob_x': global_px,
             'glob_y': global_py,
             'slice_counter': self.slice_counter}
-        self.metadata_file.write('TILE: ' + str(tile_metadata) + '\n')
+        self.acq_log.write('metadata', 'TILE: ' + str(tile_metadata) + '\n')
         # Server notification:
         if self.send_metadata:
             url = self.metadata_server + '/tile/metadata/update'
@@ -1555,6 +1829,65 @@ class Stack():
                 self.add_to_main_log('CTRL: Error sending tile metadata '
                                      'to server.')
 
+    def store_tile_in_container(self, tile_img, save_path,
+                                grid_number, tile_number):
+        """Add the accepted tile to the container of its grid. Remove the
+           tile file afterwards if specified in the configuration. The copy
+           on the mirror drive is kept.
+        """
+        success = self.tile_container.add_tile(
+            grid_number, tile_number, self.slice_counter, tile_img)
+        if not success:
+            self.add_to_main_log(
+                'CTRL: WARNING: Tile %d.%d could not be stored in container. '
+                'Tile file is kept.' % (grid_number, tile_number))
+            self.log_tile_container_error()
+        elif not self.tile_container.keep_files():
+            if self.use_mirror_drive and self.compress_images:
+                # Tile will not be compressed, mirror it now:
+                self.mirror_files([save_path])
+            try:
+                os.remove(save_path)
+            except:
+                self.add_to_main_log(
+                    'CTRL: Tile image file could not be deleted.')
+
+    def log_tile_container_error(self):
+        error = self.tile_container.get_error()
+        if error is not None:
+            self.add_to_main_log('CTRL: WARNING: ' + error)
+
+    def process_finished_compression_jobs(self):
+        self.process_compression_results(self.img_compressor.get_finished())
+
+    def process_compression_results(self, results):
+        """Record the compression ratios of finished compression jobs in
+           the metadata file and copy the compressed files to the mirror
+           drive. If compression failed, the original file is mirrored.
+        """
+        for (file_name, original_size, compressed_size,
+             success, msg) in results:
+            if file_name is None:
+                self.add_to_main_log('CTRL: WARNING: Compression job '
+                                     'failed: ' + msg)
+                continue
+            if success:
+                compression_metadata = {
+                    'filename': file_name,
+                    'codec': self.img_compressor.get_codec(),
+                    'original_size': original_size,
+                    'compressed_size': compressed_size,
+                    'ratio': round(original_size / compressed_size, 3)}
+                self.acq_log.write('metadata',
+                    'COMPRESSION: ' + str(compression_metadata) + '\n')
+            else:
+                self.add_to_main_log(
+                    'CTRL: WARNING: Compression of '
+                    + file_name[file_name.rfind('\\') + 1:]
+                    + ' failed (' + msg + '). Original file kept.')
+            if self.use_mirror_drive:
+                self.mirror_files_deferred([file_name])
+
     def perform_zeiss_autofocus(self, do_focus, do_stig, do_move,
                                 grid_number, tile_number):
         """Run SmartSEM autofocus at current stage position if do_move == False,
@@ -1579,9 +1912,9 @@ class Stack():
                 # Error_log in viewport window:
                 error_log_str = (str(self.slice_counter)
                     + ': WARNING (Problem with XY stage move)')
-                self.error_log_file.write(error_log_str + '\n')
+                self.acq_log.write('error', error_log_str + '\n')
                 # Signal to main window to update log in viewport:
-                self.transmit_cmd('VP LOG' + error_log_str)
+                self.transmit_cmd(Event.VP_LOG, error_log_str)
                 sleep(2)
                 # Try to move to tile position again:
                 self.add_to_main_log(
@@ -1718,7 +2051,7 @@ class Stack():
                 self.target_stig_x + self.stig_x_delta,
                 self.target_stig_y + self.stig_y_delta)
         if change_detected:
-            self.transmit_cmd('FOCUS ALERT')
+            self.transmit_cmd(Event.FOCUS_ALERT)
 
     def check_locked_mag(self):
         """Check if mag was accidentally changed and restore target mag."""
@@ -1729,7 +2062,7 @@ class Stack():
             #Fix it:
             self.add_to_main_log('CTRL: Resetting magnification.')
             self.sem.set_mag(self.target_mag)
-            self.transmit_cmd('MAG ALERT')
+            self.transmit_cmd(Event.MAG_ALERT)
 
     def set_user_reply(self, reply):
         """Receive a user reply from main window."""
@@ -1747,6 +2080,11 @@ class Stack():
         self.cfg['acq']['interrupted_at'] = '[]'
         self.cfg['acq']['tiles_acquired'] = '[]'
         self.cfg['acq']['grids_acquired'] = '[]'
+        self.acq_interrupted = False
+        self.acq_interrupted_at = []
+        self.tiles_acquired = []
+        self.grids_acquired = []
+        self.save_journal_state()
 
     # TODO: Remove unnecessary getters and setters, use direct access.
     def get_slice_counter(self):
@@ -1755,6 +2093,7 @@ class Stack():
     def set_slice_counter(self, slice_counter):
         self.slice_counter = slice_counter
         self.cfg['acq']['slice_counter'] = str(slice_counter)
+        self.save_journal_state()
 
     def get_number_slices(self):
         return self.number_slices
@@ -1776,23 +2115,25 @@ class Stack():
     def set_total_z_diff(self, z_diff):
         self.total_z_diff = z_diff
         self.cfg['acq']['total_z_diff'] = str(z_diff)
+        self.save_journal_state()
 
     def is_paused(self):
         return (self.cfg['acq']['paused'] == 'True')
 
-    def transmit_cmd(self, cmd):
-        """Transmit command to the main window thread."""
-        self.queue.put(cmd)
-        self.trigger.s.emit()
+    def transmit_cmd(self, event, data=None):
+        """Transmit event (with optional data) to the main window thread."""
+        self.events.put(event, data)
 
-    def add_to_main_log(self, msg):
-        """Add entry to the log in the main window"""
+    def add_to_main_log(self, msg, level=INFO):
+        """Add entry to the main log file and (unless level is below
+           GUI_LOG_LEVEL) to the log in the main window.
+        """
         msg = utils.format_log_entry(msg)
         # Store entry in main log file:
-        self.main_log_file.write(msg + '\n')
-        # Send entry to main window via queue and trigger:
-        self.queue.put(msg)
-        self.trigger.s.emit()
+        self.acq_log.write('main', msg + '\n', level)
+        # Send entry to main window:
+        if level >= self.GUI_LOG_LEVEL:
+            self.events.put(Event.LOG, msg)
 
     def pause_acquisition(self, pause_state):
         """Pause the current acquisition."""
@@ -1811,13 +2152,16 @@ class Stack():
         self.cfg['acq']['interrupted'] = 'True'
         self.acq_interrupted_at = [grid_number, tile_number]
         self.cfg['acq']['interrupted_at'] = str(self.acq_interrupted_at)
+        self.save_journal_state()
 
     def reset_interruption_info(self):
         self.acq_interrupted = False
         self.cfg['acq']['interrupted'] = 'False'
         self.acq_interrupted_at = []
         self.cfg['acq']['interrupted_at'] = '[]'
-        self.acquired_tiles = []
+        self.tiles_acquired = []
         self.cfg['acq']['tiles_acquired'] = '[]'
-        self.acquired_grids = []
+        self.grids_acquired = []
         self.cfg['acq']['grids_acquired'] = '[]'
+        # Slice completed (after cut), compact the journal:
+        self.save_journal_state()
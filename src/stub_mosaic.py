@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides the canvas for stub overview mosaics. Frames are
+   written into memory-mapped arrays on disk (full resolution and a pyramid
+   of 2x downsampled levels), so that the memory usage does not depend on
+   the size of the mosaic. The pyramid levels are saved as separate images
+   which the viewport loads depending on the current zoom level.
+"""
+
+import os
+import numpy as np
+
+from image_io import write_image
+
+
+# Stop adding pyramid levels when both dimensions are below this size:
+MIN_LEVEL_SIZE = 2048
+
+
+def get_level_file_name(stub_ov_file, level):
+    """Return the file name of the specified pyramid level of a stub OV.
+       Level 0 is the full-resolution image (stub_ov_file itself).
+    """
+    if level == 0:
+        return stub_ov_file
+    return stub_ov_file[:-4] + '_L' + str(level) + '.png'
+
+def get_canvas_file_name(base_dir, stub_ov_file):
+    """Return the file name of the memory-mapped full-resolution canvas
+       in the workspace folder.
+    """
+    return (base_dir + '\\workspace\\'
+            + os.path.basename(stub_ov_file)[:-4] + '.npy')
+
+def get_number_levels(width, height):
+    number_levels = 1
+    while max(width, height) >> (number_levels - 1) > MIN_LEVEL_SIZE:
+        number_levels += 1
+    return number_levels
+
+
+class StubMosaic(object):
+
+    def __init__(self, base_dir, stub_ov_file, width, height):
+        self.stub_ov_file = stub_ov_file
+        self.width = width
+        self.height = height
+        self.number_levels = get_number_levels(width, height)
+        self.canvas_files = [get_canvas_file_name(base_dir, stub_ov_file)]
+        for level in range(1, self.number_levels):
+            self.canvas_files.append(
+                self.canvas_files[0][:-4] + '_L' + str(level) + '.npy')
+        # Canvases are memory-mapped and zero-initialized:
+        self.canvas = []
+        for level in range(self.number_levels):
+            self.canvas.append(np.lib.format.open_memmap(
+                self.canvas_files[level], mode='w+', dtype=np.uint8,
+                shape=(height >> level, width >> level)))
+
+    def get_number_levels(self):
+        return self.number_levels
+
+    def get_preview_level(self):
+        return self.number_levels - 1
+
+    def add_frame(self, frame, x, y):
+        """Write frame (numpy array) at position x, y into all levels."""
+        level_frame = frame
+        for level in range(self.number_levels):
+            if level > 0:
+                # 2x2 block mean of the previous level:
+                h = level_frame.shape[0] // 2 * 2
+                w = level_frame.shape[1] // 2 * 2
+                level_frame = level_frame[:h, :w].reshape(
+                    h // 2, 2, w // 2, 2).mean(axis=(1, 3)).astype(np.uint8)
+            canvas = self.canvas[level]
+            lx, ly = x >> level, y >> level
+            h = min(level_frame.shape[0], canvas.shape[0] - ly)
+            w = min(level_frame.shape[1], canvas.shape[1] - lx)
+            canvas[ly:ly+h, lx:lx+w] = level_frame[:h, :w]
+
+    def save_preview(self):
+        """Save the coarsest level as an image. Used to show the progress of
+           the acquisition in the viewport. Return the level.
+        """
+        level = self.get_preview_level()
+        self.save_level(level)
+        return level
+
+    def save_level(self, level):
+        write_image(get_level_file_name(self.stub_ov_file, level),
+                    self.canvas[level])
+
+    def save(self):
+        """Save all levels as images. The full-resolution canvas is kept in
+           the workspace folder to allow the viewport to read only the
+           visible area.
+        """
+        for level in range(self.number_levels):
+            self.canvas[level].flush()
+            self.save_level(level)
+        self.close(keep_full_resolution=True)
+
+    def close(self, keep_full_resolution=False):
+        """Release the memory maps and delete the canvas files."""
+        self.canvas = []
+        for level, file_name in enumerate(self.canvas_files):
+            if level == 0 and keep_full_resolution:
+                continue
+            try:
+                os.remove(file_name)
+            except:
+                pass
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+#==============================================================================
+#   SBEMimage, ver. 2.0
+#   Acquisition control software for serial block-face electron microscopy
+#   (c) 2016-2018 Benjamin Titze,
+#   Friedrich Miescher Institute for Biomedical Research, Basel.
+#   This software is licensed under the terms of the MIT License.
+#   See LICENSE.txt in the project root folder.
+#==============================================================================
+
+"""This module provides an optional container output for tile images.
+   Accepted tiles are appended to one chunked, compressed container per grid
+   (HDF5 or OME-Zarr). Each tile is stored as a z-stack (one chunk per slice)
+   together with a 2x downsampled pyramid level, so that the z-column of a
+   single tile can be read without opening thousands of files.
+"""
+
+import os
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+import utils
+
+
+# Container formats:
+FORMAT_HDF5 = 'hdf5'
+FORMAT_ZARR = 'zarr'
+
+# Number of pyramid levels (level 0 is full resolution):
+PYRAMID_LEVELS = 2
+
+
+class TileContainer(object):
+
+    def __init__(self, config):
+        self.cfg = config
+        # Open container handles, one per grid:
+        self.containers = {}
+        # Grids whose containers are open in write mode:
+        self.writable = set()
+        # Last error that occurred when accessing a container:
+        self.error = None
+        self.update_settings()
+
+    def update_settings(self):
+        self.base_dir = self.cfg['acq']['base_dir']
+        self.active = (self.cfg['acq']['use_tile_container'] == 'True')
+        self.container_format = self.cfg['acq']['tile_container_format']
+        self.keep_tile_files = (self.cfg['acq']['keep_tile_files'] == 'True')
+
+    def is_active(self):
+        return self.active
+
+    def keep_files(self):
+        return self.keep_tile_files
+
+    def is_format_available(self):
+        """Check if the library for the selected format is installed."""
+        if self.container_format == FORMAT_HDF5:
+            return h5py is not None
+        elif self.container_format == FORMAT_ZARR:
+            return zarr is not None
+        return False
+
+    def get_container_path(self, grid_number):
+        return (self.base_dir + '\\' + utils.get_tile_container_path(
+                grid_number, self.container_format))
+
+    def get_open_container_paths(self):
+        return [self.get_container_path(grid_number)
+                for grid_number in self.containers]
+
+    def open_container(self, grid_number, writable=True):
+        """Return the container for the specified grid, open it if needed.
+           If writable is False, the container is opened read-only, and None
+           is returned if it does not exist.
+        """
+        if grid_number in self.containers:
+            if not writable or grid_number in self.writable:
+                return self.containers[grid_number]
+            # Opened read-only before, reopen in write mode:
+            self.close_container(grid_number)
+        path = self.get_container_path(grid_number)
+        if not writable and not os.path.exists(path):
+            return None
+        mode = 'a' if writable else 'r'
+        if self.container_format == FORMAT_HDF5:
+            container = h5py.File(path, mode)
+        else:
+            container = zarr.open_group(path, mode=mode)
+        self.containers[grid_number] = container
+        if writable:
+            self.writable.add(grid_number)
+        return container
+
+    def close_container(self, grid_number):
+        container = self.containers.pop(grid_number)
+        self.writable.discard(grid_number)
+        if self.container_format == FORMAT_HDF5:
+            try:
+                container.close()
+            except OSError as e:
+                self.set_error(grid_number, e)
+
+    def close_all(self):
+        for grid_number in list(self.containers):
+            self.close_container(grid_number)
+
+    def set_error(self, grid_number, exception):
+        self.error = ('Grid ' + str(grid_number) + ' container: '
+                      + str(exception))
+
+    def get_error(self):
+        """Return and clear the last error (or None)."""
+        error, self.error = self.error, None
+        return error
+
+    def add_tile(self, grid_number, tile_number, slice_number, img):
+        """Append the tile image img (numpy array) to the container of the
+           specified grid. If the slice is already stored (for example after
+           an interrupted acquisition), the existing entry is overwritten.
+           Return True if successful.
+        """
+        try:
+            container = self.open_container(grid_number)
+            tile_group = self.get_tile_group(container, tile_number, True)
+            slices = tile_group['slices']
+            if slices.shape[0] > 0 and slices[-1] == slice_number:
+                z = slices.shape[0] - 1
+            else:
+                z = slices.shape[0]
+                self.resize_z(slices, z + 1)
+                slices[z] = slice_number
+            level_img = img
+            for level in range(PYRAMID_LEVELS):
+                if level > 0:
+                    level_img = self.downsample(level_img)
+                dataset = self.get_level_dataset(
+                    tile_group, level, level_img)
+                if dataset.shape[0] <= z:
+                    self.resize_z(dataset, z + 1)
+                dataset[z] = level_img
+            if self.container_format == FORMAT_HDF5:
+                container.flush()
+            return True
+        except (OSError, KeyError, ValueError) as e:
+            self.set_error(grid_number, e)
+            return False
+
+    def contains_tile(self, grid_number, tile_number, slice_number):
+        try:
+            container = self.open_container(grid_number, writable=False)
+            if container is None:
+                return False
+            tile_group = self.get_tile_group(container, tile_number, False)
+            if tile_group is None:
+                return False
+            return slice_number in tile_group['slices'][:]
+        except (OSError, KeyError) as e:
+            self.set_error(grid_number, e)
+            return False
+
+    def get_tile(self, grid_number, tile_number, slice_number, level=0):
+        """Return the stored image for the specified tile and slice, or None
+           if not available.
+        """
+        try:
+            container = self.open_container(grid_number, writable=False)
+            if container is None:
+                return None
+            tile_group = self.get_tile_group(container, tile_number, False)
+            if tile_group is None:
+                return None
+            slices = list(tile_group['slices'][:])
+            if slice_number not in slices:
+                return None
+            z = len(slices) - 1 - slices[::-1].index(slice_number)
+            return np.array(tile_group[str(level)][z])
+        except (OSError, KeyError) as e:
+            self.set_error(grid_number, e)
+            return None
+
+    def get_tile_z_column(self, grid_number, tile_number, level=0):
+        """Return the slice numbers and the image stack (z, y, x) of the
+           specified tile. Use level > 0 to read a downsampled version.
+        """
+        try:
+            container = self.open_container(grid_number, writable=False)
+            if container is None:
+                return None, None
+            tile_group = self.get_tile_group(container, tile_number, False)
+            if tile_group is None:
+                return None, None
+            return (np.array(tile_group['slices'][:]),
+                    np.array(tile_group[str(level)][:]))
+        except (OSError, KeyError) as e:
+            self.set_error(grid_number, e)
+            return None, None
+
+    def get_tile_group(self, container, tile_number, create):
+        key = 't' + str(tile_number).zfill(utils.TILE_DIGITS)
+        if key in container:
+            return container[key]
+        if not create:
+            return None
+        tile_group = container.create_group(key)
+        if self.container_format == FORMAT_HDF5:
+            tile_group.create_dataset(
+                'slices', shape=(0,), maxshape=(None,), dtype='i4')
+        else:
+            tile_group.create_dataset(
+                'slices', shape=(0,), chunks=(1024,), dtype='i4')
+            # OME-Zarr multiscales metadata:
+            tile_group.attrs['multiscales'] = [{
+                'version': '0.4',
+                'axes': [{'name': 'z', 'type': 'space'},
+                         {'name': 'y', 'type': 'space'},
+                         {'name': 'x', 'type': 'space'}],
+                'datasets': [
+                    {'path': str(level),
+                     'coordinateTransformations': [{
+                        'type': 'scale',
+                        'scale': [1, 2**level, 2**level]}]}
+                    for level in range(PYRAMID_LEVELS)]}]
+        return tile_group
+
+    def get_level_dataset(self, tile_group, level, img):
+        key = str(level)
+        if key in tile_group:
+            return tile_group[key]
+        height, width = img.shape[0], img.shape[1]
+        if self.container_format == FORMAT_HDF5:
+            return tile_group.create_dataset(
+                key, shape=(0, height, width),
+                maxshape=(None, height, width),
+                chunks=(1, height, width), dtype=img.dtype,
+                compression='gzip', compression_opts=1, shuffle=True)
+        else:
+            # zarr uses Blosc compression by default:
+            return tile_group.create_dataset(
+                key, shape=(0, height, width),
+                chunks=(1, height, width), dtype=img.dtype)
+
+    def resize_z(self, dataset, new_depth):
+        if self.container_format == FORMAT_HDF5:
+            dataset.resize(new_depth, axis=0)
+        else:
+            dataset.resize(new_depth, *dataset.shape[1:])
+
+    def downsample(self, img):
+        """Return a 2x downsampled version of img (2x2 block mean)."""
+        height, width = img.shape[0] // 2 * 2, img.shape[1] // 2 * 2
+        blocks = img[:height, :width].reshape(
+            height // 2, 2, width // 2, 2).astype(np.uint32)
+        return (blocks.sum(axis=(1, 3)) // 4).astype(img.dtype)
@@ -34,6 +34,11 @@ GRID_DIGITS = 4       # up to 9999 grids
 TILE_DIGITS = 4       # up to 9999 tiles per grid
 SLICE_DIGITS = 5      # up to 99999 slices per stack
 
+# Tile previews: level 0 is at least TILE_PREVIEW_WIDTH pixels wide, each
+# further level doubles the resolution
+TILE_PREVIEW_WIDTH = 512
+TILE_PREVIEW_LEVELS = 3
+
 # Regular expressions for checking user input of tiles and overviews
 RE_TILE_LIST = re.compile('^((0|[1-9][0-9]*)[.](0|[1-9][0-9]*))'
                           '([ ]*,[ ]*(0|[1-9][0-9]*)[.](0|[1-9][0-9]*))*$')
@@ -121,9 +126,20 @@ def get_tile_save_path(stack_name, grid_number, tile_number, slice_counter):
             + '_s' + str(slice_counter).zfill(SLICE_DIGITS)
             + '.tif')
 
-def get_tile_preview_save_path(grid_number, tile_number):
+def get_tile_container_path(grid_number, container_format):
+    if container_format == 'zarr':
+        extension = '.ome.zarr'
+    else:
+        extension = '.h5'
+    return ('tiles\\g' + str(grid_number).zfill(GRID_DIGITS) + extension)
+
+def get_tile_preview_save_path(grid_number, tile_number, level=0):
+    if level == 0:
+        suffix = ''
+    else:
+        suffix = '_L' + str(level)
     return ('workspace\\g' + str(grid_number).zfill(GRID_DIGITS)
-            + '_t' + str(tile_number).zfill(TILE_DIGITS) + '.png')
+            + '_t' + str(tile_number).zfill(TILE_DIGITS) + suffix + '.png')
 
 def get_tile_reslice_save_path(grid_number, tile_number):
     return ('workspace\\reslices\\r_g' + str(grid_number).zfill(GRID_DIGITS)
@@ -19,17 +19,23 @@ import os
 import datetime
 import numpy as np
 from scipy import ndimage
-from PIL import Image
 from math import log, sqrt
 from statistics import mean
+from collections import OrderedDict
 
 from PyQt5.uic import loadUi
 from PyQt5.QtWidgets import QWidget, QApplication, QMessageBox, QMenu
 from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont, QIcon, QPen, \
-                        QBrush, QTransform
-from PyQt5.QtCore import Qt, QObject, QRect, QPoint, QSize
+                        QBrush, QTransform, QImage
+from PyQt5.QtCore import Qt, QObject, QRect, QPoint, QSize, QTimer
 
 import utils
+import stub_mosaic
+from image_io import read_image, load_pixmap
+from pixmap_cache import PyramidCache
+from slice_cache import SliceCache
+from spatial_index import GridIndexes
+from monitoring_history import get_histogram, get_mean_stddev
 
 
 class Viewport(QWidget):
@@ -39,10 +45,24 @@ class Viewport(QWidget):
     WINDOW_MARGIN_Y = 40
     VIEWER_WIDTH = 1000
     VIEWER_HEIGHT = 800
+    # Maximum number of pixels kept in the cache for downsampled images:
+    PYRAMID_CACHE_PIXELS = 32 * 10**6
+    # Minimum interval between two redraws in ms:
+    REDRAW_INTERVAL = 40
+    # Number of slice viewer images with saturated pixel overlay to cache:
+    SV_OVERLAY_CACHE_SIZE = 8
+    # Memory limit for decoded slices in the slice viewer:
+    SLICE_CACHE_BYTES = 1024 * 2**20
+    SLICE_LOADER_THREADS = 4
+    # Number of slices loaded in advance in the browsing direction:
+    SV_PREFETCH_SLICES = 5
+    # Cached layers of the mosaic viewer scene, from bottom to top:
+    MV_LAYERS = ['background', 'grids', 'labels', 'foreground']
 
     def __init__(self, config, sem, microtome,
                  ov_manager, grid_manager, coordinate_system,
-                 trigger, queue):
+                 trigger, queue, tile_preview_cache, monitoring_history,
+                 frame_store):
         super(Viewport, self).__init__()
         self.cfg = config
         self.sem = sem
@@ -52,6 +72,9 @@ class Viewport(QWidget):
         self.cs = coordinate_system
         self.trigger = trigger
         self.queue = queue
+        self.tile_preview_cache = tile_preview_cache
+        self.monitoring_history = monitoring_history
+        self.frame_store = frame_store
         # Shared control variables:
         self.acq_in_progress = False
         self.viewport_active = True
@@ -65,6 +88,14 @@ class Viewport(QWidget):
         self.measure_p2 = (None, None)
         self.measure_complete = False
         self.stub_ov_centre = [None, None]
+        # Redraw requests are collected and processed by a timer:
+        self.mv_scene_dirty = False
+        self.mv_overlay_dirty = False
+        self.sv_dirty = False
+        self.redraw_timer = QTimer()
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.setInterval(self.REDRAW_INTERVAL)
+        self.redraw_timer.timeout.connect(self.process_redraw_requests)
 
         self.load_gui()
         # Initialize viewport tabs:
@@ -87,6 +118,7 @@ class Viewport(QWidget):
 
     def deactivate(self):
         self.viewport_active = False
+        self.slice_cache.shut_down()
 
     def restrict_gui(self, b):
         b ^= True
@@ -141,6 +173,30 @@ class Viewport(QWidget):
                 QIcon('..\\img\\measure.png'))
             self.pushButton_measureSlice.setIconSize(QSize(16, 16))
 
+    def mv_request_draw(self, scene=True):
+        """Request a redraw of the viewport. Requests are coalesced and
+           processed at most once per REDRAW_INTERVAL. If scene is False,
+           only the overlay (dragged element, measurement) is redrawn.
+        """
+        if scene:
+            self.mv_scene_dirty = True
+        self.mv_overlay_dirty = True
+        if not self.redraw_timer.isActive():
+            self.redraw_timer.start()
+
+    def sv_request_draw(self):
+        self.sv_dirty = True
+        if not self.redraw_timer.isActive():
+            self.redraw_timer.start()
+
+    def process_redraw_requests(self):
+        if self.mv_scene_dirty:
+            self.mv_draw()
+        elif self.mv_overlay_dirty:
+            self.mv_draw_overlay()
+        if self.sv_dirty:
+            self.sv_draw()
+
     def grab_viewport_screenshot(self, save_path_filename):
         viewport_screenshot = self.grab()
         viewport_screenshot.save(save_path_filename)
@@ -239,6 +295,8 @@ class Viewport(QWidget):
                     self.drag_origin = (px, py)
                     self.stage_pos_backup = self.cs.get_ov_centre_s(
                         self.selected_ov)
+                    # Redraw scene without the selected OV:
+                    self.mv_request_draw()
 
             # Check if alt key is pressed -> Move grid:
             elif ((self.tabWidget.currentIndex() == 0)
@@ -251,6 +309,8 @@ class Viewport(QWidget):
                     # Save coordinates in case user wants to undo:
                     self.stage_pos_backup = self.cs.get_grid_origin_s(
                         self.selected_grid)
+                    # Redraw scene without the selected grid:
+                    self.mv_request_draw()
 
             # Check if ctrl+alt keys are pressed -> Move imported image:
             elif ((self.tabWidget.currentIndex() == 0)
@@ -262,16 +322,13 @@ class Viewport(QWidget):
                     # Save coordinates in case user wants to undo:
                     self.stage_pos_backup = self.cs.get_imported_img_centre_s(
                         self.selected_imported)
+                    # Redraw scene without the selected image:
+                    self.mv_request_draw()
 
             # No key pressed? -> Pan:
             elif (QApplication.keyboardModifiers() == Qt.NoModifier):
                 # Move the viewport's FOV
                 self.fov_drag_active = True
-                # For now, disable showing saturated pixels (too slow)
-                if self.show_saturated_pixels:
-                    self.checkBox_showSaturated.setChecked(False)
-                    self.show_saturated_pixels = False
-                    self.cfg['viewport']['show_saturated_pixels'] = 'False'
                 self.drag_origin = (p.x() - self.WINDOW_MARGIN_X,
                                     p.y() - self.WINDOW_MARGIN_Y)
         # Now right mouse button for context menus and measuring:
@@ -341,31 +398,32 @@ class Viewport(QWidget):
             # Update drag origin
             self.drag_origin = (px, py)
             self.mv_reposition_grid(drag_vector)
-            self.mv_draw()
+            # Only the dragged grid (overlay) has to be redrawn:
+            self.mv_request_draw(scene=False)
         elif self.ov_drag_active:
             self.setCursor(Qt.SizeAllCursor)
             drag_vector = (px - self.drag_origin[0],
                            py - self.drag_origin[1])
             self.drag_origin = (px, py)
             self.mv_reposition_ov(drag_vector)
-            self.mv_draw()
+            self.mv_request_draw(scene=False)
         elif self.imported_img_drag_active:
             self.setCursor(Qt.SizeAllCursor)
             drag_vector = (px - self.drag_origin[0],
                            py - self.drag_origin[1])
             self.drag_origin = (px, py)
             self.mv_reposition_imported_img(drag_vector)
-            self.mv_draw()
+            self.mv_request_draw(scene=False)
         elif self.fov_drag_active:
             self.setCursor(Qt.SizeAllCursor)
             drag_vector = (self.drag_origin[0] - px, self.drag_origin[1] - py)
             self.drag_origin = (px, py)
             if self.tabWidget.currentIndex() == 0:
                 self.mv_shift_fov(drag_vector)
-                self.mv_draw()
+                self.mv_request_draw()
             if self.tabWidget.currentIndex() == 1:
                 self.sv_shift_fov(drag_vector)
-                self.sv_draw()
+                self.sv_request_draw()
         elif ((self.tabWidget.currentIndex() == 0)
             and mouse_pos_within_viewer
             and self.mv_measure_active):
@@ -383,6 +441,10 @@ class Viewport(QWidget):
             self.setCursor(Qt.ArrowCursor)
         if (event.button() == Qt.LeftButton):
             self.fov_drag_active = False
+            if (self.grid_drag_active or self.ov_drag_active
+                or self.imported_img_drag_active):
+                # The dragged element must be drawn into the scene again:
+                self.mv_scene_dirty = True
             if self.grid_drag_active:
                 self.grid_drag_active = False
                 user_reply = QMessageBox.question(
@@ -451,6 +513,12 @@ class Viewport(QWidget):
         self.grid_origin_sx_sy_backup = (None, None)
         # display options:
         self.stub_ov_exists = False
+        # Stub OV pyramid levels (loaded on demand):
+        self.stub_ov_file = None
+        self.stub_ov_levels = {}
+        self.stub_ov_preview_only = False
+        # Incremented whenever a different stub OV image is shown:
+        self.stub_ov_version = 0
         self.show_stub_ov = self.cfg['viewport']['show_stub_ov'] == 'True'
         self.show_imported = self.cfg['viewport']['show_imported'] == 'True'
         self.show_labels = (
@@ -478,10 +546,20 @@ class Viewport(QWidget):
         (self.min_sx, self.max_sx,
             self.min_sy, self.max_sy) = self.cs.get_stage_limits()
 
-        # Canvas:
+        # Canvas and static scene (canvas without overlay):
         self.mv_canvas = QPixmap(self.VIEWER_WIDTH, self.VIEWER_HEIGHT)
+        self.mv_scene = QPixmap(self.VIEWER_WIDTH, self.VIEWER_HEIGHT)
+        # Cached layers of the scene: layer -> [key, pixmap]
+        self.mv_layers = {}
+        for layer in self.MV_LAYERS:
+            self.mv_layers[layer] = [
+                None, QPixmap(self.VIEWER_WIDTH, self.VIEWER_HEIGHT)]
         # QPainter:
         self.mv_qp = QPainter()
+        # Downsampled versions of OVs and imported images:
+        self.mv_pyramid_cache = PyramidCache(self.PYRAMID_CACHE_PIXELS)
+        # Spatial indexes over the tiles of all grids:
+        self.tile_indexes = GridIndexes()
 
         # Load overview files into memory:
         self.mv_load_all_overviews()
@@ -599,12 +677,13 @@ class Viewport(QWidget):
     def mv_toggle_tile_acq_indicator(self, grid_number, tile_number):
         self.tile_indicator_on ^= True
         self.tile_indicator_pos = [grid_number, tile_number]
-        self.mv_draw()
+        # Indicators are part of the overlay:
+        self.mv_request_draw(scene=False)
 
     def mv_toggle_ov_acq_indicator(self, ov_number):
         self.ov_indicator_on ^= True
         self.ov_indicator_pos = ov_number
-        self.mv_draw()
+        self.mv_request_draw(scene=False)
 
     def mv_load_all_overviews(self):
         """Load the images specified in the OV file list into memory """
@@ -613,7 +692,7 @@ class Viewport(QWidget):
         ov_file_list = self.ovm.get_ov_file_list()
         for i in range(self.number_ov):
             if os.path.isfile(ov_file_list[i]):
-                self.ov_img.append(QPixmap(ov_file_list[i]))
+                self.ov_img.append(load_pixmap(ov_file_list[i]))
             else:
                 blank = QPixmap(self.ovm.get_ov_width_p(i),
                                 self.ovm.get_ov_height_p(i))
@@ -630,20 +709,78 @@ class Viewport(QWidget):
     def mv_load_overview(self, ov_number):
         # (Re)load a single OV:
         if ov_number < self.number_ov:
+            # Use the image decoded by the image inspector if available:
+            frame = self.frame_store.get(
+                'OV' + str(ov_number).zfill(utils.OV_DIGITS))
+            if frame is not None:
+                self.ov_img[ov_number] = QPixmap.fromImage(frame.get_qimage())
+                frame.release()
+                return
             ov_file_list = self.ovm.get_ov_file_list()
             if os.path.isfile(ov_file_list[ov_number]):
-                self.ov_img[ov_number] = QPixmap(ov_file_list[ov_number])
+                self.ov_img[ov_number] = load_pixmap(ov_file_list[ov_number])
 
     def mv_load_stub_overview(self):
-        """Load the most recent stub OV image into memory"""
-        # Load stub OV image:
+        """Prepare the most recent stub OV for display. The pyramid levels
+           are loaded on demand in mv_get_stub_ov_level().
+        """
         stub_ov_file = self.ovm.get_stub_ov_file()
+        self.stub_ov_levels = {}
+        self.stub_ov_version += 1
+        self.stub_ov_preview_only = False
         if os.path.isfile(stub_ov_file):
-            self.stub_ov_img = QPixmap(stub_ov_file)
+            self.stub_ov_file = stub_ov_file
             self.stub_ov_exists = True
         else:
             self.stub_ov_exists = False
 
+    def mv_show_stub_ov_preview(self, stub_ov_file):
+        """Show the low-resolution preview of a stub OV that is currently
+           being acquired.
+        """
+        self.stub_ov_file = stub_ov_file
+        self.stub_ov_levels = {}
+        self.stub_ov_version += 1
+        self.stub_ov_preview_only = True
+        self.stub_ov_exists = True
+        self.show_stub_ov = True
+        self.checkBox_showStubOV.setChecked(True)
+        self.mv_draw()
+
+    def mv_get_stub_ov_level(self, level):
+        """Return the specified pyramid level of the stub OV as a QPixmap,
+           or None if that level is not available.
+        """
+        if level not in self.stub_ov_levels:
+            file_name = stub_mosaic.get_level_file_name(
+                self.stub_ov_file, level)
+            if not os.path.isfile(file_name):
+                return None
+            self.stub_ov_levels[level] = load_pixmap(file_name)
+        return self.stub_ov_levels[level]
+
+    def mv_crop_stub_ov_canvas(self, crop_area):
+        """Read only the area crop_area from the full-resolution canvas of
+           the stub OV. Return None if the canvas is not available.
+        """
+        canvas_file = stub_mosaic.get_canvas_file_name(
+            self.cfg['acq']['base_dir'], self.stub_ov_file)
+        if not os.path.isfile(canvas_file):
+            return None
+        try:
+            canvas = np.load(canvas_file, mmap_mode='r')
+        except:
+            return None
+        x, y = int(crop_area.x()), int(crop_area.y())
+        w, h = int(crop_area.width()), int(crop_area.height())
+        crop = np.ascontiguousarray(canvas[y:y+h, x:x+w])
+        del canvas
+        height, width = crop.shape
+        q_image = QImage(crop.data, width, height, width,
+                         QImage.Format_Grayscale8)
+        # copy() is needed because crop is released after return:
+        return QPixmap.fromImage(q_image.copy())
+
     def mv_load_all_imported_images(self):
         """Load imported images into memory"""
         self.imported_img = []
@@ -653,7 +790,7 @@ class Viewport(QWidget):
         for i in range(self.number_imported):
             if os.path.isfile(imported_file_list[i]):
                 angle = self.ovm.get_imported_img_rotation(i)
-                img = QPixmap(imported_file_list[i])
+                img = load_pixmap(imported_file_list[i])
                 if angle != 0:
                     trans = QTransform()
                     trans.rotate(angle)
@@ -666,7 +803,7 @@ class Viewport(QWidget):
         self.number_imported = self.ovm.get_number_imported()
         new_image_number = self.number_imported - 1
         file_name = self.ovm.get_imported_img_file(new_image_number)
-        img = QPixmap(file_name)
+        img = load_pixmap(file_name)
         angle = self.ovm.get_imported_img_rotation(new_image_number)
         if angle != 0:
             trans = QTransform()
@@ -690,7 +827,7 @@ class Viewport(QWidget):
         file_name = self.ovm.get_imported_img_file(img_number)
         if os.path.isfile(file_name):
             angle = self.ovm.get_imported_img_rotation(img_number)
-            img = QPixmap(file_name)
+            img = load_pixmap(file_name)
             if angle != 0:
                 trans = QTransform()
                 trans.rotate(angle)
@@ -799,45 +936,175 @@ class Viewport(QWidget):
 
     def mv_draw(self):
         """Draw all elements on mosaic viewer canvas"""
-        show_debris_area = self.cfg['debris']['show_detection_area'] == 'True'
+        self.mv_draw_scene()
+        self.mv_draw_overlay()
+
+    def mv_get_grid_display_options(self):
+        """Return show_grid, show_previews, with_gaps for the current
+           tile preview mode.
+        """
+        if self.mv_tile_preview_mode == 1:
+            return True, True, False
+        if self.mv_tile_preview_mode == 2:
+            return False, True, False
+        if self.mv_tile_preview_mode == 3:
+            return False, True, True
+        return True, False, False
+
+    def mv_update_layer(self, layer, key, draw_function):
+        """Redraw layer with draw_function if key (which describes all inputs
+           of that layer) has changed since the layer was last drawn.
+        """
+        if self.mv_layers[layer][0] == key:
+            return
+        pixmap = self.mv_layers[layer][1]
+        pixmap.fill(Qt.transparent)
+        self.mv_qp.begin(pixmap)
+        draw_function()
+        self.mv_qp.end()
+        self.mv_layers[layer][0] = key
+
+    def mv_draw_scene(self):
+        """Compose the static elements (layers) into the scene pixmap. Each
+           layer is cached and only redrawn when its inputs have changed.
+           An element that is currently being dragged is omitted; it is drawn
+           as part of the overlay.
+        """
+        self.mv_scene_dirty = False
+        # The stage calibration determines where stage positions (grids,
+        # OVs, stage limits) are drawn:
+        calibration = (self.cs.scale_x, self.cs.scale_y,
+                       self.cs.A, self.cs.B, self.cs.C, self.cs.D)
+        view_key = (self.cs.get_mv_scale(), tuple(self.cs.get_mv_centre_d()),
+                    calibration)
+        # Version numbers of the config sections (the values themselves are
+        # not read, so that deferred values are not converted to strings):
+        grids_config = self.cfg.get_version('grids')
+        ov_config = self.cfg.get_version('overviews')
+        dragged_grid = self.selected_grid if self.grid_drag_active else None
+        dragged_ov = self.selected_ov if self.ov_drag_active else None
+        dragged_imported = (
+            self.selected_imported if self.imported_img_drag_active else None)
+        # Stub OV and OVs:
+        self.mv_update_layer(
+            'background',
+            (view_key, ov_config, self.cfg.get_version('debris'),
+             self.show_stub_ov, self.stub_ov_exists, self.stub_ov_version,
+             tuple(img.cacheKey() for img in self.ov_img),
+             self.mv_current_ov, self.show_labels, dragged_ov),
+            self.mv_draw_background_layer)
+        # Tile previews and tile rectangles:
+        show_grid, show_previews, with_gaps = (
+            self.mv_get_grid_display_options())
+        if show_previews:
+            previews_key = (self.cfg['acq']['base_dir'],
+                            self.tile_preview_cache.get_generation(),
+                            self.fov_drag_active)
+        else:
+            previews_key = None
+        self.mv_update_layer(
+            'grids',
+            (view_key, grids_config, self.mv_current_grid,
+             self.mv_tile_preview_mode, previews_key, dragged_grid),
+            self.mv_draw_grid_layer)
+        # Tile numbers and grid labels:
+        self.mv_update_layer(
+            'labels',
+            (view_key, grids_config, self.gm.get_wd_revision(),
+             self.mv_current_grid, with_gaps, self.show_labels,
+             dragged_grid),
+            self.mv_draw_label_layer)
+        # Imported images, stage boundaries and axes:
+        self.mv_update_layer(
+            'foreground',
+            (view_key, self.show_imported,
+             ov_config,
+             tuple(img.cacheKey() for img in self.imported_img),
+             tuple(self.imported_img_opacity),
+             (self.min_sx, self.max_sx, self.min_sy, self.max_sy),
+             self.show_axes, dragged_imported),
+            self.mv_draw_foreground_layer)
         # Start with empty black canvas, size fixed (1000 x 800):
-        self.mv_canvas.fill(Qt.black)
-        # Begin painting on canvas:
-        self.mv_qp.begin(self.mv_canvas)
+        self.mv_scene.fill(Qt.black)
+        self.mv_qp.begin(self.mv_scene)
+        for layer in self.MV_LAYERS:
+            self.mv_qp.drawPixmap(0, 0, self.mv_layers[layer][1])
+        self.mv_qp.end()
+
+    def mv_draw_background_layer(self):
+        show_debris_area = self.cfg['debris']['show_detection_area'] == 'True'
         # First, show stub OV if option selected:
         if self.show_stub_ov and self.stub_ov_exists:
             self.mv_place_stub_overview()
         # Place OV overviews over stub OV:
         if self.mv_current_ov == -1:
             for i in range(self.number_ov):
-                self.mv_place_overview(i, show_debris_area)
-        if self.mv_current_ov >= 0:
+                if not (self.ov_drag_active and i == self.selected_ov):
+                    self.mv_place_overview(i, show_debris_area)
+        if self.mv_current_ov >= 0 and not self.ov_drag_active:
             self.mv_place_overview(self.mv_current_ov, show_debris_area)
-        # Tile preview mode:
-        if self.mv_tile_preview_mode == 0:
-            show_grid, show_previews, with_gaps = True, False, False
-        if self.mv_tile_preview_mode == 1:
-            show_grid, show_previews, with_gaps = True, True, False
-        if self.mv_tile_preview_mode == 2:
-            show_grid, show_previews, with_gaps = False, True, False
-        if self.mv_tile_preview_mode == 3:
-            show_grid, show_previews, with_gaps = False, True, True
-        if self.mv_current_grid == -1:
-            for i in range(self.number_grids):
-                self.mv_place_grid(i, show_grid,
-                                show_previews, with_gaps)
-        if self.mv_current_grid >= 0:
-            self.mv_place_grid(self.mv_current_grid, show_grid,
-                            show_previews, with_gaps)
-        # Finally, show imported images:
+
+    def mv_draw_grid_layer(self):
+        self.tile_indexes.remove_grids(self.number_grids)
+        show_grid, show_previews, with_gaps = (
+            self.mv_get_grid_display_options())
+        for i in self.mv_get_displayed_grids():
+            self.mv_place_grid(i, show_grid, show_previews, with_gaps)
+
+    def mv_draw_label_layer(self):
+        if self.show_labels:
+            with_gaps = self.mv_get_grid_display_options()[2]
+            for i in self.mv_get_displayed_grids():
+                self.mv_place_grid_labels(i, with_gaps)
+
+    def mv_draw_foreground_layer(self):
+        # Imported images:
         if self.show_imported and (self.number_imported > 0):
             for i in range(self.number_imported):
-                self.mv_place_imported_img(i)
+                if not (self.imported_img_drag_active
+                        and i == self.selected_imported):
+                    self.mv_place_imported_img(i)
         # Show stage boundaries (motor limits)
         self.mv_draw_stage_boundaries()
         # Show axes:
         if self.show_axes:
             self.mv_draw_stage_axes()
+
+    def mv_get_displayed_grids(self):
+        """Return the grids shown in the scene (without a dragged grid)."""
+        if self.mv_current_grid == -1:
+            grids = range(self.number_grids)
+        elif self.mv_current_grid >= 0:
+            grids = [self.mv_current_grid]
+        else:
+            grids = []
+        if self.grid_drag_active:
+            grids = [i for i in grids if i != self.selected_grid]
+        return grids
+
+    def mv_draw_overlay(self):
+        """Draw the element currently being dragged, the acquisition
+           indicators, the measurement and the simulation mode indicator on
+           top of the scene, and show the result in the viewport.
+        """
+        self.mv_overlay_dirty = False
+        self.mv_canvas = self.mv_scene.copy()
+        self.mv_qp.begin(self.mv_canvas)
+        if self.grid_drag_active:
+            show_grid, show_previews, with_gaps = (
+                self.mv_get_grid_display_options())
+            self.mv_place_grid(self.selected_grid, show_grid,
+                               show_previews, with_gaps)
+            if self.show_labels:
+                self.mv_place_grid_labels(self.selected_grid, with_gaps)
+        if self.ov_drag_active:
+            self.mv_place_overview(
+                self.selected_ov,
+                self.cfg['debris']['show_detection_area'] == 'True')
+        if self.imported_img_drag_active and self.show_imported:
+            self.mv_place_imported_img(self.selected_imported)
+        # Acquisition indicators:
+        self.mv_draw_acq_indicators()
         if self.mv_measure_active:
             self.mv_draw_measure_labels()
 
@@ -859,6 +1126,40 @@ class Viewport(QWidget):
             + ' µm × '
             + '{0:.1f}'.format(self.VIEWER_HEIGHT / mv_scale) + ' µm')
 
+    def mv_draw_acq_indicators(self):
+        """Highlight the tile or OV that is currently being acquired."""
+        indicator_colour = QColor(128, 00, 128, 80)
+        if self.tile_indicator_on:
+            grid_number, tile_number = self.tile_indicator_pos
+            show_grid = self.mv_get_grid_display_options()[0]
+            if (show_grid and grid_number is not None
+                    and grid_number < self.number_grids
+                    and self.mv_current_grid in [-1, grid_number]):
+                vx, vy, w, h = self.mv_get_tile_rect_v(
+                    grid_number, tile_number,
+                    self.mv_get_grid_display_options()[2])
+                rgb = self.gm.get_display_colour(grid_number)
+                self.mv_qp.setPen(
+                    QPen(QColor(rgb[0], rgb[1], rgb[2], 255), 1, Qt.SolidLine))
+                self.mv_qp.setBrush(indicator_colour)
+                self.mv_qp.drawRect(vx, vy, w, h)
+        if (self.ov_indicator_on and self.ov_indicator_pos is not None
+                and self.ov_indicator_pos < self.number_ov
+                and self.mv_current_ov in [-1, self.ov_indicator_pos]):
+            ov_number = self.ov_indicator_pos
+            resize_ratio = (self.ovm.get_ov_pixel_size(ov_number)
+                            * self.cs.get_mv_scale() / 1000)
+            dx, dy = self.cs.get_ov_centre_d(ov_number)
+            dx -= self.ovm.get_ov_width_d(ov_number)/2
+            dy -= self.ovm.get_ov_height_d(ov_number)/2
+            vx, vy = self.cs.convert_to_v((dx, dy))
+            self.mv_qp.setPen(QPen(QColor(0, 0, 255), 2, Qt.SolidLine))
+            self.mv_qp.setBrush(indicator_colour)
+            self.mv_qp.drawRect(
+                vx, vy,
+                self.ovm.get_ov_width_p(ov_number) * resize_ratio,
+                self.ovm.get_ov_height_p(ov_number) * resize_ratio)
+
     def mv_calculate_visible_area(self, vx, vy, w_px, h_px, resize_ratio):
         crop_area = QRect(0, 0, w_px, h_px)
         vx_cropped, vy_cropped = vx, vy
@@ -907,14 +1208,44 @@ class Viewport(QWidget):
         dy -= 768/2 * self.ovm.STUB_OV_PIXEL_SIZE / 1000
         vx, vy = self.cs.convert_to_v((dx, dy))
         width_px, height_px = self.ovm.get_stub_ov_full_size()
+        # Select the coarsest pyramid level that still provides at least
+        # the resolution of the viewport:
+        number_levels = stub_mosaic.get_number_levels(width_px, height_px)
+        if self.stub_ov_preview_only:
+            level = number_levels - 1
+        else:
+            level = 0
+            while (level < number_levels - 1
+                   and resize_ratio * 2**(level + 1) <= 1):
+                level += 1
+            if level > 0 and self.mv_get_stub_ov_level(level) is None:
+                # No pyramid on disk (older stub OVs), use cached levels
+                # generated from the full image:
+                level = -1
+        level_img = None
+        if level == -1:
+            level_img, level_ratio = self.mv_pyramid_cache.get_scaled_source(
+                self.mv_get_stub_ov_level(0), resize_ratio)
+            level_width, level_height = level_img.width(), level_img.height()
+        else:
+            level_ratio = resize_ratio * 2**level
+            level_width, level_height = width_px >> level, height_px >> level
         # Crop and resize stub OV before placing it into viewport:
         (visible, crop_area, vx_rel, vy_rel) = self.mv_calculate_visible_area(
-             vx, vy, width_px, height_px, resize_ratio)
+             vx, vy, level_width, level_height, level_ratio)
         if visible:
-            cropped_img = self.stub_ov_img.copy(crop_area)
+            cropped_img = None
+            if level == 0:
+                cropped_img = self.mv_crop_stub_ov_canvas(crop_area)
+            if cropped_img is None:
+                if level_img is None:
+                    level_img = self.mv_get_stub_ov_level(level)
+                if level_img is None:
+                    return
+                cropped_img = level_img.copy(crop_area)
             v_width = cropped_img.size().width()
             cropped_resized_img = cropped_img.scaledToWidth(
-                v_width * resize_ratio)
+                v_width * level_ratio)
             # Draw stub OV:
             self.mv_qp.drawPixmap(vx_rel, vy_rel, cropped_resized_img)
             # Draw grey rectangle around stub OV:
@@ -938,14 +1269,17 @@ class Viewport(QWidget):
         dx -= (width * pixel_size / 1000)/2
         dy -= (height * pixel_size / 1000)/2
         vx, vy = self.cs.convert_to_v((dx, dy))
+        # Use downsampled image if zoomed out:
+        level_img, level_ratio = self.mv_pyramid_cache.get_scaled_source(
+            self.imported_img[img_number], resize_ratio)
         # Crop and resize image before placing it into viewport:
         visible, crop_area, vx_rel, vy_rel = self.mv_calculate_visible_area(
-            vx, vy, width, height, resize_ratio)
+            vx, vy, level_img.width(), level_img.height(), level_ratio)
         if visible:
-            cropped_img = self.imported_img[img_number].copy(crop_area)
+            cropped_img = level_img.copy(crop_area)
             v_width = cropped_img.size().width()
             cropped_resized_img = cropped_img.scaledToWidth(
-                v_width * resize_ratio)
+                v_width * level_ratio)
             self.mv_qp.setOpacity(self.imported_img_opacity[img_number])
             self.mv_qp.drawPixmap(vx_rel, vy_rel, cropped_resized_img)
             self.mv_qp.setOpacity(1)
@@ -968,23 +1302,22 @@ class Viewport(QWidget):
         height_px = self.ovm.get_ov_height_p(ov_number)
         # Convert to viewport window coordinates:
         vx, vy = self.cs.convert_to_v((dx, dy))
+        # Use downsampled OV if zoomed out:
+        level_img, level_ratio = self.mv_pyramid_cache.get_scaled_source(
+            self.ov_img[ov_number], resize_ratio)
         # Crop and resize OV before placing it into viewport:
         visible, crop_area, vx_rel, vy_rel = self.mv_calculate_visible_area(
-            vx, vy, width_px, height_px, resize_ratio)
+            vx, vy, level_img.width(), level_img.height(), level_ratio)
         if visible:
-            cropped_img = self.ov_img[ov_number].copy(crop_area)
+            cropped_img = level_img.copy(crop_area)
             v_width = cropped_img.size().width()
             cropped_resized_img = cropped_img.scaledToWidth(
-                v_width * resize_ratio)
+                v_width * level_ratio)
             # Draw OV:
             self.mv_qp.drawPixmap(vx_rel, vy_rel, cropped_resized_img)
             # draw blue rectangle around OV:
             self.mv_qp.setPen(QPen(QColor(0, 0, 255), 2, Qt.SolidLine))
-            if (self.ov_indicator_pos == ov_number) and self.ov_indicator_on:
-                indicator_colour = QColor(128, 00, 128, 80)
-                self.mv_qp.setBrush(indicator_colour)
-            else:
-                self.mv_qp.setBrush(QColor(0, 0, 255, 0))
+            self.mv_qp.setBrush(QColor(0, 0, 255, 0))
 
             self.mv_qp.drawRect(vx, vy,
                              width_px * resize_ratio,
@@ -1027,37 +1360,101 @@ class Viewport(QWidget):
                                     Qt.AlignVCenter | Qt.AlignHCenter,
                                     'OV %d' % ov_number)
 
-    def mv_place_grid(self, grid_number, show_grid=True,
-                      show_previews=False, with_gaps=False):
-        mv_scale = self.cs.get_mv_scale()
-        # Calculate origin of the tile map with respect to mosaic viewer
+    def mv_get_grid_origin_v(self, grid_number):
+        """Return the viewport coordinates of the upper left corner of the
+           first tile of the specified grid.
+        """
         dx, dy = self.cs.get_grid_origin_d(grid_number)
         dx -= self.gm.get_tile_width_d(grid_number)/2
         dy -= self.gm.get_tile_height_d(grid_number)/2
-        origin_vx, origin_vy = self.cs.convert_to_v((dx, dy))
-        width_px, height_px = self.gm.get_grid_size_px_py(grid_number)
-
-        viewport_pixel_size = 1000 / mv_scale
-        grid_pixel_size = self.gm.get_pixel_size(grid_number)
-        resize_ratio = grid_pixel_size / viewport_pixel_size
+        return self.cs.convert_to_v((dx, dy))
 
-        visible = self.mv_element_is_visible(
+    def mv_get_tile_rect_v(self, grid_number, tile_number, with_gaps=False):
+        """Return the position and size of a tile in the viewport."""
+        mv_scale = self.cs.get_mv_scale()
+        origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+        if with_gaps:
+            tile_map = self.gm.get_gapped_grid_map(grid_number)
+        else:
+            tile_map = self.gm.get_grid_map_d(grid_number)
+        return (origin_vx + tile_map[tile_number][0] * mv_scale,
+                origin_vy + tile_map[tile_number][1] * mv_scale,
+                self.gm.get_tile_width_d(grid_number) * mv_scale,
+                self.gm.get_tile_height_d(grid_number) * mv_scale)
+
+    def mv_get_tile_index(self, grid_number, with_gaps=False):
+        """Return the spatial index over the tiles of the specified grid.
+           The index is rebuilt only if the grid layout has changed.
+        """
+        signature = (tuple(self.gm.get_grid_size(grid_number)),
+                     tuple(self.gm.get_tile_size_px_py(grid_number)),
+                     self.gm.get_pixel_size(grid_number),
+                     self.gm.get_overlap(grid_number),
+                     self.gm.get_row_shift(grid_number))
+        return self.tile_indexes.get_index(
+            (grid_number, with_gaps), signature,
+            lambda: self.mv_get_tile_boxes(grid_number, with_gaps))
+
+    def mv_get_tile_boxes(self, grid_number, with_gaps):
+        """Return the bounding boxes of all tiles of the specified grid
+           relative to the upper left corner of the grid (unit: µm).
+        """
+        width_d = self.gm.get_tile_width_d(grid_number)
+        height_d = self.gm.get_tile_height_d(grid_number)
+        number_tiles = self.gm.get_number_tiles(grid_number)
+        if with_gaps:
+            tile_map = self.gm.get_gapped_grid_map(grid_number)
+            return [(tile_map[tile][0], tile_map[tile][1],
+                     tile_map[tile][0] + width_d, tile_map[tile][1] + height_d)
+                    for tile in range(number_tiles)]
+        dx, dy = self.cs.get_grid_origin_d(grid_number)
+        dx -= width_d/2
+        dy -= height_d/2
+        boxes = []
+        for tile in range(number_tiles):
+            x0, y0, x1, y1 = self.gm.get_tile_bounding_box(grid_number, tile)
+            boxes.append((x0 - dx, y0 - dy, x1 - dx, y1 - dy))
+        return boxes
+
+    def mv_get_visible_tiles(self, grid_number, with_gaps=False):
+        """Return the tiles of the specified grid that are (at least
+           partially) visible in the viewport.
+        """
+        mv_scale = self.cs.get_mv_scale()
+        origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+        return self.mv_get_tile_index(grid_number, with_gaps).query_rect(
+            -origin_vx / mv_scale, -origin_vy / mv_scale,
+            (self.VIEWER_WIDTH - origin_vx) / mv_scale,
+            (self.VIEWER_HEIGHT - origin_vy) / mv_scale)
+
+    def mv_grid_is_visible(self, grid_number):
+        origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+        width_px, height_px = self.gm.get_grid_size_px_py(grid_number)
+        resize_ratio = (self.gm.get_pixel_size(grid_number)
+                        * self.cs.get_mv_scale() / 1000)
+        return self.mv_element_is_visible(
             origin_vx, origin_vy, width_px, height_px, resize_ratio)
 
-        if visible:
+    def mv_place_grid(self, grid_number, show_grid=True,
+                      show_previews=False, with_gaps=False):
+        """Draw tile previews and tile rectangles of the specified grid.
+           Labels are drawn separately in mv_place_grid_labels().
+        """
+        mv_scale = self.cs.get_mv_scale()
+        # Calculate origin of the tile map with respect to mosaic viewer
+        origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+
+        if self.mv_grid_is_visible(grid_number):
             if with_gaps:
                 tile_map = self.gm.get_gapped_grid_map(grid_number)
             else:
                 tile_map = self.gm.get_grid_map_d(grid_number)
             # active tiles in current grid:
-            active_tiles = self.gm.get_active_tiles(grid_number)
+            active_tiles = set(self.gm.get_active_tiles(grid_number))
+            visible_tiles = self.mv_get_visible_tiles(grid_number, with_gaps)
             tile_width_v = self.gm.get_tile_width_d(grid_number) * mv_scale
             tile_height_v = self.gm.get_tile_height_d(grid_number) * mv_scale
             base_dir = self.cfg['acq']['base_dir']
-            font_size1 = int(tile_width_v/5)
-            font_size1 = utils.fit_in_range(font_size1, 2, 120)
-            font_size2 = int(tile_width_v/11)
-            font_size2 = utils.fit_in_range(font_size2, 1, 40)
 
             if (show_previews
                     and not self.fov_drag_active
@@ -1065,105 +1462,113 @@ class Viewport(QWidget):
                     and self.cs.get_mv_scale() > 2):
                 # Previews are disabled when FOV or grid is being dragged or
                 # when sufficiently zoomed out.
-                width_px = self.gm.get_tile_width_p(grid_number)
-                height_px = self.gm.get_tile_height_p(grid_number)
-
-                for tile in active_tiles:
-                    vx = origin_vx + tile_map[tile][0] * mv_scale
-                    vy = origin_vy + tile_map[tile][1] * mv_scale
-                    tile_visible = self.mv_element_is_visible(
-                        vx, vy, width_px, height_px, resize_ratio)
-                    if tile_visible:
-                        # load current tile preview:
-                        tile_preview_filename = (
-                            base_dir + '\\'
-                            + utils.get_tile_preview_save_path(grid_number, tile))
-                        if os.path.exists(tile_preview_filename):
-                            tile_img = QPixmap(tile_preview_filename)
-                            # Scale image from 512px to current tile width:
-                            tile_img = tile_img.scaledToWidth(tile_width_v)
-                            # Draw:
+                for tile in visible_tiles:
+                    if tile in active_tiles:
+                        vx = origin_vx + tile_map[tile][0] * mv_scale
+                        vy = origin_vy + tile_map[tile][1] * mv_scale
+                        # Get current tile preview (from cache), scaled
+                        # from the closest preview level to the current
+                        # tile width:
+                        tile_img = self.tile_preview_cache.get_preview(
+                            base_dir, grid_number, tile, tile_width_v)
+                        if tile_img is not None:
                             self.mv_qp.drawPixmap(vx, vy, tile_img)
 
-            # Display grid lines
-            size = self.gm.get_grid_size(grid_number)
-            rows, cols = size[0], size[1]
-            # Load grid colour:
-            rgb = self.gm.get_display_colour(grid_number)
-            grid_colour = QColor(rgb[0], rgb[1], rgb[2], 255)
-            indicator_colour = QColor(128, 00, 128, 80)
-            grid_pen = QPen(grid_colour, 1, Qt.SolidLine)
-            grid_brush_active_tile = QBrush(QColor(rgb[0], rgb[1], rgb[2], 40),
-                                            Qt.SolidPattern)
-            grid_brush_transparent = QBrush(QColor(255, 255, 255, 0),
-                                            Qt.SolidPattern)
-            font = QFont()
-            for tile in range(0, rows * cols):
-                self.mv_qp.setPen(grid_pen)
-                if tile in active_tiles:
-                    self.mv_qp.setBrush(grid_brush_active_tile)
-                else:
-                    self.mv_qp.setBrush(grid_brush_transparent)
-                if ((self.tile_indicator_pos == [grid_number, tile])
-                    and self.tile_indicator_on):
-                    self.mv_qp.setBrush(indicator_colour)
-                # tile rectangles
-                if show_grid:
-                    self.mv_qp.drawRect(origin_vx + tile_map[tile][0] * mv_scale,
-                        origin_vy + tile_map[tile][1] * mv_scale,
-                        tile_width_v, tile_height_v)
-                if self.show_labels:
+            if show_grid:
+                # Display grid lines
+                # Load grid colour:
+                rgb = self.gm.get_display_colour(grid_number)
+                grid_colour = QColor(rgb[0], rgb[1], rgb[2], 255)
+                self.mv_qp.setPen(QPen(grid_colour, 1, Qt.SolidLine))
+                grid_brush_active_tile = QBrush(
+                    QColor(rgb[0], rgb[1], rgb[2], 40), Qt.SolidPattern)
+                grid_brush_transparent = QBrush(QColor(255, 255, 255, 0),
+                                                Qt.SolidPattern)
+                for tile in visible_tiles:
                     if tile in active_tiles:
-                        self.mv_qp.setPen(QColor(255, 255, 255))
-                        font.setBold(True)
+                        self.mv_qp.setBrush(grid_brush_active_tile)
                     else:
-                        self.mv_qp.setPen(QColor(rgb[0], rgb[1], rgb[2]))
-                        font.setBold(False)
-                    pos_x = (origin_vx + tile_map[tile][0] * mv_scale
-                            + tile_width_v/2)
-                    pos_y = (origin_vy + tile_map[tile][1] * mv_scale
-                            + tile_height_v/2)
-                    position_rect = QRect(pos_x - tile_width_v,
-                                          pos_y - tile_width_v,
-                                          2 * tile_width_v, 2 * tile_width_v)
-
-                    font.setPixelSize(int(font_size1))
-                    self.mv_qp.setFont(font)
-                    self.mv_qp.drawText(position_rect,
-                                     Qt.AlignVCenter | Qt.AlignHCenter,
-                                     str(tile))
-                    if self.gm.is_adaptive_focus_active(grid_number):
-                        font = QFont()
-                        font.setPixelSize(int(font_size2))
-                        self.mv_qp.setFont(font)
-                        position_rect = QRect(pos_x - tile_width_v,
-                                              pos_y - tile_width_v
-                                              + tile_height_v/4,
-                                              2 * tile_width_v, 2 * tile_width_v)
-                        self.mv_qp.drawText(position_rect,
-                                            Qt.AlignVCenter | Qt.AlignHCenter,
-                                            'WD: {0:.6f}'.format(
-                                            self.gm.get_tile_wd(0, tile) * 1000))
-            if self.show_labels:
-                fontsize = int(self.cs.get_mv_scale() * 8)
-                if fontsize < 12:
-                    fontsize = 12
+                        self.mv_qp.setBrush(grid_brush_transparent)
+                    # tile rectangles
+                    self.mv_qp.drawRect(
+                        origin_vx + tile_map[tile][0] * mv_scale,
+                        origin_vy + tile_map[tile][1] * mv_scale,
+                        tile_width_v, tile_height_v)
 
-                font.setPixelSize(fontsize)
+    def mv_place_grid_labels(self, grid_number, with_gaps=False):
+        """Draw tile numbers (and working distances if adaptive focus is
+           active) and the label of the specified grid.
+        """
+        if not self.mv_grid_is_visible(grid_number):
+            return
+        mv_scale = self.cs.get_mv_scale()
+        origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+        if with_gaps:
+            tile_map = self.gm.get_gapped_grid_map(grid_number)
+        else:
+            tile_map = self.gm.get_grid_map_d(grid_number)
+        active_tiles = set(self.gm.get_active_tiles(grid_number))
+        tile_width_v = self.gm.get_tile_width_d(grid_number) * mv_scale
+        tile_height_v = self.gm.get_tile_height_d(grid_number) * mv_scale
+        font_size1 = int(tile_width_v/5)
+        font_size1 = utils.fit_in_range(font_size1, 2, 120)
+        font_size2 = int(tile_width_v/11)
+        font_size2 = utils.fit_in_range(font_size2, 1, 40)
+        rgb = self.gm.get_display_colour(grid_number)
+        grid_colour = QColor(rgb[0], rgb[1], rgb[2], 255)
+        font = QFont()
+        for tile in self.mv_get_visible_tiles(grid_number, with_gaps):
+            if tile in active_tiles:
+                self.mv_qp.setPen(QColor(255, 255, 255))
+                font.setBold(True)
+            else:
+                self.mv_qp.setPen(QColor(rgb[0], rgb[1], rgb[2]))
+                font.setBold(False)
+            pos_x = (origin_vx + tile_map[tile][0] * mv_scale
+                    + tile_width_v/2)
+            pos_y = (origin_vy + tile_map[tile][1] * mv_scale
+                    + tile_height_v/2)
+            position_rect = QRect(pos_x - tile_width_v,
+                                  pos_y - tile_width_v,
+                                  2 * tile_width_v, 2 * tile_width_v)
+
+            font.setPixelSize(int(font_size1))
+            self.mv_qp.setFont(font)
+            self.mv_qp.drawText(position_rect,
+                             Qt.AlignVCenter | Qt.AlignHCenter,
+                             str(tile))
+            if self.gm.is_adaptive_focus_active(grid_number):
+                font = QFont()
+                font.setPixelSize(int(font_size2))
                 self.mv_qp.setFont(font)
-                self.mv_qp.setPen(grid_colour)
-                self.mv_qp.setBrush(grid_colour)
-                grid_label_rect = QRect(origin_vx, origin_vy - int(4/3 * fontsize),
-                                        int(5.3 * fontsize), int(4/3 * fontsize))
-                self.mv_qp.drawRect(grid_label_rect)
-                if self.gm.get_display_colour_index(grid_number) in [1, 2, 3]:
-                    self.mv_qp.setPen(QColor(0, 0, 0))
-                else:
-                    self.mv_qp.setPen(QColor(255, 255, 255))
-
-                self.mv_qp.drawText(grid_label_rect,
+                position_rect = QRect(pos_x - tile_width_v,
+                                      pos_y - tile_width_v
+                                      + tile_height_v/4,
+                                      2 * tile_width_v, 2 * tile_width_v)
+                self.mv_qp.drawText(position_rect,
                                     Qt.AlignVCenter | Qt.AlignHCenter,
-                                    'GRID %d' % grid_number)
+                                    'WD: {0:.6f}'.format(
+                                    self.gm.get_tile_wd(0, tile) * 1000))
+
+        fontsize = int(self.cs.get_mv_scale() * 8)
+        if fontsize < 12:
+            fontsize = 12
+
+        font.setPixelSize(fontsize)
+        self.mv_qp.setFont(font)
+        self.mv_qp.setPen(grid_colour)
+        self.mv_qp.setBrush(grid_colour)
+        grid_label_rect = QRect(origin_vx, origin_vy - int(4/3 * fontsize),
+                                int(5.3 * fontsize), int(4/3 * fontsize))
+        self.mv_qp.drawRect(grid_label_rect)
+        if self.gm.get_display_colour_index(grid_number) in [1, 2, 3]:
+            self.mv_qp.setPen(QColor(0, 0, 0))
+        else:
+            self.mv_qp.setPen(QColor(255, 255, 255))
+
+        self.mv_qp.drawText(grid_label_rect,
+                            Qt.AlignVCenter | Qt.AlignHCenter,
+                            'GRID %d' % grid_number)
 
     def mv_draw_stage_boundaries(self):
         """Show bounding box around area accessible to the stage motors:
@@ -1267,19 +1672,19 @@ class Viewport(QWidget):
                                mv_centre_dy + dy / mv_scale)
             self.measure_complete = False
             self.measure_p2 = (None, None)
-            self.mv_draw()
+            self.mv_draw_overlay()
         elif self.measure_p2 == (None, None):
             self.measure_p2 = (mv_centre_dx + dx / mv_scale,
                                mv_centre_dy + dy / mv_scale)
             self.measure_complete = True
-            self.mv_draw()
+            self.mv_draw_overlay()
 
     def mv_adjust_scale(self):
         # Recalculate scaling factor:
         new_mv_scale = 0.2 * (1.05)**self.horizontalSlider_MV.value()
         self.cs.set_mv_scale(new_mv_scale)
         # Redraw viewport:
-        self.mv_draw()
+        self.mv_request_draw()
 
     def mv_mouse_zoom(self, px, py, factor):
         # Recalculate scaling factor:
@@ -1304,7 +1709,7 @@ class Viewport(QWidget):
         # Set new mv_centre coordinates:
         self.cs.set_mv_centre_d((new_centre_dx, new_centre_dy))
         # Redraw viewport:
-        self.mv_draw()
+        self.mv_request_draw()
 
     def mv_shift_fov(self, shift_vector):
         dx, dy = shift_vector
@@ -1339,7 +1744,6 @@ class Viewport(QWidget):
                          self.ovm.get_ov_width_p(self.selected_ov),
                          self.ovm.get_ov_height_p(self.selected_ov))
         self.mv_qp.end()
-        self.mv_draw()
 
     def mv_reposition_imported_img(self, shift_vector):
         dx, dy = shift_vector
@@ -1393,44 +1797,16 @@ class Viewport(QWidget):
             grid_range = range(self.mv_current_grid, self.mv_current_grid + 1)
             selected_grid, selected_tile = self.mv_current_grid, None
 
+        mv_scale = self.cs.get_mv_scale()
         for grid_number in grid_range:
-            # Calculate origin of the tile map with respect to mosaic viewer
-            dx, dy = self.cs.get_grid_origin_d(grid_number)
-            mv_scale = self.cs.get_mv_scale()
-            pixel_size = self.gm.get_pixel_size(grid_number)
-            dx -= self.gm.get_tile_width_d(grid_number)/2
-            dy -= self.gm.get_tile_height_d(grid_number)/2
-            pixel_offset_x, pixel_offset_y = self.cs.convert_to_v((dx, dy))
-            cols = self.gm.get_number_cols(grid_number)
-            rows = self.gm.get_number_rows(grid_number)
-            overlap = self.gm.get_overlap(grid_number)
-            shift = (self.gm.get_row_shift(grid_number) * pixel_size
-                     / 1000 * mv_scale)
-            tile_width_p = self.gm.get_tile_width_p(grid_number)
-            tile_height_p = self.gm.get_tile_height_p(grid_number)
-            p_width = (((tile_width_p - overlap) * pixel_size)
-                       / 1000 * mv_scale)
-            p_height = (((tile_height_p - overlap) * pixel_size)
-                        / 1000 * mv_scale)
-            x, y = px - pixel_offset_x, py - pixel_offset_y
-            if x >= 0 and y >= 0:
-                j = y // p_height
-                if j % 2 == 0:
-                    i = x // p_width
-                elif x > shift:
-                    i = (x - shift) // p_width
-                else:
-                    i = cols
-                if (i < cols) and (j < rows):
-                    selected_tile = int(i + j * cols)
-                else:
-                    selected_tile = None
-                if selected_tile in range(
-                    self.gm.get_number_tiles(grid_number)):
-                    selected_grid = grid_number
-                    break
-                else:
-                    selected_tile = None
+            # Position relative to the origin of the tile map:
+            origin_vx, origin_vy = self.mv_get_grid_origin_v(grid_number)
+            x, y = px - origin_vx, py - origin_vy
+            selected_tile = self.mv_get_tile_index(grid_number).query_point(
+                x / mv_scale, y / mv_scale)
+            if selected_tile is not None:
+                selected_grid = grid_number
+                break
             # Also check whether grid label clicked:
             f = int(self.cs.get_mv_scale() * 8)
             if f < 12:
@@ -1556,9 +1932,19 @@ class Viewport(QWidget):
 # =================== Below: Slice Viewer (sv) functions ======================
 
     def sv_initialize(self):
-        self.slice_view_images = []
+        # Slices to be displayed, most recent first. Each slice is
+        # identified by (file_name, modification time):
+        self.slice_view_files = []
         self.slice_view_index = 0    # slice_view_index: 0..max_slices
         self.max_slices = 10  # default value
+        # Slices are loaded in the background:
+        self.slice_cache = SliceCache(self.SLICE_CACHE_BYTES,
+                                      self.SLICE_LOADER_THREADS)
+        self.slice_cache.loaded_trigger.s.connect(self.sv_slice_loaded)
+        # +1 when browsing backwards (to older slices), -1 forwards:
+        self.sv_browse_direction = 1
+        # Slice and level that sv_draw() is waiting for:
+        self.sv_waiting_for = None
 
         self.sv_current_grid = int(self.cfg['viewport']['sv_current_grid'])
         self.sv_current_tile = int(self.cfg['viewport']['sv_current_tile'])
@@ -1568,6 +1954,9 @@ class Viewport(QWidget):
 
         self.sv_measure_active = False
         self.sv_canvas = QPixmap(self.VIEWER_WIDTH, self.VIEWER_HEIGHT)
+        # Displayed images with saturated pixels marked, see
+        # sv_get_saturation_overlay():
+        self.sv_overlay_cache = OrderedDict()
         self.sv_qp = QPainter()
 
         self.pushButton_reloadSV.clicked.connect(self.sv_load_slices)
@@ -1605,7 +1994,7 @@ class Viewport(QWidget):
             self.sv_toggle_show_saturated_pixels)
 
         self.lcdNumber_sliceIndicator.display(0)
-        self.spinBox_maxSlices.setRange(1, 20)
+        self.spinBox_maxSlices.setRange(1, 100)
         self.spinBox_maxSlices.setSingleStep(1)
         self.spinBox_maxSlices.setValue(self.max_slices)
         self.spinBox_maxSlices.valueChanged.connect(self.sv_set_max_slices)
@@ -1656,24 +2045,16 @@ class Viewport(QWidget):
     def sv_slice_fwd(self):
         if self.slice_view_index < 0:
             self.slice_view_index += 1
+            self.sv_browse_direction = -1
             self.lcdNumber_sliceIndicator.display(self.slice_view_index)
-            # For now, disable showing saturated pixels (too slow)
-            if self.show_saturated_pixels:
-                self.checkBox_showSaturated.setChecked(False)
-                self.show_saturated_pixels = False
-                self.cfg['viewport']['show_saturated_pixels'] = 'False'
             self.sv_draw()
 
     def sv_slice_bwd(self):
         if (self.slice_view_index > (-1) * (self.max_slices-1)) and \
-           ((-1) * self.slice_view_index < len(self.slice_view_images)-1):
+           ((-1) * self.slice_view_index < len(self.slice_view_files)-1):
             self.slice_view_index -= 1
+            self.sv_browse_direction = 1
             self.lcdNumber_sliceIndicator.display(self.slice_view_index)
-            # For now, disable showing saturated pixels (too slow)
-            if self.show_saturated_pixels:
-                self.checkBox_showSaturated.setChecked(False)
-                self.show_saturated_pixels = False
-                self.cfg['viewport']['show_saturated_pixels'] = 'False'
             self.sv_draw()
 
     def sv_set_max_slices(self):
@@ -1710,11 +2091,6 @@ class Viewport(QWidget):
             new_offset_y = int(current_offset_y - ratio * dy + dy)
             self.cfg['viewport']['sv_offset_x_tile'] = str(new_offset_x)
             self.cfg['viewport']['sv_offset_y_tile'] = str(new_offset_y)
-        # For now, disable showing saturated pixels (too slow)
-        if self.show_saturated_pixels:
-            self.checkBox_showSaturated.setChecked(False)
-            self.show_saturated_pixels = False
-            self.cfg['viewport']['show_saturated_pixels'] = 'False'
         # Redraw viewport:
         self.sv_draw()
 
@@ -1794,46 +2170,27 @@ class Viewport(QWidget):
         return visible
 
     def sv_load_slices(self):
-        # Reading the tiff files from SmartSEM generates warnings. They
-        # are suppressed in the code below.
-        # First show a "waiting" info, since loading the image may take a while:
-        self.sv_qp.begin(self.sv_canvas)
-        self.sv_qp.setBrush(QColor(0, 0, 0))
-        if self.sv_instructions_displayed:
-            position_rect = QRect(150, 380, 700, 40)
-            self.sv_qp.setPen(QColor(0, 0, 0))
-            self.sv_qp.drawRect(position_rect)
-            self.sv_instructions_displayed = False
-
-        self.sv_qp.setPen(QColor(255, 255, 255))
-        position_rect = QRect(350, 380, 300, 40)
-        self.sv_qp.drawRect(position_rect)
-        self.sv_qp.drawText(position_rect,
-                            Qt.AlignVCenter | Qt.AlignHCenter,
-                            'Loading slices...')
-        self.sv_qp.end()
-        self.slice_viewer.setPixmap(self.sv_canvas)
-        QApplication.processEvents()
-        self.slice_view_images = []
+        """Collect the files of the most recent slices of the selected tile
+           or OV. The images are loaded in the background by the slice
+           cache; sv_draw() shows them as soon as they are available.
+        """
+        self.sv_instructions_displayed = False
+        self.slice_view_files = []
         self.slice_view_index = 0
+        self.sv_browse_direction = 1
         self.lcdNumber_sliceIndicator.display(0)
         start_slice = int(self.cfg['acq']['slice_counter'])
         base_dir = self.cfg['acq']['base_dir']
         stack_name = base_dir[base_dir.rfind('\\') + 1:]
 
-        slices_loaded = False
         if self.sv_current_ov >= 0:
             for i in range(0, -self.max_slices, -1):
                 filename = (base_dir + '\\'
                             + utils.get_ov_save_path(
                             stack_name, self.sv_current_ov, start_slice + i))
                 if os.path.isfile(filename):
-                    self.slice_view_images.append(QPixmap(filename))
-                    slices_loaded = True
-                    utils.suppress_console_warning()
-
-            self.sv_set_native_resolution()
-            self.sv_draw()
+                    self.slice_view_files.append(
+                        (filename, os.path.getmtime(filename)))
         elif self.sv_current_tile >= 0:
             selected_tile = self.gm.get_active_tiles(
                 self.sv_current_grid)[self.sv_current_tile]
@@ -1843,24 +2200,62 @@ class Viewport(QWidget):
                             stack_name, self.sv_current_grid, selected_tile,
                             start_slice + i))
                 if os.path.isfile(filename):
-                    slices_loaded = True
-                    self.slice_view_images.append(QPixmap(filename))
-                    utils.suppress_console_warning()
-            self.sv_set_native_resolution()
+                    self.slice_view_files.append(
+                        (filename, os.path.getmtime(filename)))
+
+        if self.slice_view_files:
             # Draw the current slice:
-            self.sv_draw()
+            self.sv_set_native_resolution()
+        else:
+            self.sv_canvas.fill(Qt.black)
+            self.sv_show_info('No images found')
 
-        if not slices_loaded:
-            self.sv_qp.begin(self.sv_canvas)
-            self.sv_qp.setPen(QColor(255, 255, 255))
-            self.sv_qp.setBrush(QColor(0, 0, 0))
-            position_rect = QRect(350, 380, 300, 40)
-            self.sv_qp.drawRect(position_rect)
-            self.sv_qp.drawText(position_rect,
-                                Qt.AlignVCenter | Qt.AlignHCenter,
-                                'No images found')
-            self.sv_qp.end()
-            self.slice_viewer.setPixmap(self.sv_canvas)
+    def sv_show_info(self, text):
+        self.sv_qp.begin(self.sv_canvas)
+        self.sv_qp.setPen(QColor(255, 255, 255))
+        self.sv_qp.setBrush(QColor(0, 0, 0))
+        position_rect = QRect(350, 380, 300, 40)
+        self.sv_qp.drawRect(position_rect)
+        self.sv_qp.drawText(position_rect,
+                            Qt.AlignVCenter | Qt.AlignHCenter,
+                            text)
+        self.sv_qp.end()
+        self.slice_viewer.setPixmap(self.sv_canvas)
+
+    def sv_get_level(self, resize_ratio):
+        """Return the coarsest downsampling level that still provides the
+           resolution needed for the given resize ratio.
+        """
+        level = 0
+        while (level < SliceCache.MAX_LEVEL
+               and resize_ratio * 2**(level + 1) <= 1):
+            level += 1
+        return level
+
+    def sv_prefetch(self, level):
+        """Request the current slice and its neighbours (mostly in the
+           browsing direction) at the specified level. Jobs for other
+           slices that have not started yet are cancelled.
+        """
+        current = -self.slice_view_index
+        positions = [current]
+        for k in range(1, self.SV_PREFETCH_SLICES + 1):
+            positions.append(current + k * self.sv_browse_direction)
+        positions.append(current - self.sv_browse_direction)
+        slice_keys = [(self.slice_view_files[i], level) for i in positions
+                      if 0 <= i < len(self.slice_view_files)]
+        self.slice_cache.cancel_pending(slice_keys)
+        for slice_id, level in slice_keys:
+            self.slice_cache.request(slice_id, level)
+
+    def sv_slice_loaded(self):
+        # Reading the tiff files from SmartSEM generates warnings:
+        utils.suppress_console_warning()
+        # Redraw if the image that is waited for has been loaded:
+        if (self.sv_waiting_for is not None
+                and self.slice_cache.get(*self.sv_waiting_for) is not None):
+            self.sv_waiting_for = None
+            self.sv_request_draw()
 
     def sv_set_native_resolution(self):
         if self.sv_current_ov >= 0:
@@ -1931,7 +2326,24 @@ class Viewport(QWidget):
             tile_pixel_size = self.gm.get_pixel_size(self.sv_current_grid)
             resize_ratio = tile_pixel_size / viewport_pixel_size
 
-        if len(self.slice_view_images) > 0:
+        current_image = None
+        if len(self.slice_view_files) > 0:
+            slice_id = self.slice_view_files[-self.slice_view_index]
+            level = self.sv_get_level(resize_ratio)
+            self.sv_prefetch(level)
+            # Show the closest available level until the requested level
+            # has been loaded:
+            current_image, current_level = self.slice_cache.get_closest(
+                slice_id, level)
+            if current_level == level:
+                self.sv_waiting_for = None
+            else:
+                self.sv_waiting_for = (slice_id, level)
+
+        if current_image is None:
+            if len(self.slice_view_files) > 0:
+                self.sv_show_info('Loading slice...')
+        else:
             self.sv_qp.begin(self.sv_canvas)
             offset_x = 0
             offset_y = 0
@@ -1942,42 +2354,26 @@ class Viewport(QWidget):
                 offset_x = int(self.cfg['viewport']['sv_offset_x_tile'])
                 offset_y = int(self.cfg['viewport']['sv_offset_y_tile'])
 
-            current_image = self.slice_view_images[-self.slice_view_index]
-
-            w_px = current_image.size().width()
-            h_px = current_image.size().height()
+            # Downsampled images must be enlarged by 2**level:
+            level_ratio = resize_ratio * 2**current_level
+            w_px = current_image.width()
+            h_px = current_image.height()
 
             visible, crop_area, vx, vy = self.mv_calculate_visible_area(
-                offset_x, offset_y, w_px, h_px, resize_ratio)
+                offset_x, offset_y, w_px, h_px, level_ratio)
             display_img = current_image.copy(crop_area)
 
             # Resize according to scale factor:
-            current_width = display_img.size().width()
+            current_width = display_img.width()
             display_img = display_img.scaledToWidth(
-                current_width * resize_ratio)
+                current_width * level_ratio)
 
             # Show saturated pixels?
             if self.cfg['viewport']['show_saturated_pixels'] == 'True':
-                width = display_img.size().width()
-                height = display_img.size().height()
-                img = display_img.toImage()
-                # Black:
-                black_pixels = [QColor(0, 0, 0).rgb(),
-                                QColor(1, 1, 1).rgb()]
-                white_pixels = [QColor(255, 255, 255).rgb(),
-                                QColor(254, 254, 254).rgb()]
-                blue_pixel = QColor(0, 0, 255).rgb()
-                red_pixel = QColor(255, 0, 0).rgb()
-                for x in range(0, width):
-                    for y in range(0, height):
-                        pixel_value = img.pixel(x, y)
-                        if pixel_value in black_pixels:
-                            img.setPixel(x, y, blue_pixel)
-                        if pixel_value in white_pixels:
-                            img.setPixel(x, y, red_pixel)
-                display_img = QPixmap.fromImage(img)
-
-            self.sv_qp.drawPixmap(vx, vy, display_img)
+                display_img = self.sv_get_saturation_overlay(
+                    current_image.cacheKey(), crop_area, display_img)
+
+            self.sv_qp.drawImage(vx, vy, display_img)
             # Measuring tool:
             if self.sv_measure_active:
                 self.sv_qp.setPen(QPen(QColor(255, 165, 0), 2, Qt.SolidLine))
@@ -2027,6 +2423,50 @@ class Viewport(QWidget):
                 '{0:.2f} µm × '.format(self.VIEWER_WIDTH / self.sv_scale_tile)
                 + '{0:.2f} µm'.format(self.VIEWER_HEIGHT / self.sv_scale_tile))
 
+    def sv_get_saturation_lut(self, low, high):
+        """Return a colour table that maps grey values at or below the low
+           threshold to blue, at or above the high threshold to red, and all
+           other values to grey.
+        """
+        blue_pixel = QColor(0, 0, 255).rgb()
+        red_pixel = QColor(255, 0, 0).rgb()
+        lut = []
+        for value in range(256):
+            if value <= low:
+                lut.append(blue_pixel)
+            elif value >= high:
+                lut.append(red_pixel)
+            else:
+                lut.append(QColor(value, value, value).rgb())
+        return lut
+
+    def sv_get_saturation_overlay(self, image_key, crop_area, display_img):
+        """Return display_img (cropped and scaled slice) with saturated
+           pixels marked. The grey values are not changed pixel by pixel:
+           the image buffer is reinterpreted as an indexed image with a
+           colour table. Results are cached per slice, crop area and scale.
+        """
+        low = int(self.cfg['viewport']['saturation_low_threshold'])
+        high = int(self.cfg['viewport']['saturation_high_threshold'])
+        key = (image_key, crop_area.x(), crop_area.y(),
+               crop_area.width(), crop_area.height(),
+               display_img.width(), low, high)
+        if key in self.sv_overlay_cache:
+            self.sv_overlay_cache.move_to_end(key)
+            return self.sv_overlay_cache[key]
+        grey_img = display_img.convertToFormat(QImage.Format_Grayscale8)
+        # Indexed image that shares the buffer of grey_img:
+        indexed_img = QImage(grey_img.bits(), grey_img.width(),
+                             grey_img.height(), grey_img.bytesPerLine(),
+                             QImage.Format_Indexed8)
+        indexed_img.setColorTable(self.sv_get_saturation_lut(low, high))
+        # The conversion copies the data while grey_img is still alive:
+        overlay = indexed_img.convertToFormat(QImage.Format_RGB32)
+        self.sv_overlay_cache[key] = overlay
+        if len(self.sv_overlay_cache) > self.SV_OVERLAY_CACHE_SIZE:
+            self.sv_overlay_cache.popitem(last=False)
+        return overlay
+
     def sv_shift_fov(self, shift_vector):
         (dx, dy) = shift_vector
         if self.sv_current_ov >= 0:
@@ -2324,7 +2764,7 @@ class Viewport(QWidget):
                         + '\\workspace\\reslices\\r_' + tile_key + '.png')
         canvas = self.reslice_canvas_template.copy()
         if filename is not None and os.path.isfile(filename):
-            current_reslice = QPixmap(filename)
+            current_reslice = load_pixmap(filename)
             self.m_qp.begin(canvas)
             self.m_qp.setPen(QColor(0, 0, 0))
             self.m_qp.setBrush(QColor(0, 0, 0))
@@ -2378,29 +2818,12 @@ class Viewport(QWidget):
         slice_number_list = []
         mean_list = []
         stddev_list = []
-        filename = None
-        if self.m_current_ov >= 0:
-            # get current data:
-            filename = (self.cfg['acq']['base_dir']
-                        + '\\meta\\stats\\OV'
-                        + str(self.m_current_ov).zfill(utils.OV_DIGITS)
-                        + '.dat')
-        elif self.m_current_tile >= 0:
-            tile_number = self.gm.get_active_tiles(
-                self.m_current_grid)[self.m_current_tile]
-            tile_key = ('g' + str(self.m_current_grid).zfill(utils.GRID_DIGITS)
-                        + '_t' + str(tile_number).zfill(utils.TILE_DIGITS))
-            filename = (self.cfg['acq']['base_dir']
-                        + '\\meta\\stats\\' + tile_key + '.dat')
-        if filename is not None and os.path.isfile(filename):
-            with open(filename, 'r') as file:
-                for line in file:
-                    values_str = line.split(';')
-                    values = [x for x in values_str]
-                    slice_number_list.append(int(values[0]))
-                    mean_list.append(float(values[1]))
-                    stddev_list.append(float(values[2]))
-            # Shorten the lists to last 150 entries if larger than 150:
+        source_key = self.m_get_source_key()
+        if source_key is not None:
+            slice_number_list, mean_list, stddev_list = (
+                self.m_get_stats(source_key))
+        if mean_list:
+            # Shorten the lists to last 165 entries if larger than 165:
             N = len(mean_list)
             if N > 165:
                 mean_list = mean_list[-165:]
@@ -2559,58 +2982,89 @@ class Viewport(QWidget):
             self.plots_view.setPixmap(self.plots_canvas_template)
             self.m_tab_populated = False
 
+    def m_get_source_key(self):
+        """Return the key of the selected tile or OV as used for the
+           statistics files, or None.
+        """
+        if self.m_current_ov >= 0:
+            return 'OV' + str(self.m_current_ov).zfill(utils.OV_DIGITS)
+        elif self.m_current_tile >= 0:
+            tile_number = self.gm.get_active_tiles(
+                self.m_current_grid)[self.m_current_tile]
+            return ('g' + str(self.m_current_grid).zfill(utils.GRID_DIGITS)
+                    + '_t' + str(tile_number).zfill(utils.TILE_DIGITS))
+        return None
+
+    def m_get_stats(self, source_key):
+        """Get the current stats from memory. The stats file is only read
+           if the data is not available in memory.
+        """
+        stats_filename = (self.cfg['acq']['base_dir']
+                          + '\\meta\\stats\\' + source_key + '.dat')
+        return self.monitoring_history.get_stats(source_key, stats_filename)
+
+    def m_get_histogram_from_stack(self):
+        """Return slice number and histogram of the selected slice of the
+           selected tile/OV. The histogram is taken from memory if
+           available, otherwise it is calculated from the image on disk.
+        """
+        source_key = self.m_get_source_key()
+        if source_key is None:
+            return None, None
+        # Make sure that the stats are loaded:
+        self.m_get_stats(source_key)
+        slice_number = self.m_selected_slice_number
+        if slice_number is None:
+            slice_number = self.monitoring_history.get_last_slice_number(
+                source_key)
+        if slice_number is None:
+            return None, None
+        hist = self.monitoring_history.get_histogram(source_key, slice_number)
+        if hist is None:
+            # Fall back to the image file:
+            base_dir = self.cfg['acq']['base_dir']
+            stack_name = base_dir[base_dir.rfind('\\') + 1:]
+            if self.m_current_ov >= 0:
+                selected_file = (base_dir + '\\' + utils.get_ov_save_path(
+                    stack_name, self.m_current_ov, slice_number))
+            else:
+                tile_number = self.gm.get_active_tiles(
+                    self.m_current_grid)[self.m_current_tile]
+                selected_file = (base_dir + '\\' + utils.get_tile_save_path(
+                    stack_name, self.m_current_grid, tile_number,
+                    slice_number))
+            if not os.path.isfile(selected_file):
+                return None, None
+            try:
+                hist = get_histogram(read_image(selected_file))
+            except:
+                return None, None
+            self.monitoring_history.set_histogram(
+                source_key, slice_number, hist)
+        return slice_number, hist
+
     def m_draw_histogram(self):
         base_dir = self.cfg['acq']['base_dir']
-        selected_file = ''
         slice_number = None
+        hist = None
         if self.m_from_stack:
-            success = False
-            path = ''
-            if self.m_current_ov >= 0:
-                path = (base_dir + '\\overviews\\ov'
-                        + str(self.m_current_ov).zfill(utils.OV_DIGITS))
-
-            elif self.m_current_tile >= 0:
+            slice_number, hist = self.m_get_histogram_from_stack()
+            if self.m_current_tile >= 0:
                 tile_number = self.gm.get_active_tiles(
                     self.m_current_grid)[self.m_current_tile]
-                path = (base_dir + '\\tiles\\g'
-                        + str(self.m_current_grid).zfill(utils.GRID_DIGITS)
-                        + '\\t' + str(tile_number).zfill(utils.TILE_DIGITS))
-
-            if os.path.exists(path):
-                filenames = next(os.walk(path))[2]
-                if len(filenames) > 165:
-                    filenames = filenames[-165:]
-                if filenames:
-                    if self.m_selected_slice_number is None:
-                        selected_file = path + '\\' + filenames[-1]
-                    else:
-                        slice_number_str = (
-                            's' + str(self.m_selected_slice_number).zfill(
-                                utils.SLICE_DIGITS))
-                        for filename in filenames:
-                            if slice_number_str in filename:
-                                selected_file = path + '\\' + filename
-                                break
-
         else:
             # Use current image in SmartSEM
             selected_file = base_dir + '\\workspace\\current_frame.tif'
             self.sem.save_frame(selected_file)
             self.m_reset_view()
             self.m_tab_populated = False
-
-        if os.path.isfile(selected_file):
-            img = np.array(Image.open(selected_file))
-            success = True
+            if os.path.isfile(selected_file):
+                hist = get_histogram(read_image(selected_file))
 
         canvas = self.histogram_canvas_template.copy()
-        if success:
+        if hist is not None:
             # calculate mean and SD:
-            mean = np.mean(img)
-            stddev = np.std(img)
-            #Full histogram:
-            hist, bin_edges = np.histogram(img, 256, [0, 256])
+            mean, stddev = get_mean_stddev(hist)
 
             hist_max = hist.max()
             peak = -1
@@ -2624,11 +3078,6 @@ class Viewport(QWidget):
                 self.m_qp.drawLine(x + 11, 160,
                                    x + 11, 160 - gv_normalized * 147)
             if self.m_from_stack:
-                try:
-                    idx = selected_file.rfind('s')
-                    slice_number = int(selected_file[idx+1:idx+6])
-                except:
-                    slice_number = -1
                 if self.m_current_ov >= 0:
                     self.m_qp.drawText(
                         280, 50,